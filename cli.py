@@ -0,0 +1,303 @@
+"""
+cli.py — Headless command-line entry point (no Qt).
+
+Runs the same pipeline as the GUI buttons from a terminal or cron job:
+
+    python cli.py download [--data-dir data]
+    python cli.py graphs   --csv FILE --output DIR [--workers N] [--html-mode MODE]
+    python cli.py map      --csv FILE --output DIR [--engine leaflet] [--charts sidecar] ...
+    python cli.py all      --output DIR [--csv FILE] [graph and map options]
+    python cli.py backfill --csv FILE --output DIR [--from YYYYMM] [--to YYYYMM] [--workers N]
+    python cli.py watch    --output DIR [--dir data] [--once] [--concurrency N] [--queue-size N]
+
+'all' downloads the database (skipped when --csv is given) and renders the
+graphs and the map from it. 'backfill' renders one run folder per past month
+of the archive and prints each month's throughput. 'watch' runs the
+watch-folder service (watch_folder.py) until Ctrl+C. Stage modules are
+imported only when their stage runs, so 'download' never loads
+matplotlib/bokeh/folium, and PyQt6 is never imported. Progress is printed
+every 10 %; startup, import and run times of each stage are printed as they
+finish, and 'graphs'/'all' end with the per-stage timings of the render
+pipeline (graph_generation.PipelineStats). Exit status: 0 on success, 1 when
+a stage fails, 2 for invalid arguments (including unknown mode names).
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+_T0 = time.perf_counter()
+
+# Off-screen rendering; inherited by the graph rendering processes
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+
+# Option values of the stage modules, copied so that parsing the command line
+# does not import bokeh/folium; dev/test_suite.py [22] checks they still match.
+HTML_MODES = ("standalone", "shared", "dashboard")       # data_processing.HTML_MODES
+MAP_ENGINES = ("folium", "leaflet")                      # map_viewer.MAP_ENGINES
+LAYER_MODES = ("layers", "restyle")                      # map_viewer.LAYER_MODES
+CHART_MODES = ("inline", "sidecar")                      # map_viewer.CHART_MODES
+SPARKLINE_BACKENDS = ("matplotlib", "pillow")            # map_viewer.SPARKLINE_BACKENDS
+
+
+class StageError(Exception):
+    """A pipeline stage could not complete (message is shown to the user)."""
+
+
+class _Progress:
+    """Prints a progress line each time another `step` percent is reached."""
+
+    def __init__(self, label, step=10):
+        self.label = label
+        self.step = step
+        self._next = step
+
+    def percent(self, value):
+        if value >= self._next:
+            print(f"  {self.label}: {value}%", flush=True)
+            self._next = (value // self.step + 1) * self.step
+
+    def download(self, info):
+        """download_database progress callback (see TransferStats)."""
+        if not info["total"]:
+            if info["done"]:
+                print(f"  {self.label}: {info['bytes'] / 1e6:.1f} MB", flush=True)
+            return
+        value = int(100 * info["bytes"] / info["total"])
+        if value >= self._next or info["done"]:
+            print(f"  {self.label}: {value}% de {info['total'] / 1e6:.1f} MB, "
+                  f"{info['mb_per_s']:.2f} MB/s", flush=True)
+            self._next = (value // self.step + 1) * self.step
+
+
+def _timed_import(stage):
+    """Import the modules of one stage; returns (modules, seconds)."""
+    start = time.perf_counter()
+    if stage == "download":
+        import download_database
+        modules = (download_database,)
+    elif stage == "graphs":
+        import graph_generation
+        modules = (graph_generation,)
+    else:
+        import map_viewer
+        modules = (map_viewer,)
+    return modules, time.perf_counter() - start
+
+
+def run_download(args, timings):
+    (download_database,), import_s = _timed_import("download")
+    start = time.perf_counter()
+    result = download_database.update_database(args.data_dir, progress=_Progress("descarga").download)
+    if result is None:
+        raise StageError("No se pudo descargar la base de datos (ver registro).")
+    elapsed = time.perf_counter() - start
+    timings.append(("descarga", import_s, elapsed))
+    state = "actualizada" if result["changed"] else "sin cambios"
+    print(f"[descarga] {state}: {result['path']} "
+          f"({result['data_start']}–{result['data_end']}) "
+          f"— {elapsed:.2f} s, importación {import_s:.2f} s", flush=True)
+    return result["path"]
+
+
+def run_graphs(args, csv_path, timings):
+    (graph_generation,), import_s = _timed_import("graphs")
+    start = time.perf_counter()
+    stats = graph_generation.PipelineStats()
+    run_folder = graph_generation.generate_graphs(
+        args.output, csv_path, workers=args.workers, html_mode=args.html_mode,
+        progress=_Progress("gráficas").percent, incremental=not args.full, stats=stats,
+    )
+    elapsed = time.perf_counter() - start
+    timings.append(("gráficas", import_s, elapsed))
+    print(f"[gráficas] {run_folder} — {elapsed:.2f} s, importación {import_s:.2f} s", flush=True)
+    _print_stages(stats.record())
+    return run_folder
+
+
+def _print_stages(record):
+    """Per-stage table of a PipelineStats record (skipped when nothing was rendered)."""
+    if not any(entry["items"] for entry in record.values()):
+        return
+    print(f"  {'etapa':<10} {'estaciones':>10} {'trabajo':>9} {'espera ent.':>12} {'espera sal.':>12}")
+    for stage, entry in record.items():
+        print(f"  {stage:<10} {entry['items']:>10} {entry['busy_s']:>8.2f}s "
+              f"{entry['wait_in_s']:>11.2f}s {entry['wait_out_s']:>11.2f}s")
+
+
+def run_backfill(args, timings):
+    (graph_generation,), import_s = _timed_import("graphs")
+    start = time.perf_counter()
+
+    def on_month(result):
+        if "error" in result:
+            print(f"[{result['month']}] error: {result['error']}", flush=True)
+            return
+        print(f"[{result['month']}] {result['stations']} estaciones — {result['seconds']:.2f} s "
+              f"({result['stations_per_s']:.1f} est/s) → {result['run_folder']}", flush=True)
+
+    failure = None
+    try:
+        results = graph_generation.backfill_graphs(
+            args.output, args.csv, start=args.start, end=args.end, workers=args.workers,
+            html_mode=args.html_mode, on_month=on_month,
+        )
+    except graph_generation.BackfillError as e:
+        # Report the months that did render before exiting with the error
+        results, failure = e.results, e
+    elapsed = time.perf_counter() - start
+    timings.append(("histórico", import_s, elapsed))
+    stations = sum(r["stations"] for r in results)
+    print(f"[histórico] {len(results)} meses, {stations} gráficas de estación — {elapsed:.2f} s "
+          f"({stations / elapsed if elapsed else 0:.1f} est/s), importación {import_s:.2f} s", flush=True)
+    if failure is not None:
+        raise failure
+    return results
+
+
+def run_watch(args):
+    import threading
+    from watch_folder import WatchService
+
+    service = WatchService(
+        args.dir, args.output, interval=args.interval, settle_seconds=args.settle,
+        concurrency=args.concurrency, queue_size=args.queue_size, render_workers=args.workers,
+        html_mode=args.html_mode, map_engine=args.engine,
+    )
+    print(f"[vigilancia] {os.path.abspath(args.dir)} → {os.path.abspath(args.output)} "
+          f"(estado: {service.status_path})", flush=True)
+    try:
+        service.run(threading.Event(), once=args.once)
+    except KeyboardInterrupt:
+        print("[vigilancia] detenido", flush=True)
+    done = [job for job in service.jobs.values() if job["status"] == "done"]
+    failed = [job for job in service.jobs.values() if job["status"] == "failed"]
+    print(f"[vigilancia] {len(done)} archivos procesados, {len(failed)} con error", flush=True)
+    if failed:
+        raise StageError(f"{len(failed)} archivos con error (ver {service.status_path})")
+
+
+def run_map(args, csv_path, timings):
+    (map_viewer,), import_s = _timed_import("map")
+    start = time.perf_counter()
+    summary = map_viewer.build_station_summary(csv_path)
+    history = map_viewer.build_station_history(csv_path)
+    map_path = map_viewer.generate_map(
+        summary, args.output, history,
+        layer_mode=args.layer_mode, engine=args.engine, charts=args.charts,
+        sparkline_backend=args.sparkline_backend, rain_surface=args.rain_surface,
+    )
+    elapsed = time.perf_counter() - start
+    timings.append(("mapa", import_s, elapsed))
+    print(f"[mapa] {len(summary)} estaciones → {map_path} — {elapsed:.2f} s, "
+          f"importación {import_s:.2f} s", flush=True)
+    return map_path
+
+
+def build_parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("-v", "--verbose", action="store_true", help="registro INFO en stderr")
+
+    download = argparse.ArgumentParser(add_help=False)
+    download.add_argument("--data-dir", default="data",
+                          help="carpeta de la base descargada (por defecto: data)")
+
+    output = argparse.ArgumentParser(add_help=False)
+    output.add_argument("--output", required=True, help="carpeta de salida")
+
+    graphs = argparse.ArgumentParser(add_help=False)
+    graphs.add_argument("--workers", type=int, default=None,
+                        help="procesos de renderizado (por defecto: uno por CPU)")
+    graphs.add_argument("--html-mode", default="standalone", choices=HTML_MODES,
+                        help="páginas HTML por estación (por defecto: standalone)")
+    full = argparse.ArgumentParser(add_help=False)
+    full.add_argument("--full", action="store_true",
+                      help="volver a generar todas las estaciones (sin reutilizar ejecuciones previas)")
+
+    maps = argparse.ArgumentParser(add_help=False)
+    maps.add_argument("--engine", default="folium", choices=MAP_ENGINES,
+                      help="motor del mapa (por defecto: folium)")
+    maps.add_argument("--layer-mode", default="layers", choices=LAYER_MODES,
+                      help="capas de variables (por defecto: layers)")
+    maps.add_argument("--charts", default="inline", choices=CHART_MODES,
+                      help="gráficas de las ventanas emergentes (por defecto: inline)")
+    maps.add_argument("--sparkline-backend", default="matplotlib", choices=SPARKLINE_BACKENDS,
+                      help="dibujo de las miniaturas (por defecto: matplotlib)")
+    maps.add_argument("--rain-surface", action="store_true",
+                      help="añadir la capa de lluvia interpolada (IDW)")
+
+    parser = argparse.ArgumentParser(
+        prog="cli.py",
+        description="Generador de Gráficas Mensual — modo por lotes sin interfaz gráfica.",
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("download", parents=[common, download],
+                   help="descargar la base de datos (solo si cambió)")
+    p = sub.add_parser("graphs", parents=[common, output, graphs, full], help="generar las gráficas")
+    p.add_argument("--csv", required=True, help="CSV a procesar")
+    p = sub.add_parser("map", parents=[common, output, maps], help="generar el mapa de estaciones")
+    p.add_argument("--csv", required=True, help="CSV a procesar")
+    p = sub.add_parser("all", parents=[common, download, output, graphs, full, maps],
+                       help="descarga + gráficas + mapa")
+    p.add_argument("--csv", default=None, help="CSV a procesar (omite la descarga)")
+    p = sub.add_parser("backfill", parents=[common, output, graphs],
+                       help="generar las gráficas de cada mes del archivo")
+    p.add_argument("--csv", required=True, help="CSV histórico")
+    p.add_argument("--from", dest="start", default=None, help="primer mes AAAAMM (por defecto: el primero)")
+    p.add_argument("--to", dest="end", default=None, help="último mes AAAAMM (por defecto: el último)")
+    p = sub.add_parser("watch", parents=[common, output, graphs],
+                       help="vigilar una carpeta y procesar cada exportación nueva")
+    p.add_argument("--dir", default="data", help="carpeta vigilada (por defecto: data)")
+    p.add_argument("--engine", default="folium", choices=MAP_ENGINES,
+                   help="motor del mapa (por defecto: folium)")
+    p.add_argument("--interval", type=float, default=2.0, help="segundos entre revisiones")
+    p.add_argument("--settle", type=float, default=5.0,
+                   help="segundos sin cambios antes de procesar un archivo")
+    p.add_argument("--concurrency", type=int, default=1, help="trabajos simultáneos")
+    p.add_argument("--queue-size", type=int, default=8, help="trabajos en cola como máximo")
+    p.add_argument("--once", action="store_true",
+                   help="procesar los archivos presentes y terminar")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(
+        level=logging.INFO if args.verbose or args.command == "watch" else logging.WARNING,
+        format='%(asctime)s %(levelname)s %(module)s: %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S',
+    )
+    print(f"arranque: {time.perf_counter() - _T0:.2f} s", flush=True)
+
+    timings = []
+    start = time.perf_counter()
+    try:
+        csv_path = getattr(args, "csv", None)
+        if args.command == "backfill":
+            run_backfill(args, timings)
+        if args.command == "watch":
+            run_watch(args)
+        if args.command == "download" or (args.command == "all" and not csv_path):
+            csv_path = run_download(args, timings)
+        if args.command in ("graphs", "all"):
+            run_graphs(args, csv_path, timings)
+        if args.command in ("map", "all"):
+            run_map(args, csv_path, timings)
+    except (StageError, ValueError, OSError, KeyError, RuntimeError) as e:
+        # KeyError (a CSV without a required column) quotes its message in str()
+        message = e.args[0] if isinstance(e, KeyError) and e.args else e
+        print(f"error: {message}", file=sys.stderr, flush=True)
+        return 1
+    finally:
+        if len(timings) > 1:
+            for stage, import_s, elapsed in timings:
+                print(f"  {stage:<9} {elapsed:8.2f} s  (importación {import_s:.2f} s)")
+        print(f"total: {time.perf_counter() - start:.2f} s", flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,779 @@
+"""
+data_loader.py
+
+Parse-once loading layer for INSIVUMEH meteorological CSV exports.
+
+Every consumer (graphs, map, download step) reads the CSV through
+load_dataset(). The first call parses the CSV — including the 'fecha'
+conversion — and writes a typed columnar copy (one .npy file per column)
+into a cache folder next to the CSV. Later calls for the same file load the
+binary columns instead of re-parsing the text.
+
+Only the columns listed in COLUMN_SETS are ever read (pd.read_csv usecols):
+measurements are float32 and station names/IDs are 'category', so the
+unused Unnamed: 0 / eva_* / tsuelo_* / Fenomenos/* columns never reach memory.
+
+Steps that only need the last WINDOW_DAYS days use read_last_days(), which
+reads the file backwards in blocks and stops at the cutoff date instead of
+parsing the whole archive.
+
+The download step feeds the bytes it receives to a StreamingIngest, which
+parses them block by block while the transfer runs and writes the cache
+entry as soon as the file is complete.
+
+Inputs
+------
+- CSV file path  : insivumeh_YYYYMMDD_YYYYMM_a_YYYYMM.csv  (YYYY-MM-DD dates)
+                   or database.csv (DD/MM/YYYY dates)
+
+Outputs
+-------
+- <csv_dir>/_cache/<key>/meta.json      : column order, dtypes, source file
+- <csv_dir>/_cache/<key>/<n>.npy        : one array per column
+
+Cache key
+---------
+File size + modification time + a hash of the first and last 64 KB. The
+path is deliberately left out of the key so that renaming the downloaded
+_download_temp.csv to its final insivumeh_*.csv name (os.replace keeps
+size and mtime) reuses the cache written during the download step.
+"""
+
+import hashlib
+import importlib.util
+import io
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+
+CACHE_DIRNAME = "_cache"
+CACHE_VERSION = 2
+
+# Bytes hashed from each end of the file when building the cache key
+_KEY_SAMPLE_BYTES = 65536
+
+# Length of the "last N days" window shown by the graphs and the map
+WINDOW_DAYS = 30
+
+# Block size used by read_last_days() when scanning backwards from the end
+TAIL_BLOCK_BYTES = 1 << 20
+
+# Samples read_last_days() takes across the rest of the file (head first) to
+# check it is date-ordered before trusting the tail, and their size in bytes
+ORDER_PROBES = 16
+ORDER_PROBE_BYTES = 4096
+
+# Complete lines StreamingIngest buffers before parsing them as one block
+INGEST_BLOCK_BYTES = 4 << 20
+
+# ── Schema ───────────────────────────────────────────────────────────────────
+# Columns each consumer needs. Station-ID columns differ between CSV variants
+# ('ID' in insivumeh_*.csv, 'estacion' in database.csv); columns absent from a
+# file are simply skipped.
+COLUMN_SETS: dict = {
+    "graphs": ["fecha", "Nombre", "lluvia", "tmin", "tseca", "tmax", "hum_rel"],
+    "map_summary": [
+        "fecha", "Nombre", "ID", "estacion", "lluvia", "tseca", "tmin", "tmax",
+        "hum_rel", "vel_viento", "dir_viento", "Latitud", "Longitud", "Altitud",
+    ],
+    "map_history": ["fecha", "Nombre", "lluvia", "tseca", "tmin", "tmax", "hum_rel"],
+    "dates": ["fecha"],
+}
+
+# Union of all consumer sets, in a stable order — this is what the cache holds
+SCHEMA_COLUMNS: list = list(dict.fromkeys(c for cols in COLUMN_SETS.values() for c in cols))
+
+MEASUREMENT_COLUMNS = ("lluvia", "tmin", "tseca", "tmax", "hum_rel", "vel_viento", "dir_viento")
+CATEGORY_COLUMNS = ("Nombre", "ID", "estacion")
+
+# Coordinates stay float64: float32 would round station positions by ~1 m.
+# 'fecha' is read as category so the parser de-duplicates the day strings and
+# parse_fecha() works on the categories only
+SCHEMA_DTYPES: dict = {
+    "fecha": "category",
+    **{c: "float32" for c in MEASUREMENT_COLUMNS},
+    **{c: "category" for c in CATEGORY_COLUMNS},
+    "Latitud": "float64", "Longitud": "float64", "Altitud": "float64",
+}
+
+# pyarrow's multithreaded CSV reader is used when installed; the C engine otherwise
+DEFAULT_ENGINE = "pyarrow" if importlib.util.find_spec("pyarrow") else "c"
+
+
+# ── Date handling ────────────────────────────────────────────────────────────
+
+def detect_date_format(sample: str) -> str:
+    """
+    Return the strptime format string that matches an INSIVUMEH fecha sample value.
+
+    Kept for callers that format or parse single values; whole columns are
+    converted with parse_fecha(), which detects the layout per distinct value.
+
+    Supports:
+      - YYYY-MM-DD  (insivumeh_*.csv — primary download file)
+      - DD/MM/YYYY  (database.csv   — local historical copy)
+
+    Args:
+        sample: A single non-null value from the 'fecha' column, as a string.
+
+    Returns:
+        A strptime format string: '%Y-%m-%d' or '%d/%m/%Y'.
+    """
+    s = str(sample).strip()
+    return "%Y-%m-%d" if len(s) >= 10 and s[4] == "-" else "%d/%m/%Y"
+
+
+# Date layouts found in INSIVUMEH exports; DD/MM/YYYY also matches unpadded D/M/YYYY
+_ISO_DATE = r"^\s*(?P<year>\d{4})-(?P<month>\d{1,2})-(?P<day>\d{1,2})"
+_DMY_DATE = r"^\s*(?P<day>\d{1,2})/(?P<month>\d{1,2})/(?P<year>\d{4})"
+
+
+def parse_fecha(fecha: pd.Series) -> pd.Series:
+    """
+    Convert a raw 'fecha' column to datetime64, parsing each distinct value once.
+
+    An archive has millions of rows but only a few thousand distinct days, so
+    the column is factorised (or its categorical codes are used directly),
+    only the unique strings are parsed, and the results are mapped back to
+    the rows through the codes. The layout is detected per unique value with
+    vectorised regexes, so files mixing these formats parse correctly:
+
+      - YYYY-MM-DD  (insivumeh_*.csv — primary download file)
+      - DD/MM/YYYY  (database.csv   — local historical copy)
+      - D/M/YYYY    (onestation.csv, shortscv.csv — unpadded day/month)
+
+    Args:
+        fecha: Raw 'fecha' values (strings or categorical of strings).
+
+    Returns:
+        pd.Series of datetime64 aligned with fecha; missing values become NaT.
+
+    Raises:
+        ValueError: if a non-empty value matches none of the layouts.
+    """
+    if isinstance(fecha.dtype, pd.CategoricalDtype):
+        codes = fecha.cat.codes.to_numpy()
+        uniques = pd.Series(fecha.cat.categories.astype(str))
+    elif pd.api.types.is_datetime64_any_dtype(fecha):
+        return fecha
+    else:
+        codes, uniques = pd.factorize(fecha)
+        uniques = pd.Series(uniques).astype(str)
+
+    iso = uniques.str.extract(_ISO_DATE)
+    dmy = uniques.str.extract(_DMY_DATE)
+    parts = iso.fillna(dmy).astype(float)
+    parsed = pd.to_datetime(parts[["year", "month", "day"]], errors="coerce")
+
+    bad = parsed.isna() & uniques.str.strip().ne("")
+    if bad.any():
+        raise ValueError(
+            f"Unrecognised fecha values (expected YYYY-MM-DD or DD/MM/YYYY): "
+            f"{uniques[bad].head(5).tolist()}"
+        )
+
+    # Code -1 (missing) indexes the NaT appended at the end
+    lookup = np.append(parsed.to_numpy(), np.datetime64("NaT"))
+    return pd.Series(lookup[codes], index=fecha.index, name=fecha.name)
+
+
+# ── Typed CSV parsing ─────────────────────────────────────────────────────────
+
+def resolve_columns(columns) -> list:
+    """
+    Turn a consumer name from COLUMN_SETS, a column list or None into a list.
+
+    None means every column in SCHEMA_COLUMNS.
+    """
+    if columns is None:
+        return list(SCHEMA_COLUMNS)
+    if isinstance(columns, str):
+        try:
+            return list(COLUMN_SETS[columns])
+        except KeyError:
+            raise ValueError(
+                f"Unknown column set '{columns}'. Expected one of: {sorted(COLUMN_SETS)}"
+            ) from None
+    return list(columns)
+
+
+def read_csv(csv_path: str, columns=None, engine: str = None) -> pd.DataFrame:
+    """
+    Parse an INSIVUMEH CSV from text with pruned columns and compact dtypes.
+
+    This is the slow path used to populate the cache; callers should use
+    load_dataset() instead. The memory report is attached as
+    df.attrs["load_report"] (see memory_report()).
+
+    Args:
+        csv_path: Path to the CSV file.
+        columns:  Consumer name from COLUMN_SETS, column list, or None (schema).
+        engine:   pandas CSV engine; defaults to DEFAULT_ENGINE.
+
+    Returns:
+        pd.DataFrame with 'fecha' as datetime64 and only the requested columns
+        that exist in the file.
+    """
+    engine = engine or DEFAULT_ENGINE
+    header = list(pd.read_csv(csv_path, nrows=0).columns)
+    usecols = _usecols(header, columns, csv_path)
+    df = _read_typed(csv_path, usecols, engine)
+    df["fecha"] = parse_fecha(df["fecha"])
+
+    df.attrs["load_report"] = memory_report(df, len(header))
+    logging.info(
+        f"Loaded {os.path.basename(csv_path)}: {len(df):,} rows, "
+        f"{len(usecols)}/{len(header)} columns, "
+        f"{df.attrs['load_report']['bytes_saved']:,} bytes saved vs. untyped read"
+    )
+    return df
+
+
+def _usecols(header: list, columns, csv_path: str) -> list:
+    """Return the header columns to read for a column request, in file order."""
+    wanted = set(resolve_columns(columns))
+    usecols = [c for c in header if c in wanted]
+    if "fecha" not in usecols:
+        raise KeyError(f"'fecha' column not found in {os.path.basename(csv_path)}")
+    return usecols
+
+
+def _read_typed(source, usecols: list, engine: str) -> pd.DataFrame:
+    """pd.read_csv with SCHEMA_DTYPES applied; source is a path or a buffer."""
+    dtype = {c: SCHEMA_DTYPES[c] for c in usecols if c in SCHEMA_DTYPES}
+    options = {"low_memory": False} if engine == "c" else {}
+    try:
+        return pd.read_csv(source, header=0, usecols=usecols, dtype=dtype,
+                           engine=engine, **options)
+    except ValueError:
+        # A non-numeric cell in a measurement column — read those columns
+        # untyped, then coerce exactly as the plotting code used to.
+        if hasattr(source, "seek"):
+            source.seek(0)
+        dtype = {c: t for c, t in dtype.items() if t == "category"}
+        df = pd.read_csv(source, header=0, usecols=usecols, dtype=dtype,
+                         engine=engine, **options)
+        for c in usecols:
+            if SCHEMA_DTYPES.get(c, "category") != "category":
+                df[c] = pd.to_numeric(df[c], errors="coerce").astype(SCHEMA_DTYPES[c])
+        return df
+
+
+def memory_report(df: pd.DataFrame, file_columns: int) -> dict:
+    """
+    Compare the in-memory size of df with an untyped read of the whole file.
+
+    The untyped baseline is estimated as 8 bytes per cell for every column
+    in the file (float64 values / object pointers), which ignores the string
+    payloads of object columns — so bytes_saved is a lower bound.
+
+    Returns:
+        dict with rows, bytes_used, bytes_untyped_estimate and bytes_saved.
+    """
+    used = int(df.memory_usage(deep=True, index=False).sum())
+    untyped = len(df) * file_columns * 8
+    return {
+        "rows": len(df),
+        "bytes_used": used,
+        "bytes_untyped_estimate": untyped,
+        "bytes_saved": max(untyped - used, 0),
+    }
+
+
+# ── Cache key / location ─────────────────────────────────────────────────────
+
+def cache_key(csv_path: str) -> str:
+    """
+    Return the cache key for a CSV file: size, mtime and a head/tail hash.
+
+    Hashing both ends of the file catches in-place edits that keep the size
+    and mtime (e.g. files copied with preserved timestamps) without reading
+    the whole archive.
+    """
+    st = os.stat(csv_path)
+    h = hashlib.sha1()
+    with open(csv_path, "rb") as f:
+        h.update(f.read(_KEY_SAMPLE_BYTES))
+        if st.st_size > _KEY_SAMPLE_BYTES:
+            f.seek(max(st.st_size - _KEY_SAMPLE_BYTES, _KEY_SAMPLE_BYTES))
+            h.update(f.read())
+    return f"{st.st_size}-{st.st_mtime_ns}-{h.hexdigest()[:16]}"
+
+
+def default_cache_dir(csv_path: str) -> str:
+    """Return the cache folder used for a CSV: '_cache' next to the file."""
+    return os.path.join(os.path.dirname(os.path.abspath(csv_path)), CACHE_DIRNAME)
+
+
+# ── Columnar store ───────────────────────────────────────────────────────────
+
+def _write_cache(df: pd.DataFrame, entry_dir: str, source: str) -> None:
+    """
+    Write df as one .npy file per column plus meta.json.
+
+    Object (string) columns are stored as int32 codes with the categories
+    kept in meta.json, so no pickled arrays are ever written. The entry is
+    built in a temporary folder and renamed into place, so a crash never
+    leaves a half-written cache behind.
+    """
+    tmp_dir = entry_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    columns = []
+    for i, name in enumerate(df.columns):
+        col = df[name]
+        fname = f"{i}.npy"
+        if col.dtype == object or isinstance(col.dtype, pd.StringDtype):
+            codes, uniques = pd.factorize(col)
+            np.save(os.path.join(tmp_dir, fname), codes.astype(np.int32))
+            columns.append({
+                "name": name, "file": fname, "kind": "category",
+                "dtype": str(col.dtype), "categories": [str(u) for u in uniques],
+            })
+        elif isinstance(col.dtype, pd.CategoricalDtype):
+            np.save(os.path.join(tmp_dir, fname), col.cat.codes.to_numpy(np.int32))
+            columns.append({
+                "name": name, "file": fname, "kind": "category",
+                "dtype": "category", "categories": [str(u) for u in col.cat.categories],
+            })
+        else:
+            np.save(os.path.join(tmp_dir, fname), col.to_numpy())
+            columns.append({"name": name, "file": fname, "kind": "array"})
+
+    meta = {
+        "version": CACHE_VERSION,
+        "schema": SCHEMA_COLUMNS,
+        "source": os.path.abspath(source),
+        "rows": len(df),
+        "columns": columns,
+    }
+    with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+    shutil.rmtree(entry_dir, ignore_errors=True)
+    os.replace(tmp_dir, entry_dir)
+
+
+def _read_cache(entry_dir: str, columns=None) -> pd.DataFrame:
+    """Load the requested columns (all when None) from a cache entry."""
+    with open(os.path.join(entry_dir, "meta.json"), encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("version") != CACHE_VERSION or meta.get("schema") != SCHEMA_COLUMNS:
+        raise ValueError("cache written by a different schema version")
+
+    wanted = set(resolve_columns(columns))
+    data = {}
+    for spec in meta["columns"]:
+        if spec["name"] not in wanted:
+            continue
+        arr = np.load(os.path.join(entry_dir, spec["file"]), allow_pickle=False)
+        if spec["kind"] == "category":
+            values = pd.Categorical.from_codes(arr, categories=spec["categories"])
+            data[spec["name"]] = pd.Series(values).astype(spec["dtype"])
+        else:
+            data[spec["name"]] = arr
+    return pd.DataFrame(data)
+
+
+def _prune_stale_entries(cache_dir: str, source: str, keep: str) -> None:
+    """Remove older cache entries that were built from the same source path."""
+    source = os.path.abspath(source)
+    for name in os.listdir(cache_dir):
+        entry = os.path.join(cache_dir, name)
+        if name == keep or not os.path.isdir(entry):
+            continue
+        try:
+            with open(os.path.join(entry, "meta.json"), encoding="utf-8") as f:
+                if json.load(f).get("source") == source:
+                    shutil.rmtree(entry, ignore_errors=True)
+        except (OSError, ValueError):
+            continue
+
+
+# ── Public entry point ───────────────────────────────────────────────────────
+
+def load_dataset(csv_path: str, columns=None, cache_dir: str = None,
+                 engine: str = None) -> pd.DataFrame:
+    """
+    Return the CSV as a typed DataFrame with 'fecha' converted to datetime64.
+
+    The first call for a given file parses the SCHEMA_COLUMNS of the CSV and
+    stores a columnar copy; subsequent calls (from any step, in any process)
+    load only the requested columns from that copy. Cache failures are
+    logged and never prevent the data from being returned.
+
+    Args:
+        csv_path:  Path to the CSV file.
+        columns:   Consumer name from COLUMN_SETS ('graphs', 'map_summary',
+                   'map_history', 'dates'), a column list, or None for all
+                   schema columns. Columns missing from the file are skipped.
+        cache_dir: Cache folder; defaults to '_cache' next to the CSV.
+        engine:    pandas CSV engine for the first parse (DEFAULT_ENGINE).
+
+    Returns:
+        pd.DataFrame with the requested columns in file order.
+    """
+    cache_dir = cache_dir or default_cache_dir(csv_path)
+    key = cache_key(csv_path)
+    entry_dir = os.path.join(cache_dir, key)
+
+    if os.path.isfile(os.path.join(entry_dir, "meta.json")):
+        try:
+            return _read_cache(entry_dir, columns)
+        except ValueError as e:
+            logging.info(f"Dataset cache for '{csv_path}' is outdated, re-parsing: {e}")
+        except Exception as e:
+            logging.warning(f"Dataset cache unreadable for '{csv_path}', re-parsing: {e}")
+
+    df = read_csv(csv_path, engine=engine)
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        _write_cache(df, entry_dir, csv_path)
+        _prune_stale_entries(cache_dir, csv_path, keep=key)
+    except OSError as e:
+        logging.warning(f"Could not write dataset cache for '{csv_path}': {e}")
+
+    wanted = set(resolve_columns(columns))
+    return df[[c for c in df.columns if c in wanted]]
+
+
+# ── Streaming ingest ─────────────────────────────────────────────────────────
+
+class StreamingIngest:
+    """
+    Incremental parser fed with the raw bytes of a CSV as they arrive.
+
+    Complete lines are buffered and parsed with the same typed reader as
+    read_csv() every INGEST_BLOCK_BYTES, so parsing overlaps the download.
+    Running results: row count, first/last fecha, rows per station and the
+    SHA-256 of all bytes fed. With cache=True the typed blocks are kept and
+    write_cache() stores them as the load_dataset() cache entry of the
+    finished file, which then never has to be parsed from text.
+
+    Lines are split on newlines; INSIVUMEH exports have no quoted fields.
+    If a quote character shows up, or a block cannot be parsed (e.g. an
+    unrecognised fecha), the incremental parse stops with a log message,
+    feed() keeps hashing, and close() falls back to load_dataset() on the
+    finished file. A parse problem never interrupts the download itself.
+
+    Usage:
+        ingest = StreamingIngest()
+        for chunk in response.iter_content(CHUNK_SIZE):
+            f.write(chunk)
+            ingest.feed(chunk)
+        summary = ingest.close(path)
+        ingest.write_cache(path)
+    """
+
+    def __init__(self, cache: bool = True, engine: str = None):
+        self.cache = cache
+        self.engine = engine or DEFAULT_ENGINE
+        self.sha256 = hashlib.sha256()
+        self.bytes = 0
+        self.rows = 0
+        self.first_fecha = None
+        self.last_fecha = None
+        self.station_rows = pd.Series(dtype="int64")
+        self._header = None
+        self._usecols = None
+        self._pending = []
+        self._pending_bytes = 0
+        self._carry = b""
+        self._blocks = []
+        self._quoted = False
+        self.error = None       # parse error that stopped the incremental parse
+        self._df = None
+
+    def feed(self, chunk: bytes) -> None:
+        """Hash chunk and parse every complete line accumulated so far."""
+        self.sha256.update(chunk)
+        self.bytes += len(chunk)
+        if self._quoted or self.error is not None:
+            return
+        if b'"' in chunk:
+            logging.info("Quoted CSV fields in the stream; parsing after the download")
+            self._quoted = True
+            self._pending, self._blocks, self._carry = [], [], b""
+            return
+        try:
+            self._feed_lines(chunk)
+        except Exception as e:
+            self._stop(e)
+
+    def _stop(self, error: Exception) -> None:
+        logging.warning(f"Streaming parse stopped, the file is loaded after the download: {error}")
+        self.error = error
+        self._pending, self._blocks, self._carry = [], [], b""
+
+    def _feed_lines(self, chunk: bytes) -> None:
+        data = self._carry + chunk
+        cut = data.rfind(b"\n") + 1
+        self._carry = data[cut:]
+        if not cut:
+            return
+        lines = data[:cut]
+        if self._header is None:
+            end = lines.index(b"\n") + 1
+            self._header, lines = lines[:end], lines[end:]
+            if self._header.startswith(b"\xef\xbb\xbf"):
+                self._header = self._header[3:]
+            header = list(pd.read_csv(io.BytesIO(self._header), nrows=0).columns)
+            wanted = None if self.cache else ["fecha", "Nombre"]
+            self._usecols = _usecols(header, wanted, "stream")
+        self._pending.append(lines)
+        self._pending_bytes += len(lines)
+        if self._pending_bytes >= INGEST_BLOCK_BYTES:
+            self._parse_pending()
+
+    def feed_file(self, path: str, length: int) -> None:
+        """Feed the first length bytes of path (a partial download being resumed)."""
+        with open(path, "rb") as f:
+            while length > 0:
+                block = f.read(min(length, INGEST_BLOCK_BYTES))
+                if not block:
+                    break
+                self.feed(block)
+                length -= len(block)
+
+    def _parse_pending(self) -> None:
+        raw = b"".join(self._pending)
+        self._pending, self._pending_bytes = [], 0
+        if not raw.strip():
+            return
+        block = _read_typed(io.BytesIO(self._header + raw), self._usecols, self.engine)
+        block["fecha"] = parse_fecha(block["fecha"])
+        self._account(block)
+        if self.cache:
+            self._blocks.append(block)
+
+    def _account(self, block: pd.DataFrame) -> None:
+        self.rows += len(block)
+        lo, hi = block["fecha"].min(), block["fecha"].max()
+        if pd.notna(lo):
+            self.first_fecha = lo if self.first_fecha is None else min(self.first_fecha, lo)
+            self.last_fecha = hi if self.last_fecha is None else max(self.last_fecha, hi)
+        if "Nombre" in block.columns:
+            counts = block["Nombre"].value_counts()
+            self.station_rows = self.station_rows.add(counts[counts > 0], fill_value=0).astype("int64")
+
+    def close(self, path: str = None) -> dict:
+        """
+        Parse the last lines and return the summary.
+
+        path (the finished file) is only read when the stream could not be
+        parsed incrementally; it is then loaded with load_dataset(), whose
+        errors (e.g. ValueError for an unrecognised fecha) propagate.
+
+        Returns:
+            dict(rows, first_fecha, last_fecha, stations, station_rows,
+                 sha256, bytes).
+        """
+        if not self._quoted and self.error is None:
+            if self._carry.strip() and self._header is not None:
+                self._pending.append(self._carry + b"\n")
+            self._carry = b""
+            try:
+                self._parse_pending()
+            except Exception as e:
+                self._stop(e)
+        if self._quoted or self.error is not None:
+            if path is None:
+                raise ValueError("stream not parsed: close() needs the finished file path")
+            self._df = load_dataset(path, None if self.cache else ["fecha", "Nombre"],
+                                    engine=self.engine)
+            self.rows, self.first_fecha, self.last_fecha = 0, None, None
+            self.station_rows = pd.Series(dtype="int64")
+            self._account(self._df)
+        return {
+            "rows": self.rows,
+            "first_fecha": self.first_fecha,
+            "last_fecha": self.last_fecha,
+            "stations": len(self.station_rows),
+            "station_rows": self.station_rows.sort_index(),
+            "sha256": self.sha256.hexdigest(),
+            "bytes": self.bytes,
+        }
+
+    def dataframe(self) -> pd.DataFrame:
+        """The parsed schema columns, equal to read_csv() of the finished file."""
+        if self._df is None:
+            if not self._blocks:
+                raise ValueError("no rows were parsed (cache=False or empty stream)")
+            df = pd.concat(self._blocks, ignore_index=True)
+            # Blocks carry their own categories; rebuild them as one sorted set
+            for c in df.columns:
+                if SCHEMA_DTYPES.get(c) == "category" and c != "fecha":
+                    df[c] = pd.api.types.union_categoricals(
+                        [b[c] for b in self._blocks], sort_categories=True)
+            self._df = df
+            self._blocks = []
+        return self._df
+
+    def write_cache(self, csv_path: str, cache_dir: str = None) -> None:
+        """Store the parsed data as the load_dataset() cache entry of csv_path."""
+        if not self.cache:
+            return
+        cache_dir = cache_dir or default_cache_dir(csv_path)
+        key = cache_key(csv_path)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            _write_cache(self.dataframe(), os.path.join(cache_dir, key), csv_path)
+            _prune_stale_entries(cache_dir, csv_path, keep=key)
+        except OSError as e:
+            logging.warning(f"Could not write dataset cache for '{csv_path}': {e}")
+
+
+# ── Tail window ──────────────────────────────────────────────────────────────
+
+def read_last_days(csv_path: str, days: int = WINDOW_DAYS, columns=None,
+                   block_size: int = TAIL_BLOCK_BYTES, engine: str = None) -> pd.DataFrame:
+    """
+    Return only the rows with fecha >= max(fecha) - days, reading from the end.
+
+    INSIVUMEH exports are appended chronologically, so the file is read
+    backwards in blocks of block_size bytes; each block is parsed and the
+    scan stops once a block reaches dates older than the cutoff and the
+    block before it confirms the order (entirely earlier, no later than the
+    first date kept). Cost is proportional to the window, not to the
+    archive length.
+
+    The blocks read, and ORDER_PROBES small samples spread over the rest of
+    the file (the first at its head), must be in non-decreasing date order.
+    If they are not (e.g. database.csv, which is sorted by day of month, or
+    an export sorted by station), the file is treated as unordered and the
+    full dataset is loaded with load_dataset() and filtered instead.
+    Disorder that falls entirely between two samples is not detected.
+
+    The earliest date of the file is attached as df.attrs["first_fecha"]
+    (from the head of the file when ordered) so callers can still name
+    outputs after the full data period.
+
+    Args:
+        csv_path:   Path to the CSV file.
+        days:       Window length in days (inclusive cutoff, as in
+                    prepare_data_for_graphs()).
+        columns:    Consumer name from COLUMN_SETS, column list, or None.
+        block_size: Bytes read per backwards step.
+        engine:     pandas CSV engine (DEFAULT_ENGINE).
+
+    Returns:
+        pd.DataFrame with the window rows in file order.
+    """
+    engine = engine or DEFAULT_ENGINE
+    size = os.path.getsize(csv_path)
+
+    with open(csv_path, "rb") as f:
+        header_line = f.readline()
+        data_start = f.tell()
+        header = list(pd.read_csv(io.BytesIO(header_line), nrows=0).columns)
+        usecols = _usecols(header, columns, csv_path)
+
+        def parse(raw: bytes) -> pd.DataFrame:
+            block = _read_typed(io.BytesIO(header_line + raw), usecols, engine)
+            block["fecha"] = parse_fecha(block["fecha"])
+            return block
+
+        def unordered():
+            logging.info(f"{os.path.basename(csv_path)} is not date-ordered; "
+                         "reading the full file for the last-days window")
+            return _filter_full(csv_path, days, columns, engine)
+
+        blocks = []
+        cutoff = None
+        confirm = None      # block before the window, read to check the order
+        carry = b""
+        pos = size
+        while pos > data_start:
+            start = max(pos - block_size, data_start)
+            f.seek(start)
+            raw = f.read(pos - start) + carry
+            pos = start
+            if pos > data_start:
+                # The first line of the block may be cut — keep it for the next step
+                cut = raw.find(b"\n")
+                if cut < 0:
+                    carry = raw
+                    continue
+                carry, raw = raw[:cut + 1], raw[cut + 1:]
+            else:
+                carry = b""
+            if not raw.strip():
+                continue
+
+            block = parse(raw)
+            fechas = block["fecha"].dropna()
+            if fechas.empty:
+                continue
+            if not fechas.is_monotonic_increasing or (
+                blocks and fechas.iloc[-1] > blocks[0]["fecha"].dropna().iloc[0]
+            ):
+                return unordered()
+            if blocks and blocks[0]["fecha"].dropna().iloc[0] < cutoff:
+                # The window's start was crossed in the previous block and this
+                # one is entirely earlier: the tail is ordered, stop here
+                confirm = fechas
+                break
+
+            if cutoff is None:
+                cutoff = fechas.iloc[-1] - pd.Timedelta(days=days)
+            blocks.insert(0, block)
+
+        if not blocks:
+            return _filter_full(csv_path, days, columns, engine)
+
+        # Earliest date of the archive: head of the file (ordered file)
+        earliest = confirm.iloc[0] if confirm is not None else blocks[0]["fecha"].min()
+        first_fecha = earliest
+        if pos > data_start:
+            sampled = _probe_fechas(f, data_start, pos, parse)
+            if not sampled.empty:
+                if not sampled.is_monotonic_increasing or sampled.iloc[-1] > earliest:
+                    return unordered()
+                first_fecha = sampled.iloc[0]
+
+    df = pd.concat(blocks, ignore_index=True)
+    df = df[df["fecha"] >= cutoff].reset_index(drop=True)
+    # Blocks carry their own categories; concat falls back to strings
+    for c in CATEGORY_COLUMNS:
+        if c in df.columns:
+            df[c] = df[c].astype("category")
+    df.attrs["first_fecha"] = first_fecha
+    return df
+
+
+def _probe_fechas(f, start: int, end: int, parse) -> pd.Series:
+    """
+    Dates of ORDER_PROBES samples of whole lines between byte offsets
+    start and end (the first at start), concatenated in file order.
+    """
+    step = max((end - start) // ORDER_PROBES, 1)
+    samples = []
+    for offset in range(start, end, step):
+        f.seek(offset)
+        raw = f.read(min(ORDER_PROBE_BYTES, end - offset))
+        if offset > start:
+            # Skip the line the sample starts in the middle of
+            raw = raw[raw.find(b"\n") + 1:] if b"\n" in raw else b""
+        raw = raw[:raw.rfind(b"\n") + 1]
+        if raw.strip():
+            samples.append(parse(raw)["fecha"].dropna())
+    if not samples:
+        return pd.Series(dtype="datetime64[ns]")
+    return pd.concat(samples, ignore_index=True)
+
+
+def _filter_full(csv_path: str, days: int, columns, engine: str) -> pd.DataFrame:
+    """Fallback for read_last_days(): load everything, then apply the cutoff."""
+    df = load_dataset(csv_path, columns, engine=engine)
+    cutoff = df["fecha"].max() - pd.Timedelta(days=days)
+    first_fecha = df["fecha"].min()
+    df = df[df["fecha"] >= cutoff].reset_index(drop=True)
+    df.attrs["first_fecha"] = first_fecha
+    return df
@@ -1,28 +1,48 @@
+import numpy as np
 import pandas as pd
+import bokeh
+from bokeh.layouts import column, row
 from bokeh.plotting import figure, output_file, save
-from bokeh.models import Range1d, LinearAxis, HoverTool
+from bokeh.models import (Range1d, LinearAxis, HoverTool, ColumnDataSource, CustomJS,
+                          Select, AutocompleteInput)
+from bokeh.embed import components, file_html
+from bokeh.resources import CDN, Resources
+from jinja2 import Template
 import os
+# detect_date_format is re-exported for existing `from data_processing import ...` callers
+from data_loader import detect_date_format, load_dataset, read_last_days, WINDOW_DAYS
 
+# save_plot() output modes:
+#   standalone — one self-contained file per station (same page as output_file/save)
+#   shared     — station pages hold only their script/div fragments and load
+#                BokehJS from one bundle written once into html_output/static
+PAGE_MODES = ("standalone", "shared")
+# HTML output of a generation run: per-station pages, or one dashboard
+# holding every station (save_dashboard) instead
+HTML_MODES = PAGE_MODES + ("dashboard",)
+SERIES = ('lluvia', 'tseca', 'tmin', 'tmax', 'hum_rel')
+STATIC_DIRNAME = "static"
 
-def detect_date_format(sample: str) -> str:
-    """
-    Return the strptime format string that matches an INSIVUMEH fecha sample value.
-
-    Supports:
-      - YYYY-MM-DD  (insivumeh_*.csv — primary download file)
-      - DD/MM/YYYY  (database.csv   — local historical copy)
-
-    Args:
-        sample: A single non-null value from the 'fecha' column, as a string.
-
-    Returns:
-        A strptime format string: '%Y-%m-%d' or '%d/%m/%Y'.
-    """
-    s = str(sample).strip()
-    return "%Y-%m-%d" if len(s) >= 10 and s[4] == "-" else "%d/%m/%Y"
+# Compiled once; rendered for every station page in 'shared' mode
+_SHARED_PAGE = Template("""<!DOCTYPE html>
+<html lang="es">
+  <head>
+    <meta charset="utf-8">
+    <title>{{ title }}</title>
+    <style>
+      html, body { box-sizing: border-box; display: flow-root; height: 100%; margin: 0; padding: 0; }
+    </style>
+    <script src="{{ bundle }}"></script>
+  </head>
+  <body>
+    {{ div }}
+    {{ script }}
+  </body>
+</html>
+""")
 
 
-def read_and_prepare_data(csv_file_path):
+def read_and_prepare_data(csv_file_path, last_days=None):
     """
     Read and prepare data from a CSV file.
 
@@ -30,16 +50,22 @@ def read_and_prepare_data(csv_file_path):
       - YYYY-MM-DD  (insivumeh_*.csv — primary download file)
       - DD/MM/YYYY  (database.csv   — local historical copy)
 
+    Only the 'graphs' column set is loaded (float32 measurements, categorical
+    Nombre). The CSV is parsed once and cached as typed columns by
+    data_loader.load_dataset(); later reads of the same file are binary loads.
+
     Args:
         csv_file_path (str): Path to the CSV file.
+        last_days (int): When set, only the rows of the last `last_days` days
+            are read, scanning the file backwards (data_loader.read_last_days).
+            The archive's first date is kept in df.attrs["first_fecha"].
 
     Returns:
         pd.DataFrame: Prepared DataFrame.
     """
-    df = pd.read_csv(csv_file_path, header=0, delimiter=',')
-    sample = str(df['fecha'].dropna().iloc[0]).strip()
-    df['fecha'] = pd.to_datetime(df['fecha'], format=detect_date_format(sample))
-    return df
+    if last_days is not None:
+        return read_last_days(csv_file_path, last_days, "graphs")
+    return load_dataset(csv_file_path, "graphs")
 
 def prepare_data_for_graphs(df):
     """
@@ -55,10 +81,10 @@ def prepare_data_for_graphs(df):
         pd.DataFrameGroupBy: Grouped data limited to the last 30 days.
     """
     max_date = df['fecha'].max()
-    cutoff = max_date - pd.Timedelta(days=30)
-    return df[df['fecha'] >= cutoff].groupby('Nombre')
+    cutoff = max_date - pd.Timedelta(days=WINDOW_DAYS)
+    return df[df['fecha'] >= cutoff].groupby('Nombre', observed=True)
 
-def process_grouped_data(name, group, directory_img, directory_html):
+def process_grouped_data(name, group, directory_img, directory_html, html_mode="standalone"):
     """
     Process and plot data for each group.
 
@@ -67,21 +93,35 @@ def process_grouped_data(name, group, directory_img, directory_html):
         group (pd.DataFrame): Grouped data.
         directory_img (str): Directory for images.
         directory_html (str): Directory for HTML output.
+        html_mode (str): 'standalone' or 'shared' (see save_plot); with
+            'dashboard' no per-station page is written.
 
     Returns:
         dict: Data for further processing or matplotlib plotting.
     """
-    df = group.copy().sort_values("fecha")
-    month_year_str = df['fecha'].max().strftime("%m-%Y")
-    df['Nombre'] = df['Nombre'].replace('_', ' ', regex=True)
+    df, month_year_str = prepare_station_frame(group)
 
     # Plotting
-    fig = create_bokeh_plot(df, name)
-    save_plot(fig, name, month_year_str, directory_html)
+    if html_mode != "dashboard":
+        fig = create_bokeh_plot(df, name)
+        save_plot(fig, name, month_year_str, directory_html, html_mode)
 
     # Data for further processing or matplotlib plotting
     return extract_plotting_data(df, name, directory_img)
 
+def prepare_station_frame(group):
+    """
+    One station's rows sorted by date, with display names.
+
+    Returns:
+        tuple: (DataFrame, "MM-YYYY" of its latest date), as used by
+        create_bokeh_plot() / save_plot().
+    """
+    df = group.copy().sort_values("fecha")
+    month_year_str = df['fecha'].max().strftime("%m-%Y")
+    df['Nombre'] = df['Nombre'].astype(str).str.replace('_', ' ')
+    return df, month_year_str
+
 def create_bokeh_plot(data, station_name):
     """
     Create Bokeh plot for the given data.
@@ -93,8 +133,7 @@ def create_bokeh_plot(data, station_name):
     Returns:
         bokeh.plotting.Figure: Bokeh plot.
     """
-    import numpy as np
-    lluvia_top = max(pd.to_numeric(data['lluvia'], errors='coerce').max() * 1.15, 30)
+    lluvia_top, _, _ = plot_limits(data)
     fig = figure(
         x_axis_type='datetime', title=station_name, height=400, width=800,
         toolbar_location='below', y_axis_label="Precipitación (mm)",
@@ -105,10 +144,16 @@ def create_bokeh_plot(data, station_name):
     add_plot_elements(fig, data)
     return fig
 
-def configure_plot(fig, data):
-    """Configure plot appearance and settings."""
+def plot_limits(data):
+    """Data-driven (lluvia_top, temp_lo, temp_hi) so unusual days are never clipped."""
+    lluvia_top = max(pd.to_numeric(data['lluvia'], errors='coerce').max() * 1.15, 30)
     temp_lo = min(pd.to_numeric(data['tmin'], errors='coerce').min() - 2, -5)
     temp_hi = max(pd.to_numeric(data['tmax'], errors='coerce').max() + 3, 40)
+    return lluvia_top, temp_lo, temp_hi
+
+def configure_plot(fig, data):
+    """Configure plot appearance and settings."""
+    _, temp_lo, temp_hi = plot_limits(data)
     fig.left[0].formatter.use_scientific = False
     fig.extra_y_ranges = {
         "temp_range": Range1d(start=float(temp_lo), end=float(temp_hi)),
@@ -136,22 +181,153 @@ def add_tooltips(fig):
     formatters = {'@x': 'datetime'}
     fig.add_tools(HoverTool(tooltips=tooltips, formatters=formatters, mode='vline'))
 
-def save_plot(fig, station_name, month_year_str, directory_html):
+def save_plot(fig, station_name, month_year_str, directory_html, html_mode="standalone"):
     """
     Save the plot as an HTML file.
 
+    In 'standalone' mode the page is the one Bokeh's output_file/save would
+    write and loads BokehJS from the CDN. In 'shared' mode only the plot's
+    script/div fragments are rendered into a small page that references the
+    bundle written by write_bokeh_bundle(); the bundle is created here if
+    missing, but callers rendering many stations should write it once
+    beforehand. The page is built by page_html().
+
     Args:
         fig (bokeh.plotting.Figure): Bokeh plot.
         station_name (str): Station name.
         month_year_str (str): Month and year as a string.
         directory_html (str): Directory for HTML output.
+        html_mode (str): One of HTML_MODES.
     """
+    filename, page = page_html(fig, station_name, month_year_str, directory_html, html_mode)
+    with open(os.path.join(directory_html, filename), "w", encoding="utf-8") as f:
+        f.write(page)
+
+def page_html(fig, station_name, month_year_str, directory_html, html_mode="standalone"):
+    """
+    Serialize a station page without writing it: (file name, HTML text).
+
+    'standalone' gives the same page as Bokeh's output_file/save (CDN
+    resources, default title) but through file_html(), which uses no global
+    document state and so can run on any thread.
+    """
+    if html_mode not in PAGE_MODES:
+        raise ValueError(f"html_mode must be one of {PAGE_MODES}, not {html_mode!r}")
     filename = f'{os.path.basename(station_name)}_{month_year_str}.html'
-    output_file(os.path.join(directory_html, filename))
+    style_legend(fig)
+    if html_mode == "standalone":
+        return filename, file_html(fig, resources=CDN, title="Bokeh Plot")
+
+    bundle = write_bokeh_bundle(directory_html)
+    script, div = components(fig)
+    return filename, _SHARED_PAGE.render(title=f"{station_name} {month_year_str}",
+                                         bundle=bundle, script=script, div=div)
+
+def style_legend(fig):
+    """Compact, semi-transparent legend used by every saved chart."""
     fig.legend.background_fill_alpha = 0.5
     fig.legend.label_text_font_size = "8pt"
     fig.legend.spacing = 1
-    save(fig)
+
+# Swaps the visible station: slices the shared columns into each named
+# renderer's source and applies that station's precomputed ranges
+_DASHBOARD_JS = """
+const i = names.indexOf(cb_obj.value);
+if (i < 0) return;
+const a = offsets[i], b = offsets[i + 1];
+const x = src.data.x.slice(a, b);
+for (const r of renderers) {
+    r.data_source.data = {x: x, y: src.data[r.name].slice(a, b)};
+}
+const lim = limits[i];
+if (isFinite(lim[0])) fig.y_range.end = lim[0];
+if (isFinite(lim[1])) temp_range.start = lim[1];
+if (isFinite(lim[2])) temp_range.end = lim[2];
+fig.title.text = names[i];
+for (const w of widgets) {
+    if (w.value !== names[i]) w.value = names[i];
+}
+"""
+
+def save_dashboard(stations, directory_html, month_year_str):
+    """
+    Save every station's series as one HTML dashboard with a station selector.
+
+    All stations share one ColumnDataSource: the series are concatenated in
+    station order as typed arrays (float64 epoch-ms x, float32 measurements)
+    and each station is an [offset, next offset) slice. The figure is the one
+    create_bokeh_plot() builds for the first station; choosing a station in
+    the dropdown or the search box swaps the renderers' data client-side.
+
+    Args:
+        stations (list): (name, group DataFrame) pairs, e.g. list(grouped_data).
+        directory_html (str): Directory for HTML output.
+        month_year_str (str): Month and year as a string, for the file name.
+
+    Returns:
+        str: Path of the written dashboard.
+    """
+    names, frames, offsets, limits = [], [], [0], []
+    for name, group in stations:
+        df = group.sort_values("fecha")
+        names.append(str(name))
+        frames.append(df)
+        offsets.append(offsets[-1] + len(df))
+        limits.append([float(v) for v in plot_limits(df)])
+    if not frames:
+        raise ValueError("No hay estaciones para el panel")
+
+    data = pd.concat(frames, ignore_index=True)
+    columns = {'x': data['fecha'].to_numpy('datetime64[ms]').astype(np.float64)}
+    for key in SERIES:
+        columns[key] = pd.to_numeric(data[key], errors='coerce').to_numpy(np.float32)
+    src = ColumnDataSource(data=columns)
+
+    fig = create_bokeh_plot(frames[0], names[0])
+    style_legend(fig)
+    renderers = [fig.select_one({'name': key}) for key in SERIES]
+
+    select = Select(title="Estación", value=names[0], options=names, width=300)
+    search = AutocompleteInput(title="Buscar estación", completions=names, width=300,
+                               case_sensitive=False, search_strategy="includes")
+    callback = CustomJS(args=dict(src=src, renderers=renderers, names=names,
+                                  offsets=offsets, limits=limits, fig=fig,
+                                  temp_range=fig.extra_y_ranges["temp_range"],
+                                  widgets=[select, search]),
+                        code=_DASHBOARD_JS)
+    select.js_on_change('value', callback)
+    search.js_on_change('value', callback)
+
+    path = os.path.join(directory_html, f"panel_estaciones_{month_year_str}.html")
+    output_file(path, title=f"Estaciones {month_year_str}")
+    save(column(row(select, search), fig))
+    return path
+
+def bokeh_bundle_name():
+    """File name of the shared BokehJS bundle for the installed Bokeh version."""
+    return f"bokeh-{bokeh.__version__}.min.js"
+
+def write_bokeh_bundle(directory_html):
+    """
+    Write the BokehJS library once into <directory_html>/static.
+
+    The bundle is versioned by file name, so an existing file is reused
+    as-is. Pages keep working offline and browsers cache it across stations.
+
+    Returns:
+        str: Bundle path relative to directory_html, for <script src>.
+    """
+    rel_path = f"{STATIC_DIRNAME}/{bokeh_bundle_name()}"
+    path = os.path.join(directory_html, STATIC_DIRNAME, bokeh_bundle_name())
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        js = "\n".join(Resources(mode="inline", components=["bokeh"]).js_raw)
+        # Concurrent render processes may race here; the rename is atomic
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(js)
+        os.replace(tmp_path, path)
+    return rel_path
 
 def extract_plotting_data(data, station_name, directory_img):
     """
@@ -0,0 +1,63 @@
+"""
+bench_map_writer.py — Station-map benchmark: Folium object graph vs. the
+direct Leaflet writer (generate_map(engine="leaflet")).
+
+Builds synthetic station summaries (random points over Guatemala, plausible
+30-day statistics) and times generate_map() for both engines and both layer
+modes, reporting seconds and file size. No popup history charts are used,
+so the numbers isolate the map writing itself.
+
+Run from project root:
+    python dev/bench_map_writer.py [n_stations ...]      (default: 240 5000)
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+import pandas as pd
+
+from map_viewer import generate_map, LAYER_MODES, MAP_ENGINES
+
+
+def synthetic_summary(n, seed=0):
+    """build_station_summary()-shaped frame with n random stations."""
+    rng = np.random.default_rng(seed)
+    tseca = rng.uniform(12, 30, n)
+    return pd.DataFrame({
+        "Nombre": [f"ESTACION_{i:05d}" for i in range(n)],
+        "station_id": [f"S{i:05d}" for i in range(n)],
+        "Latitud": rng.uniform(13.8, 17.8, n),
+        "Longitud": rng.uniform(-92.2, -88.2, n),
+        "Altitud": rng.uniform(0, 3500, n),
+        "lluvia_total": np.where(rng.random(n) < 0.05, np.nan, rng.gamma(2.0, 60.0, n)),
+        "tseca_mean": tseca,
+        "tmin_mean": tseca - rng.uniform(4, 9, n),
+        "tmax_mean": tseca + rng.uniform(4, 9, n),
+        "hum_rel_mean": rng.uniform(55, 95, n),
+        "vel_viento_mean": rng.uniform(0, 20, n),
+        "dir_viento_mean": rng.uniform(0, 360, n),
+        "last_fecha": pd.Timestamp("2023-08-31"),
+        "n_days": rng.integers(20, 31, n),
+    })
+
+
+sizes = [int(a) for a in sys.argv[1:]] or [240, 5000]
+for n in sizes:
+    summary = synthetic_summary(n)
+    print(f"{n} stations")
+    for layer_mode in LAYER_MODES:
+        timings = {}
+        for engine in MAP_ENGINES:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                start = time.perf_counter()
+                path = generate_map(summary, tmpdir, layer_mode=layer_mode, engine=engine)
+                timings[engine] = time.perf_counter() - start
+                size = os.path.getsize(path)
+            print(f"  {layer_mode:<8} {engine:<8} {timings[engine]:8.2f} s  {size / 1e6:7.2f} MB")
+        print(f"  {layer_mode:<8} speed-up {timings['folium'] / timings['leaflet']:8.1f}x")
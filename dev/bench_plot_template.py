@@ -0,0 +1,66 @@
+"""
+bench_plot_template.py — PNG rendering benchmark: reused figure template vs.
+a new figure per station.
+
+Renders every station of the 30-day window twice:
+  - baseline : plot_with_matplotlib(data, reuse_figure=False)  (original path)
+  - template : plot_with_matplotlib(data, reuse_figure=True)
+then reports seconds per station for each path and compares the two PNGs of
+every station pixel by pixel.
+
+Run from project root:
+    python dev/bench_plot_template.py [csv_path]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.image as mpimg
+import numpy as np
+
+from data_loader import WINDOW_DAYS
+from data_processing import read_and_prepare_data, prepare_data_for_graphs, extract_plotting_data
+from graph_generation import plot_with_matplotlib
+
+csv_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(ROOT, "data", "database.csv")
+grouped = prepare_data_for_graphs(read_and_prepare_data(csv_path, last_days=WINDOW_DAYS))
+stations = [(name, group.sort_values("fecha")) for name, group in grouped]
+print(f"{len(stations)} stations from {os.path.basename(csv_path)}")
+
+with tempfile.TemporaryDirectory() as tmpdir:
+    timings = {}
+    for label, reuse in (("baseline", False), ("template", True)):
+        out_dir = os.path.join(tmpdir, label)
+        os.makedirs(out_dir)
+        start = time.perf_counter()
+        for name, group in stations:
+            plot_with_matplotlib(extract_plotting_data(group, name, out_dir), reuse_figure=reuse)
+        timings[label] = (time.perf_counter() - start) / len(stations)
+        print(f"  {label:<9} {timings[label] * 1000:8.1f} ms/station")
+
+    print(f"  speed-up  {timings['baseline'] / timings['template']:8.2f}x")
+
+    compared = identical = 0
+    worst = 0.0
+    for fname in sorted(os.listdir(os.path.join(tmpdir, "baseline"))):
+        other = os.path.join(tmpdir, "template", fname)
+        if not os.path.exists(other):
+            print(f"  missing from template run: {fname}")
+            continue
+        a = mpimg.imread(os.path.join(tmpdir, "baseline", fname))
+        b = mpimg.imread(other)
+        compared += 1
+        if a.shape == b.shape and np.array_equal(a, b):
+            identical += 1
+        else:
+            diff = np.abs(a - b).max() if a.shape == b.shape else float("inf")
+            worst = max(worst, diff)
+            print(f"  differs: {fname} (max channel diff {diff:.3f})")
+    print(f"  {identical}/{compared} PNGs pixel-identical" + (f", worst diff {worst:.3f}" if worst else ""))
@@ -0,0 +1,50 @@
+"""
+bench_sparkline.py — History-chart (sparkline) benchmark: matplotlib figure
+vs. the Pillow backend of map_viewer.
+
+Renders the sparkline of every station with both backends (no cache) and
+reports milliseconds per station and average PNG size. With an output folder,
+both PNGs of every station are written side by side for visual comparison.
+
+Run from project root:
+    python dev/bench_sparkline.py [csv_path] [output_dir]
+"""
+
+import base64
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import matplotlib
+matplotlib.use("Agg")
+
+import map_viewer
+from map_viewer import build_station_history, SPARKLINE_BACKENDS
+
+csv_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(ROOT, "data", "database.csv")
+out_dir = sys.argv[2] if len(sys.argv) > 2 else None
+history = {name: df for name, df in build_station_history(csv_path).items() if len(df) >= 2}
+print(f"{len(history)} stations with >= 2 months from {os.path.basename(csv_path)}")
+
+results = {}
+for backend in SPARKLINE_BACKENDS:
+    map_viewer._render_sparkline(next(iter(history.values())), backend)   # warm-up (fonts, imports)
+    start = time.perf_counter()
+    results[backend] = {name: map_viewer._render_sparkline(df, backend) for name, df in history.items()}
+    elapsed = (time.perf_counter() - start) / len(history)
+    size = sum(len(base64.b64decode(b)) for b in results[backend].values()) / len(history)
+    results[backend + "_ms"] = elapsed * 1000
+    print(f"  {backend:<11} {elapsed * 1000:7.1f} ms/station  {size / 1024:6.1f} KB/PNG")
+
+print(f"  speed-up    {results['matplotlib_ms'] / results['pillow_ms']:7.1f}x")
+
+if out_dir:
+    os.makedirs(out_dir, exist_ok=True)
+    for name in history:
+        for backend in SPARKLINE_BACKENDS:
+            with open(os.path.join(out_dir, f"{name}_{backend}.png"), "wb") as f:
+                f.write(base64.b64decode(results[backend][name]))
+    print(f"  PNGs written to {out_dir}")
@@ -0,0 +1,72 @@
+"""
+bench_startup.py — Import-time breakdown of the GUI start-up (python -X importtime).
+
+Runs a fresh interpreter for each case and reports the total import time and
+its split by root package (self time of all its modules, e.g. PyQt6, pandas):
+  - gui      : import monthly_graph  (what the exe does before showing the window)
+  - pipeline : import download_database, graph_generation, map_viewer
+               (what gui.py used to import eagerly; now loaded by the workers
+               or by gui.PrewarmWorker after the window is visible)
+
+Run from project root:
+    python dev/bench_startup.py [top_n]
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CASES = (
+    ("gui", "import monthly_graph"),
+    ("pipeline", "import download_database, graph_generation, map_viewer"),
+)
+
+# Packages the GUI must not import before its window is shown
+HEAVY_PACKAGES = ("numpy", "pandas", "matplotlib", "bokeh", "folium", "requests",
+                  "download_database", "data_loader", "data_processing",
+                  "graph_generation", "map_viewer")
+
+
+def import_profile(statement):
+    """
+    Run `statement` under ``python -X importtime`` in a scratch directory
+    (monthly_graph.py opens its log file in the working directory).
+
+    Returns (total_seconds, {root_package: self_seconds}, modules): the total
+    includes the interpreter's own start-up imports (site, encodings, ...);
+    `modules` is the set of every module name imported.
+    """
+    env = {**os.environ, "PYTHONPATH": ROOT,
+           "QT_QPA_PLATFORM": os.environ.get("QT_QPA_PLATFORM", "offscreen")}
+    with tempfile.TemporaryDirectory() as cwd:
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", statement],
+            cwd=cwd, env=env, capture_output=True, text=True, timeout=300,
+        )
+    if proc.returncode != 0:
+        raise RuntimeError(f"'{statement}' failed: {proc.stderr.strip().splitlines()[-1]}")
+    packages, modules = {}, set()
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, _, name = line[len("import time:"):].split("|")
+        name = name.strip()
+        modules.add(name)
+        root = name.split(".")[0]
+        packages[root] = packages.get(root, 0.0) + int(own) / 1e6
+    return sum(packages.values()), packages, modules
+
+
+if __name__ == "__main__":
+    top_n = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    for label, statement in CASES:
+        total, packages, _ = import_profile(statement)
+        print(f"{label:<9} {total * 1000:8.1f} ms  ({statement})")
+        for name, seconds in sorted(packages.items(), key=lambda kv: -kv[1])[:top_n]:
+            print(f"    {name:<24} {seconds * 1000:8.1f} ms")
+    _, _, modules = import_profile(CASES[0][1])
+    heavy = [name for name in HEAVY_PACKAGES if name in modules]
+    print("heavy packages imported by the GUI at start-up: " + (", ".join(heavy) or "none"))
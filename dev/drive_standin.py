@@ -0,0 +1,124 @@
+"""
+drive_standin.py — Local HTTP stand-in for the Google Drive download endpoint.
+
+Serves one payload at http://127.0.0.1:<port>/uc the way Drive serves a large
+file: the first request (no ``confirm``) gets the HTML virus-scan warning page
+with a ``confirm=<token>`` link, the confirmed request gets the bytes. On top
+of that it can:
+  - honour ``Range: bytes=N-`` with ``If-Range`` (``ranges=False`` ignores it)
+  - drop the connection after ``drop_after`` body bytes (once)
+  - answer ``If-None-Match`` with 304 (``conditional=False`` ignores it)
+  - throttle file bodies to ``rate`` bytes/s
+and records every request, with the status sent, in ``.requests`` for
+assertions. ``etag_suffix`` changes the ETag without changing the bytes.
+
+Used by dev/test_suite.py:
+    with DriveStandIn(b"fecha,...") as drive:
+        download_file_from_google_drive("FILE", dest, url=drive.url)
+"""
+
+import hashlib
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+TOKEN = "t0k3n"
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        drive = self.server.drive
+        query = parse_qs(urlparse(self.path).query)
+        drive.requests.append({
+            "confirm":  query.get("confirm", [None])[0],
+            "range":    self.headers.get("Range"),
+            "if_range": self.headers.get("If-Range"),
+            "if_none_match": self.headers.get("If-None-Match"),
+        })
+
+        if "confirm" not in query:
+            page = (f'<html><body>Google Drive can\'t scan this file for viruses.'
+                    f'<a href="/uc?export=download&amp;confirm={TOKEN}&amp;id={query["id"][0]}">'
+                    f'Download anyway</a></body></html>').encode()
+            self._send(200, page, {"Content-Type": "text/html; charset=utf-8"})
+            return
+        if query["confirm"][0] != TOKEN:
+            self._send(403, b"bad token", {"Content-Type": "text/plain"})
+            return
+
+        payload, etag = drive.payload, drive.etag
+        headers = {"Content-Type": "application/octet-stream", "ETag": etag}
+        if drive.ranges:
+            headers["Accept-Ranges"] = "bytes"
+        if drive.conditional and self.headers.get("If-None-Match") == etag:
+            self._send(304, b"", {"ETag": etag})
+            return
+        status, start = 200, 0
+        match = re.match(r"bytes=(\d+)-$", self.headers.get("Range") or "")
+        if match and drive.ranges and self.headers.get("If-Range") in (None, etag):
+            start = int(match.group(1))
+            if start >= len(payload):
+                headers["Content-Range"] = f"bytes */{len(payload)}"
+                self._send(416, b"", headers)
+                return
+            status = 206
+            headers["Content-Range"] = f"bytes {start}-{len(payload) - 1}/{len(payload)}"
+        self._send(status, payload[start:], headers)
+
+    def _send(self, status, body, headers):
+        drive = self.server.drive
+        drive.requests[-1]["status"] = status
+        drive.requests[-1]["body_bytes"] = len(body)
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if status in (200, 206) and "ETag" in headers and drive.drop_after is not None:
+            body, drive.drop_after = body[:drive.drop_after], None
+            self.close_connection = True
+        try:
+            if drive.rate and "ETag" in headers:
+                step = max(drive.rate // 20, 1)
+                for i in range(0, len(body), step):
+                    self.wfile.write(body[i:i + step])
+                    self.wfile.flush()
+                    time.sleep(step / drive.rate)
+            else:
+                self.wfile.write(body)
+        except ConnectionError:
+            pass    # client closed after reading the headers
+
+
+class DriveStandIn:
+    """Threaded local server; use as a context manager."""
+
+    def __init__(self, payload, ranges=True, drop_after=None, conditional=True, rate=None):
+        self.payload = payload
+        self.rate = rate
+        self.ranges = ranges
+        self.drop_after = drop_after
+        self.conditional = conditional
+        self.etag_suffix = ""
+        self.requests = []
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._server.drive = self
+        self.url = f"http://127.0.0.1:{self._server.server_port}/uc?export=download"
+
+    @property
+    def etag(self):
+        return '"' + hashlib.sha1(self.payload).hexdigest()[:16] + self.etag_suffix + '"'
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
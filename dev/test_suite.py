@@ -7,6 +7,29 @@ Tests:
   3. data_processing: date auto-detection works for both CSV formats
   4. data_processing: full pipeline runs on local CSV without crashing
   5. download_database: live download from Google Drive produces a valid CSV
+  6. data_loader: parse-once dataset cache round-trips the CSV exactly,
+     typed column-pruned loading
+  7. data_loader: tail-window reader matches a full parse + 30-day filter
+  8. graph_generation: process-pool rendering matches serial output
+  9. data_processing: 'shared' HTML mode writes one BokehJS bundle
+ 10. data_processing: 'dashboard' HTML mode writes one multi-station page
+ 11. map_viewer: 'restyle' layer mode writes each popup once
+ 12. map_viewer: vectorized colours/radii match the per-value matplotlib path
+ 13. map_viewer: sparkline cache reuses unchanged histories, LRU-bounded
+ 14. map_viewer: Pillow sparkline backend produces the same-size PNG
+ 15. map_viewer: sidecar charts are written next to the map and lazy-loaded
+ 16. map_viewer: direct Leaflet engine embeds one GeoJSON FeatureCollection
+ 17. map_viewer: IDW rainfall surface is exact at stations, overlay in both engines
+ 18. download_database: dropped downloads resume with Range requests (local stand-in)
+ 19. download_database: unchanged remote database is not downloaded again
+ 20. data_loader: streaming ingest parses the download while it arrives
+ 21. download_database: progress/throughput callback, adaptive chunks, stats log
+ 22. cli: headless batch mode runs without importing PyQt6, prints stage timings
+ 23. gui: start-up imports only Qt (-X importtime); pipeline modules prewarmed after show
+ 24. graph_generation: incremental reruns hard-link unchanged stations via the manifest
+ 25. graph_generation: backfill renders every month from one parse, same output as a trimmed CSV
+ 26. watch_folder: debounced polling, bounded queue, each file content processed once
+ 27. graph_generation: staged render pipeline matches per-station rendering, exports stage timings
 
 Run from project root:
     python dev/test_suite.py
@@ -21,6 +44,7 @@ import tempfile
 ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 LOG = os.path.join(ROOT, "dev", "test_output.txt")
 sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "dev"))
 
 _lines = []
 
@@ -72,14 +96,18 @@ try:
 
     iso_rows = "fecha,Nombre,lluvia\n2024-03-01,STA,1.0\n2024-03-02,STA,2.0\n"
     dmy_rows = "fecha,Nombre,lluvia\n01/03/2024,STA,1.0\n02/03/2024,STA,2.0\n"
+    unpadded_rows = "fecha,Nombre,lluvia\n1/3/2024,STA,1.0\n2/3/2024,STA,2.0\n"
+    mixed_rows = "fecha,Nombre,lluvia\n2024-03-01,STA,1.0\n2/3/2024,STA,2.0\n03/03/2024,STA,3.0\n"
 
-    for label, content in [("YYYY-MM-DD", iso_rows), ("DD/MM/YYYY", dmy_rows)]:
+    for label, content in [("YYYY-MM-DD", iso_rows), ("DD/MM/YYYY", dmy_rows),
+                           ("D/M/YYYY", unpadded_rows), ("mixed formats", mixed_rows)]:
         with tempfile.NamedTemporaryFile(mode="w", suffix=".csv", delete=False, encoding="utf-8") as f:
             f.write(content)
             tmp = f.name
         try:
             df = read_and_prepare_data(tmp)
-            ok = pd.api.types.is_datetime64_any_dtype(df["fecha"])
+            ok = (pd.api.types.is_datetime64_any_dtype(df["fecha"])
+                  and df["fecha"].dt.month.eq(3).all() and df["fecha"].dt.day.iloc[0] == 1)
             check(f"read_and_prepare_data handles {label}", ok)
         except Exception as e:
             check(f"read_and_prepare_data handles {label}", False, str(e))
@@ -91,10 +119,16 @@ except Exception as e:
 # ── 4. Full pipeline on local CSV ─────────────────────────────────────────────
 log("\n[4] Full graph pipeline (local CSV — writes to temp dir)")
 try:
+    import shutil
     from data_processing import read_and_prepare_data, prepare_data_for_graphs, process_grouped_data
 
-    df = read_and_prepare_data(csv_path)
-    check("CSV read OK", len(df) > 0, f"{len(df)} rows loaded")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = csv_path
+        if not os.path.isfile(source):
+            # No export downloaded yet: read a copy of the bundled historical file
+            source = shutil.copy(os.path.join(ROOT, "data", "database.csv"), tmpdir)
+        df = read_and_prepare_data(source)
+    check("CSV read OK", len(df) > 0, f"{len(df)} rows loaded from {os.path.basename(source)}")
 
     grouped = prepare_data_for_graphs(df)
     groups = list(grouped)
@@ -144,6 +178,1035 @@ try:
 except Exception as e:
     check("download test", False, str(e))
 
+# ── 6. Dataset cache ──────────────────────────────────────────────────────────
+log("\n[6] Parse-once dataset cache (data_loader)")
+try:
+    import shutil
+    import pandas as pd
+    from data_loader import read_csv, load_dataset, default_cache_dir
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmp_csv = os.path.join(tmpdir, "database.csv")
+        shutil.copy2(os.path.join(ROOT, "data", "database.csv"), tmp_csv)
+
+        first = load_dataset(tmp_csv)
+        entries = os.listdir(default_cache_dir(tmp_csv))
+        check("first load writes one cache entry", len(entries) == 1, str(entries))
+
+        cached = load_dataset(tmp_csv)
+        try:
+            pd.testing.assert_frame_equal(cached, read_csv(tmp_csv))
+            check("cached load equals a fresh CSV parse", True)
+        except AssertionError as e:
+            check("cached load equals a fresh CSV parse", False, str(e)[:200])
+
+        subset = load_dataset(tmp_csv, columns=["fecha", "Nombre"])
+        check("column subset loads from cache", list(subset.columns) == ["fecha", "Nombre"])
+
+        graphs = load_dataset(tmp_csv, "graphs")
+        check("'graphs' set prunes unused columns",
+              "Fenomenos/0" not in graphs.columns and "hum_rel" in graphs.columns,
+              str(list(graphs.columns)))
+        check("measurements float32, Nombre categorical",
+              str(graphs["lluvia"].dtype) == "float32" and str(graphs["Nombre"].dtype) == "category")
+
+        renamed = os.path.join(tmpdir, "insivumeh_renamed.csv")
+        os.replace(tmp_csv, renamed)
+        load_dataset(renamed)
+        entries = os.listdir(default_cache_dir(renamed))
+        check("renamed file reuses the cache entry", len(entries) == 1, str(entries))
+except Exception as e:
+    check("dataset cache", False, str(e))
+
+# ── 7. Tail-window reader ─────────────────────────────────────────────────────
+log("\n[7] Tail-window reader (read_last_days)")
+try:
+    import pandas as pd
+    from data_loader import read_csv, read_last_days
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # database.csv is sorted by day-of-month; write a date-ordered copy
+        raw = pd.read_csv(os.path.join(ROOT, "data", "database.csv"))
+        order = pd.to_datetime(raw["fecha"], format="%d/%m/%Y").argsort(kind="stable")
+        sorted_csv = os.path.join(tmpdir, "sorted.csv")
+        raw.iloc[order].to_csv(sorted_csv, index=False)
+
+        full = read_csv(sorted_csv, "graphs")
+        expected = full[full["fecha"] >= full["fecha"].max() - pd.Timedelta(days=30)]
+        for block in (4096, 1 << 20):
+            tail = read_last_days(sorted_csv, 30, "graphs", block_size=block)
+            same = (len(tail) == len(expected)
+                    and tail["fecha"].tolist() == expected["fecha"].tolist()
+                    and tail["Nombre"].astype(str).tolist() == expected["Nombre"].astype(str).tolist())
+            check(f"ordered file, {block}-byte blocks: window rows match", same,
+                  f"{len(tail)} vs {len(expected)} rows")
+        check("first_fecha is the archive start",
+              tail.attrs.get("first_fecha") == full["fecha"].min())
+
+        # Unordered files must match a full-scan filter whatever the block size:
+        # database.csv (by day of month) and a copy sorted by (Nombre, fecha)
+        fechas = pd.to_datetime(raw["fecha"], format="%d/%m/%Y")
+        by_station = os.path.join(tmpdir, "by_station.csv")
+        raw.assign(_f=fechas).sort_values(["Nombre", "_f"], kind="stable").drop(columns="_f").to_csv(
+            by_station, index=False)
+        for label, path in (("database.csv", os.path.join(ROOT, "data", "database.csv")),
+                            ("station-sorted", by_station)):
+            full = read_csv(path, "graphs")
+            expected = full[full["fecha"] >= full["fecha"].max() - pd.Timedelta(days=30)]
+            for block in (4096, 1 << 20):
+                tail = read_last_days(path, 30, "graphs", block_size=block)
+                same = (len(tail) == len(expected)
+                        and sorted(zip(tail["fecha"], tail["Nombre"].astype(str)))
+                        == sorted(zip(expected["fecha"], expected["Nombre"].astype(str)))
+                        and tail.attrs.get("first_fecha") == full["fecha"].min())
+                check(f"unordered {label}, {block}-byte blocks: same window as a full scan", same,
+                      f"{len(tail)} vs {len(expected)} rows, {tail['Nombre'].nunique()} stations")
+except Exception as e:
+    check("tail-window reader", False, str(e))
+
+# ── 8. Parallel rendering ─────────────────────────────────────────────────────
+log("\n[8] Process-pool rendering (generate_graphs workers=2)")
+try:
+    os.environ.setdefault("MPLBACKEND", "Agg")
+    from graph_generation import generate_graphs
+
+    sample_csv = os.path.join(ROOT, "data", "shortscv.csv")
+    listings = {}
+    for workers in (1, 2):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            progress = []
+            run_folder = generate_graphs(tmpdir, sample_csv, workers=workers, progress=progress.append)
+            listings[workers] = sorted(
+                os.path.relpath(os.path.join(d, f), tmpdir)
+                for d, _, files in os.walk(tmpdir) for f in files
+            )
+            check(f"workers={workers}: run completes with progress 100",
+                  os.path.isdir(run_folder) and progress[-1:] == [100], os.path.basename(run_folder))
+    check("parallel run writes the same files as the serial run",
+          listings[1] == listings[2] and len(listings[1]) > 0, f"{len(listings[2])} files")
+except Exception as e:
+    check("parallel rendering", False, str(e))
+
+log("\n[9] Shared-resource Bokeh output (html_mode='shared')")
+try:
+    from graph_generation import generate_graphs
+    from data_processing import bokeh_bundle_name
+
+    sample_csv = os.path.join(ROOT, "data", "shortscv.csv")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        run_folder = generate_graphs(tmpdir, sample_csv, workers=1, html_mode="shared")
+        check("shared run completes", os.path.isdir(run_folder), os.path.basename(run_folder))
+        html_dir = os.path.join(run_folder, "html_output")
+        bundle = os.path.join(html_dir, "static", bokeh_bundle_name())
+        check("BokehJS bundle written once into html_output/static",
+              os.path.isfile(bundle) and os.listdir(os.path.dirname(bundle)) == [bokeh_bundle_name()])
+        pages = [f for f in os.listdir(html_dir) if f.endswith(".html")]
+        texts = [open(os.path.join(html_dir, f), encoding="utf-8").read() for f in pages]
+        check(f"{len(pages)} station pages reference the bundle, not the CDN",
+              bool(pages) and all(f'src="static/{bokeh_bundle_name()}"' in t and "cdn.bokeh.org" not in t
+                                  for t in texts))
+except Exception as e:
+    check("shared html mode", False, str(e))
+
+log("\n[10] Multi-station dashboard (html_mode='dashboard')")
+try:
+    from graph_generation import generate_graphs
+
+    sample_csv = os.path.join(ROOT, "data", "shortscv.csv")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        run_folder = generate_graphs(tmpdir, sample_csv, workers=1, html_mode="dashboard")
+        check("dashboard run completes", os.path.isdir(run_folder), os.path.basename(run_folder))
+        html_dir = os.path.join(run_folder, "html_output")
+        pages = os.listdir(html_dir)
+        check("html_output holds a single dashboard page",
+              len(pages) == 1 and pages[0].startswith("panel_estaciones_"), str(pages))
+        pngs = os.listdir(os.path.join(run_folder, "img_output"))
+        text = open(os.path.join(html_dir, pages[0]), encoding="utf-8").read()
+        check(f"dashboard lists all {len(pngs)} stations, PNGs still rendered",
+              bool(pngs) and all(f'"{os.path.splitext(p)[0]}"' in text for p in pngs))
+except Exception as e:
+    check("dashboard html mode", False, str(e))
+
+log("\n[11] Station map layer modes (layers vs restyle)")
+try:
+    from map_viewer import build_station_summary, generate_map, VARIABLES
+
+    sample_csv = os.path.join(ROOT, "data", "shortscv.csv")
+    summary = build_station_summary(sample_csv)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        popups = {}
+        for mode in ("layers", "restyle"):
+            path = generate_map(summary, os.path.join(tmpdir, mode), layer_mode=mode)
+            text = open(path, encoding="utf-8").read()
+            popups[mode] = text.count("L.popup(")
+        check(f"layers mode: one popup per station per variable ({popups['layers']})",
+              popups["layers"] == len(summary) * len(VARIABLES))
+        check(f"restyle mode: one popup per station ({popups['restyle']})",
+              popups["restyle"] == len(summary))
+except Exception as e:
+    check("map layer modes", False, str(e))
+
+log("\n[12] Vectorized marker colours and radii")
+try:
+    import numpy as np
+    import matplotlib
+    import matplotlib.colors as mcolors
+    from map_viewer import _values_to_hex, _values_to_radius, NAN_COLOR
+
+    values = np.append(np.random.default_rng(0).uniform(-10, 310, 500), [np.nan, 0.0, 300.0])
+    for cmap_name in ("Blues", "RdYlBu_r", "YlGnBu"):
+        norm = mcolors.Normalize(vmin=0.0, vmax=300.0, clip=True)
+        expected = [NAN_COLOR if np.isnan(v) else mcolors.to_hex(matplotlib.colormaps[cmap_name](norm(v)))
+                    for v in values]
+        check(f"{cmap_name}: LUT colours match Normalize + colormap",
+              _values_to_hex(values, 0.0, 300.0, cmap_name).tolist() == expected)
+    radii = _values_to_radius(values, 0.0, 300.0, 5, 22)
+    expected = [5 if np.isnan(v) else 5 + np.sqrt(max(v, 0.0)) / np.sqrt(300.0) * 17 for v in values]
+    check("radii match the scalar square-root scaling", np.allclose(radii, expected))
+except Exception as e:
+    check("vectorized marker styling", False, str(e))
+
+log("\n[13] Sparkline cache")
+try:
+    import map_viewer
+    from map_viewer import build_station_history, _build_sparklines, _evict_sparklines
+
+    history = build_station_history(os.path.join(ROOT, "data", "shortscv.csv"))
+    history = dict(list(history.items())[:6])
+    with tempfile.TemporaryDirectory() as cache_dir:
+        rendered = []
+        original = map_viewer._sparkline_b64
+        map_viewer._sparkline_b64 = lambda df: rendered.append(1) or original(df)
+        try:
+            first = _build_sparklines(history, cache_dir)
+            n_first = len(rendered)
+            second = _build_sparklines(history, cache_dir)
+            n_second = len(rendered) - n_first
+            name = next(iter(history))
+            changed = dict(history)
+            changed[name] = history[name].assign(lluvia_total=history[name]["lluvia_total"] + 1)
+            _build_sparklines(changed, cache_dir)
+            n_third = len(rendered) - n_first - n_second
+        finally:
+            map_viewer._sparkline_b64 = original
+        uncached = _build_sparklines(history)
+        check(f"first run renders, second run reuses all ({n_first} → {n_second})",
+              n_first > 0 and n_second == 0)
+        check("cached sparklines equal freshly rendered ones", first == second == uncached)
+        check(f"only the changed station is re-rendered ({n_third})", n_third == 1)
+        sizes = [e.stat().st_size for e in os.scandir(cache_dir)]
+        _evict_sparklines(cache_dir, max_bytes=sum(sizes) // 2)
+        left = sum(e.stat().st_size for e in os.scandir(cache_dir))
+        check("eviction keeps the cache under its byte bound", left <= sum(sizes) // 2)
+except Exception as e:
+    check("sparkline cache", False, str(e))
+
+log("\n[14] Pillow sparkline backend")
+try:
+    import base64
+    import io
+    import numpy as np
+    from PIL import Image
+    import map_viewer
+    from map_viewer import build_station_history, _render_sparkline, _sparkline_key
+
+    history = build_station_history(os.path.join(ROOT, "data", "shortscv.csv"))
+    df = next(d for d in history.values() if len(d) >= 2)
+    sizes = {}
+    for backend in ("matplotlib", "pillow"):
+        png = base64.b64decode(_render_sparkline(df, backend))
+        sizes[backend] = (Image.open(io.BytesIO(png)).size, len(png))
+    check(f"pillow PNG has the matplotlib image size {sizes['matplotlib'][0]}",
+          sizes["pillow"][0] == sizes["matplotlib"][0], str(sizes["pillow"][0]))
+    check(f"pillow PNG is smaller ({sizes['pillow'][1]} vs {sizes['matplotlib'][1]} bytes)",
+          sizes["pillow"][1] < sizes["matplotlib"][1])
+    check("cache keys differ per backend",
+          _sparkline_key(df, "matplotlib") != _sparkline_key(df, "pillow"))
+
+    # Pixel comparison with the matplotlib chart: same plot box, same bars,
+    # same temperature line (within a couple of pixels of anti-aliasing)
+    def spark_rgb(station_df, backend):
+        png = base64.b64decode(_render_sparkline(station_df, backend))
+        return np.asarray(Image.open(io.BytesIO(png)).convert("RGB")).astype(int)
+
+    def colour_mask(rgb, colour):
+        return np.abs(rgb - np.array(colour)).max(axis=2) < 40
+
+    def frame_columns(rgb):
+        cols = np.where((rgb.max(axis=2) < 80).sum(axis=0) > 60)[0]
+        return cols.min(), cols.max()
+
+    wet = next(d for d in history.values() if len(d) >= 2
+               and (d["lluvia_total"] > 0).any() and d["tseca_mean"].notna().all())
+    dry = next(d for d in history.values() if len(d) >= 2 and (d["lluvia_total"].fillna(0) == 0).all())
+    for label, station_df in (("rain + temperature", wet), ("no rain", dry)):
+        mpl_rgb, pil_rgb = spark_rgb(station_df, "matplotlib"), spark_rgb(station_df, "pillow")
+        check(f"pillow plot box matches matplotlib ({label})",
+              np.allclose(frame_columns(mpl_rgb), frame_columns(pil_rgb), atol=1),
+              f"{frame_columns(pil_rgb)} vs {frame_columns(mpl_rgb)}")
+
+    mpl_rgb, pil_rgb = spark_rgb(wet, "matplotlib"), spark_rgb(wet, "pillow")
+    inner = slice(frame_columns(mpl_rgb)[0] + 2, frame_columns(mpl_rgb)[1] - 1)
+    mpl_bar, pil_bar = (colour_mask(rgb, map_viewer._SPK_BAR)[:, inner] for rgb in (mpl_rgb, pil_rgb))
+    mpl_cols, pil_cols = mpl_bar.sum(axis=0) >= 3, pil_bar.sum(axis=0) >= 3
+    overlap = (mpl_cols & pil_cols).sum() / max((mpl_cols | pil_cols).sum(), 1)
+    top_diff = np.abs(mpl_bar.argmax(axis=0) - pil_bar.argmax(axis=0))[mpl_cols & pil_cols]
+    check(f"pillow bars cover the matplotlib bars ({overlap:.0%} of columns)", overlap >= 0.9)
+    check("pillow bar heights within 2 px of matplotlib",
+          top_diff.size > 0 and np.median(top_diff) <= 2, f"median {np.median(top_diff)}")
+
+    rows = np.arange(mpl_rgb.shape[0])[:, None]
+    line_y = []
+    for rgb in (mpl_rgb, pil_rgb):
+        mask = colour_mask(rgb, map_viewer._SPK_LINE)[:, inner]
+        line_y.append(np.where(mask.any(axis=0), (mask * rows).sum(axis=0) / np.maximum(mask.sum(axis=0), 1), np.nan))
+    both = ~np.isnan(line_y[0]) & ~np.isnan(line_y[1])
+    line_diff = np.abs(line_y[0] - line_y[1])[both].mean()
+    check(f"pillow temperature line within 2 px of matplotlib (mean {line_diff:.2f} px)",
+          both.sum() > 50 and line_diff <= 2)
+except Exception as e:
+    check("pillow sparkline backend", False, str(e))
+
+log("\n[15] Sidecar popup charts (charts='sidecar')")
+try:
+    import re
+    import map_viewer
+    from map_viewer import build_station_summary, build_station_history, generate_map
+
+    sample_csv = os.path.join(ROOT, "data", "shortscv.csv")
+    summary = build_station_summary(sample_csv)
+    history = build_station_history(sample_csv)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = generate_map(summary, tmpdir, history, layer_mode="restyle", charts="sidecar",
+                            sparkline_backend="pillow", cache_sparklines=False, rain_surface=False)
+        text = open(path, encoding="utf-8").read()
+        assets = path[:-len(".html")] + "_files"
+        files = os.listdir(assets) if os.path.isdir(assets) else []
+        expected = sum(1 for df in history.values() if len(df) >= 2)
+        check(f"{len(files)} chart files written to {os.path.basename(assets)}/",
+              len(files) == expected and expected > 0, f"expected {expected}")
+        mapped = sum(1 for name in summary["Nombre"] if len(history.get(name, ())) >= 2)
+        check(f"map embeds no base64 charts, {mapped} popups reference data-src",
+              "base64," not in text and text.count("data-src=") == mapped)
+        check("popup images are loaded on popupopen", 'on("popupopen"' in text)
+
+        # Regenerating the same map drops the charts of stations that left it
+        gone = next(name for name, df in history.items() if len(df) >= 2)
+        stale = os.path.join(assets, re.sub(r"[^\w.-]", "_", gone) + ".png")
+        kept_before = os.path.isfile(stale)
+        again = generate_map(summary[summary["Nombre"] != gone], tmpdir,
+                             {name: df for name, df in history.items() if name != gone},
+                             charts="sidecar", sparkline_backend="pillow", cache_sparklines=False)
+        check("regenerated map removes charts of stations no longer present",
+              again == path and kept_before and not os.path.exists(stale)
+              and len(os.listdir(assets)) == expected - 1, f"{len(os.listdir(assets))} files")
+        check(f"popup DOM built on first click (folium {map_viewer.folium.__version__})",
+              not map_viewer.POPUP_LAZY or text.count(".once('click'") == mapped)
+
+        # A folium without Popup(lazy=) must not get the keyword, and is reported
+        import logging
+        saved_lazy, map_viewer.POPUP_LAZY = map_viewer.POPUP_LAZY, False
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logging.getLogger().addHandler(handler)
+        try:
+            path = generate_map(summary, tmpdir, history, charts="sidecar", sparkline_backend="pillow",
+                                cache_sparklines=False, rain_surface=False)
+        finally:
+            map_viewer.POPUP_LAZY = saved_lazy
+            logging.getLogger().removeHandler(handler)
+        text = open(path, encoding="utf-8").read()
+        check("without lazy popups: eager popups, no stray 'lazy' option, warning logged",
+              ".once('click'" not in text and '"lazy"' not in text
+              and any("no lazy popups" in r.getMessage() for r in records))
+except Exception as e:
+    check("sidecar popup charts", False, str(e))
+
+log("\n[16] Direct Leaflet map engine (engine='leaflet')")
+try:
+    import json
+    from map_viewer import build_station_summary, generate_map, VARIABLES
+
+    summary = build_station_summary(os.path.join(ROOT, "data", "shortscv.csv"))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = generate_map(summary, tmpdir, engine="leaflet")
+        text = open(path, encoding="utf-8").read()
+        start = text.index("var data = ") + len("var data = ")
+        data = json.loads(text[start:text.index(";\n", start)].replace("<\\/", "</"))
+        features = data["stations"]["features"]
+        check(f"one GeoJSON feature per station ({len(features)})", len(features) == len(summary))
+        check("styles for every variable, one colour per station",
+              list(data["styles"]) == list(VARIABLES)
+              and all(len(st["colors"]) == len(summary) for st in data["styles"].values()))
+        script = text[text.index("<script>\n(function()"):]
+        check("popup HTML cannot close the <script> block early",
+              script.count("</script>") == 1 and "L.heatLayer" in script)
+except Exception as e:
+    check("leaflet map engine", False, str(e))
+
+log("\n[17] Interpolated rainfall surface (IDW image overlay)")
+try:
+    import numpy as np
+    import map_viewer as mv
+
+    pts = np.array([[0.0, 0.0], [10.0, 0.0], [0.0, 10.0]])
+    vals = np.array([10.0, 20.0, 30.0])
+    est, nearest = mv._idw_grid(pts, vals, np.array([0.0, 5.0, 10.0]), np.array([0.0, 10.0]))
+    check("IDW returns the station value on top of a station",
+          est[0, 0] == 10.0 and est[0, 2] == 20.0 and est[1, 0] == 30.0 and nearest[0, 0] == 0.0)
+    check("IDW stays within the station range", vals.min() <= est.min() and est.max() <= vals.max())
+
+    # Enough stations for the tiled neighbour pruning to drop candidates;
+    # the grid is not a multiple of the tile size, so edge tiles are partial
+    rng = np.random.default_rng(17)
+    pts = rng.uniform(0.0, 200.0, size=(300, 2))
+    vals = rng.uniform(0.0, 100.0, size=300)
+    xs, ys = np.linspace(-20.0, 220.0, 90), np.linspace(-20.0, 220.0, 70)
+    est, nearest = mv._idw_grid(pts, vals, xs, ys)
+    d = np.hypot(xs[None, :, None] - pts[:, 0], ys[:, None, None] - pts[:, 1])
+    idx = np.argsort(d, axis=-1)[..., :mv.RAIN_SURFACE_NEIGHBOURS]
+    w = 1.0 / np.take_along_axis(d, idx, axis=-1) ** mv.RAIN_SURFACE_POWER
+    brute = (w * vals[idx]).sum(axis=-1) / w.sum(axis=-1)
+    check("tiled IDW matches a dense brute-force IDW (300 stations)",
+          np.allclose(est, brute, rtol=1e-12, atol=0) and np.array_equal(nearest, d.min(axis=-1)),
+          f"max diff {np.abs(est - brute).max():.2e}")
+
+    summary = mv.build_station_summary(os.path.join(ROOT, "data", "shortscv.csv"))
+    surface = mv._rain_surface(summary)
+    check("surface is a PNG data URI", surface is not None and surface["url"].startswith("data:image/png;base64,"))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for engine in mv.MAP_ENGINES:
+            text = open(mv.generate_map(summary, os.path.join(tmpdir, engine), engine=engine,
+                                        rain_surface=True), encoding="utf-8").read()
+            check(f"{engine}: overlay and legend toggle present",
+                  surface["url"][:200] in text and text.count('"overlayadd"') == 1)
+        text = open(mv.generate_map(summary, os.path.join(tmpdir, "off")), encoding="utf-8").read()
+        check("overlay is opt-in (off by default)", mv.RAIN_SURFACE_LABEL not in text)
+except Exception as e:
+    check("rainfall surface", False, str(e))
+
+log("\n[18] Resumable download (local Drive stand-in)")
+try:
+    import logging
+    from download_database import download_file_from_google_drive, part_state_path
+    from drive_standin import DriveStandIn
+
+    logging.disable(logging.CRITICAL)
+    with open(os.path.join(ROOT, "data", "shortscv.csv"), "rb") as f:
+        header, body = f.read().split(b"\n", 1)
+    payload = header + b"\n" + body * 40   # many CHUNK_SIZE reads
+    with tempfile.TemporaryDirectory() as tmpdir:
+        dest = os.path.join(tmpdir, "_download_temp.csv")
+        with DriveStandIn(payload, drop_after=len(payload) // 3) as drive:
+            first = download_file_from_google_drive("FILE", dest, url=drive.url)
+            check("dropped connection keeps the partial file and its sidecar",
+                  first is False and os.path.exists(part_state_path(dest))
+                  and 0 < os.path.getsize(dest) < len(payload),
+                  f"{os.path.getsize(dest):,} of {len(payload):,} bytes")
+            partial = os.path.getsize(dest)
+            del drive.requests[:]
+            second = download_file_from_google_drive("FILE", dest, url=drive.url)
+            check("second call resumes through the interstitial with a Range request",
+                  second is True and drive.requests[-1]["range"] == f"bytes={partial}-"
+                  and drive.requests[-1]["confirm"] is not None)
+            check("resumed file is byte-identical, sidecar removed",
+                  open(dest, "rb").read() == payload and not os.path.exists(part_state_path(dest)))
+
+            # Server copy changes between the drop and the retry: If-Range → full 200
+            drive.drop_after = len(payload) // 2
+            download_file_from_google_drive("FILE", dest, url=drive.url)
+            old_etag = drive.etag
+            drive.payload = payload.replace(b",", b";")
+            ok = download_file_from_google_drive("FILE", dest, url=drive.url)
+            check("changed server copy (If-Range mismatch) restarts from byte zero",
+                  ok and drive.requests[-1]["if_range"] == old_etag
+                  and open(dest, "rb").read() == drive.payload)
+
+        with DriveStandIn(payload, ranges=False, drop_after=len(payload) // 2) as drive:
+            download_file_from_google_drive("FILE", dest, url=drive.url)
+            ok = download_file_from_google_drive("FILE", dest, url=drive.url)
+            check("server without Range support restarts cleanly",
+                  ok and open(dest, "rb").read() == payload)
+    logging.disable(logging.NOTSET)
+except Exception as e:
+    check("resumable download", False, str(e))
+
+log("\n[19] Conditional re-download (update_database)")
+try:
+    import logging
+    from download_database import update_database, STATE_NAME, TEMP_NAME
+    from drive_standin import DriveStandIn
+
+    logging.disable(logging.CRITICAL)
+    with open(os.path.join(ROOT, "data", "shortscv.csv"), "rb") as f:
+        payload = f.read()
+    with tempfile.TemporaryDirectory() as data_dir:
+        with DriveStandIn(payload) as drive:
+            first = update_database(data_dir, "FILE", url=drive.url)
+            check("first call downloads and names the file",
+                  first is not None and first["changed"] and first["name"].startswith("insivumeh_")
+                  and os.path.exists(os.path.join(data_dir, STATE_NAME)), first and first["name"])
+
+            del drive.requests[:]
+            second = update_database(data_dir, "FILE", url=drive.url)
+            check("unchanged remote: 304, existing file reused",
+                  second is not None and not second["changed"] and second["path"] == first["path"]
+                  and drive.requests[-1]["status"] == 304
+                  and not os.path.exists(os.path.join(data_dir, TEMP_NAME)))
+
+            drive.conditional = False
+            del drive.requests[:]
+            third = update_database(data_dir, "FILE", url=drive.url)
+            check("server ignoring If-None-Match: same ETag on the 200 still skips the body",
+                  third is not None and not third["changed"] and drive.requests[-1]["status"] == 200)
+
+            drive.etag_suffix = "-v2"
+            fourth = update_database(data_dir, "FILE", url=drive.url)
+            check("new ETag, same bytes: content hash keeps the existing file",
+                  fourth is not None and not fourth["changed"] and fourth["path"] == first["path"])
+
+            drive.payload = payload.rstrip(b"\n").rsplit(b"\n", 1)[0] + b"\n"
+            fifth = update_database(data_dir, "FILE", url=drive.url)
+            check("changed remote is downloaded again",
+                  fifth is not None and fifth["changed"]
+                  and open(fifth["path"], "rb").read() == drive.payload)
+
+    # Without ETags a malformed Content-Length means "changed", not a crash
+    from types import SimpleNamespace
+    from download_database import _same_remote
+    known = {"etag": None, "last_modified": "Tue, 01 Aug 2023 00:00:00 GMT", "length": 1234}
+    headers = {"Last-Modified": known["last_modified"], "Content-Length": "1234"}
+    check("same Last-Modified and Content-Length: unchanged",
+          _same_remote(SimpleNamespace(headers=headers), known))
+    check("non-numeric Content-Length counts as changed",
+          not _same_remote(SimpleNamespace(headers=dict(headers, **{"Content-Length": "12 34"})), known))
+    logging.disable(logging.NOTSET)
+except Exception as e:
+    check("conditional re-download", False, str(e))
+
+log("\n[20] Streaming ingest (StreamingIngest fed from the download)")
+try:
+    import hashlib
+    import logging
+    import pandas as pd
+    import data_loader
+    from data_loader import StreamingIngest, read_csv, cache_key, default_cache_dir
+    from download_database import update_database
+    from drive_standin import DriveStandIn
+
+    db_path = os.path.join(ROOT, "data", "database.csv")
+    with open(db_path, "rb") as f:
+        payload = f.read()
+    saved_block = data_loader.INGEST_BLOCK_BYTES
+    data_loader.INGEST_BLOCK_BYTES = 100_000          # several parse blocks
+    try:
+        ingest = StreamingIngest()
+        for i in range(0, len(payload), 7777):        # chunks cut mid-line
+            ingest.feed(payload[i:i + 7777])
+        summary = ingest.close()
+        reference = read_csv(db_path)
+        try:
+            pd.testing.assert_frame_equal(ingest.dataframe(), reference)
+            same = True
+        except AssertionError:
+            same = False
+        check("parsed blocks equal read_csv()", same)
+        counts = reference.groupby("Nombre", observed=True).size().sort_index()
+        check(f"running stats: {summary['rows']:,} rows, {summary['stations']} stations",
+              summary["rows"] == len(reference) and summary["station_rows"].equals(counts)
+              and summary["first_fecha"] == reference["fecha"].min()
+              and summary["last_fecha"] == reference["fecha"].max()
+              and summary["sha256"] == hashlib.sha256(payload).hexdigest())
+
+        logging.disable(logging.CRITICAL)
+        with tempfile.TemporaryDirectory() as data_dir:
+            with DriveStandIn(payload, drop_after=len(payload) // 2) as drive:
+                update_database(data_dir, "FILE", url=drive.url)      # dropped
+                result = update_database(data_dir, "FILE", url=drive.url)
+            check("resumed download is ingested in full",
+                  result is not None and result["rows"] == len(reference), str(result and result["rows"]))
+            entry = os.path.join(default_cache_dir(result["path"]), cache_key(result["path"]))
+            check("dataset cache of the final file written during the download",
+                  os.path.isfile(os.path.join(entry, "meta.json")))
+
+        # A parse error while streaming must not cost the download
+        with tempfile.TemporaryDirectory() as data_dir:
+            parse_pending = StreamingIngest._parse_pending
+
+            def fail_once(self):
+                StreamingIngest._parse_pending = parse_pending
+                raise ValueError("parser failure")
+
+            StreamingIngest._parse_pending = fail_once
+            try:
+                with DriveStandIn(payload) as drive:
+                    result = update_database(data_dir, "FILE", url=drive.url)
+            finally:
+                StreamingIngest._parse_pending = parse_pending
+            check("ingest error mid-stream: download completes, file loaded afterwards",
+                  result is not None and result["rows"] == len(reference)
+                  and os.path.getsize(result["path"]) == len(payload), str(result and result["rows"]))
+
+        with tempfile.TemporaryDirectory() as data_dir:
+            lines = payload.split(b"\n")
+            fields = lines[len(lines) // 2].split(b",")
+            fields[1] = b"no-es-fecha"
+            lines[len(lines) // 2] = b",".join(fields)
+            bad_payload = b"\n".join(lines)
+            try:
+                with DriveStandIn(bad_payload) as drive:
+                    update_database(data_dir, "FILE", url=drive.url)
+                error = ""
+            except ValueError as e:
+                error = str(e)
+            kept = [n for n in os.listdir(data_dir) if os.path.isfile(os.path.join(data_dir, n))
+                    and os.path.getsize(os.path.join(data_dir, n)) == len(bad_payload)]
+            check("unparseable fecha: ValueError after a complete download, bytes kept",
+                  "no-es-fecha" in error and len(kept) == 1, error[:80])
+        logging.disable(logging.NOTSET)
+    finally:
+        data_loader.INGEST_BLOCK_BYTES = saved_block
+except Exception as e:
+    check("streaming ingest", False, str(e))
+
+log("\n[21] Download telemetry (throttled stand-in)")
+try:
+    import json
+    import logging
+    import download_database as dd
+    from drive_standin import DriveStandIn
+
+    logging.disable(logging.CRITICAL)
+    with open(os.path.join(ROOT, "data", "shortscv.csv"), "rb") as f:
+        header, body = f.read().split(b"\n", 1)
+    payload = header + b"\n" + body * 15            # ~320 KB
+    rate = 150_000
+    events = []
+    with tempfile.TemporaryDirectory() as data_dir:
+        with DriveStandIn(payload, rate=rate) as drive:
+            result = dd.update_database(data_dir, "FILE", url=drive.url, progress=events.append)
+        check("throttled download completes", result is not None and result["changed"])
+        sizes = [e["bytes"] for e in events]
+        check(f"progress reported {len(events)} times, monotonic, ends at the total",
+              len(events) >= 3 and sizes == sorted(sizes) and events[-1]["done"]
+              and events[-1]["bytes"] == events[-1]["total"] == len(payload))
+        mid = events[len(events) // 2]
+        check(f"rate ~{rate / 1e6:.2f} MB/s measured ({mid['mb_per_s']:.3f}), ETA consistent",
+              0.5 * rate < mid["rate"] < 1.5 * rate and mid["eta"] is not None
+              and abs(mid["eta"] - (mid["total"] - mid["bytes"]) / mid["rate"]) < 1e-6)
+        with open(os.path.join(data_dir, dd.STATS_NAME), encoding="utf-8") as f:
+            record = json.loads(f.readlines()[-1])
+        check("stats log line written",
+              record["status"] == "downloaded" and record["bytes"] == len(payload)
+              and record["chunk_final"] == dd.MIN_CHUNK_SIZE,
+              f"{record['mb_per_s']} MB/s, {record['chunks']} chunks, stall {record['max_stall_s']} s")
+
+        with DriveStandIn(payload * 25, rate=20_000_000) as drive:
+            stats = dd.TransferStats()
+            dd._download("FILE", os.path.join(data_dir, "fast.csv"), drive.url, stats=stats)
+        check("chunk size grows on a fast link",
+              stats.record()["chunk_max"] > dd.CHUNK_SIZE, str(stats.record()["chunk_max"]))
+    logging.disable(logging.NOTSET)
+except Exception as e:
+    check("download telemetry", False, str(e))
+
+log("\n[22] Headless command line (cli.py)")
+try:
+    import subprocess
+    cli = os.path.join(ROOT, "cli.py")
+    probe = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c",
+         "import cli, download_database, graph_generation, map_viewer"],
+        cwd=ROOT, capture_output=True, text=True, timeout=120,
+    )
+    check("pipeline modules import without PyQt6",
+          probe.returncode == 0 and "PyQt6" not in probe.stderr,
+          f"{probe.stderr.count('import time:')} modules imported")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        run = subprocess.run(
+            [sys.executable, cli, "map", "--csv", os.path.join(ROOT, "data", "shortscv.csv"),
+             "--output", tmpdir, "--sparkline-backend", "pillow"],
+            cwd=tmpdir, capture_output=True, text=True, timeout=300,
+        )
+        maps = [f for f in os.listdir(tmpdir) if f.startswith("mapa_") and f.endswith(".html")]
+        check("cli.py map exits 0 and writes the map", run.returncode == 0 and len(maps) == 1,
+              run.stderr[-300:])
+        check("startup and stage timings printed",
+              "arranque:" in run.stdout and "[mapa]" in run.stdout and "total:" in run.stdout,
+              run.stdout.strip().replace("\n", " | "))
+        bad = subprocess.run(
+            [sys.executable, cli, "graphs", "--csv", os.path.join(tmpdir, "missing.csv"),
+             "--output", tmpdir],
+            cwd=tmpdir, capture_output=True, text=True, timeout=120,
+        )
+        check("failing stage exits 1 with an error line",
+              bad.returncode == 1 and bad.stderr.startswith("error:"), bad.stderr.strip())
+        no_fecha = os.path.join(tmpdir, "sin_fecha.csv")
+        with open(no_fecha, "w") as f:
+            f.write("a,b\n1,2\n")
+        bad = subprocess.run([sys.executable, cli, "graphs", "--csv", no_fecha, "--output", tmpdir],
+                             cwd=tmpdir, capture_output=True, text=True, timeout=120)
+        check("CSV without 'fecha' exits 1 without a traceback",
+              bad.returncode == 1 and bad.stderr.startswith("error:") and "Traceback" not in bad.stderr,
+              bad.stderr.strip()[-120:])
+        bad = subprocess.run([sys.executable, cli, "map", "--csv", no_fecha, "--output", tmpdir,
+                              "--engine", "openlayers"],
+                             cwd=tmpdir, capture_output=True, text=True, timeout=120)
+        check("unknown mode name exits 2 at argument parsing",
+              bad.returncode == 2 and "invalid choice" in bad.stderr, bad.stderr.strip()[-120:])
+
+    import cli as cli_module
+    import data_processing
+    import map_viewer
+    check("cli.py option tuples match the stage modules",
+          cli_module.HTML_MODES == data_processing.HTML_MODES
+          and cli_module.MAP_ENGINES == map_viewer.MAP_ENGINES
+          and cli_module.LAYER_MODES == map_viewer.LAYER_MODES
+          and cli_module.CHART_MODES == map_viewer.CHART_MODES
+          and cli_module.SPARKLINE_BACKENDS == map_viewer.SPARKLINE_BACKENDS)
+    map_args = ["map", "--csv", "x.csv", "--output", "out"]
+    check("--rain-surface is opt-in",
+          not cli_module.build_parser().parse_args(map_args).rain_surface
+          and cli_module.build_parser().parse_args(map_args + ["--rain-surface"]).rain_surface)
+except Exception as e:
+    check("headless command line", False, str(e))
+
+log("\n[23] Lazy GUI start-up imports (-X importtime)")
+try:
+    import subprocess
+    from bench_startup import import_profile, HEAVY_PACKAGES
+
+    gui_s, gui_packages, gui_modules = import_profile("import monthly_graph")
+    pipe_s, _, _ = import_profile("import download_database, graph_generation, map_viewer")
+    heavy = [name for name in HEAVY_PACKAGES if name in gui_modules]
+    check("import monthly_graph loads no pipeline/heavy package", not heavy and "PyQt6" in gui_modules,
+          f"heavy: {heavy}" if heavy else f"{gui_s * 1000:.0f} ms, PyQt6 {gui_packages.get('PyQt6', 0) * 1000:.0f} ms")
+    check("GUI start-up imports cheaper than the pipeline imports", gui_s < pipe_s,
+          f"{gui_s * 1000:.0f} ms vs {pipe_s * 1000:.0f} ms")
+
+    probe = (
+        "import sys, time\n"
+        "from PyQt6.QtWidgets import QApplication\n"
+        "import gui\n"
+        "app = QApplication([])\n"
+        "w = gui.WeatherGraphsApp()\n"
+        "before = [m for m in gui.PREWARM_MODULES if m in sys.modules]\n"
+        "w.show()\n"
+        "deadline = time.time() + 120\n"
+        "while (w.prewarm_worker is None or not w.prewarm_worker.isFinished()) and time.time() < deadline:\n"
+        "    app.processEvents(); time.sleep(0.01)\n"
+        "print(len(before), len([m for m in gui.PREWARM_MODULES if m in sys.modules]), len(gui.PREWARM_MODULES))\n"
+    )
+    with tempfile.TemporaryDirectory() as tmpdir:
+        run = subprocess.run(
+            [sys.executable, "-c", probe], cwd=tmpdir, capture_output=True, text=True, timeout=300,
+            env={**os.environ, "PYTHONPATH": ROOT, "QT_QPA_PLATFORM": "offscreen"},
+        )
+    counts = run.stdout.split()
+    check("prewarm thread imports the pipeline after the window is shown",
+          run.returncode == 0 and len(counts) == 3 and counts[0] == "0" and counts[1] == counts[2],
+          run.stdout.strip() or run.stderr[-300:])
+except Exception as e:
+    check("lazy GUI start-up", False, str(e))
+
+log("\n[24] Incremental regeneration (station manifest)")
+try:
+    import json
+    import logging
+    import pandas as pd
+    import graph_generation as gg
+
+    logging.disable(logging.WARNING)
+    raw = pd.read_csv(os.path.join(ROOT, "data", "shortscv.csv"))
+    names = [n for n, g in raw.groupby("Nombre") if g["tmin"].notna().any()][:3]
+    subset = raw[raw["Nombre"].isin(names)]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        csv_a = os.path.join(tmpdir, "a.csv")
+        subset.to_csv(csv_a, index=False)
+        out = os.path.join(tmpdir, "out")
+        run = gg.generate_graphs(out, csv_a, workers=1)
+        manifest = json.load(open(gg.manifest_path(out), encoding="utf-8"))["stations"]
+        check("manifest records every station with its files",
+              sorted(manifest) == sorted(names) and all(len(e["files"]) == 2 for e in manifest.values()))
+
+        png = {n: os.path.join(run, "img_output", f"{n}.png") for n in names}
+        stamp = {n: os.stat(p).st_mtime_ns for n, p in png.items()}
+        events = []
+        gg.generate_graphs(out, csv_a, workers=1, progress=events.append)
+        check("same-day rerun renders nothing", events == [100]
+              and all(os.stat(p).st_mtime_ns == stamp[n] for n, p in png.items()), str(events))
+
+        # Pretend the first run was on an earlier day, then correct one value
+        old = run + "_old"
+        os.rename(run, old)
+        for entry in manifest.values():
+            entry["run_folder"] = os.path.basename(old)
+        with open(gg.manifest_path(out), "w", encoding="utf-8") as f:
+            json.dump({"version": gg.MANIFEST_VERSION, "stations": manifest}, f)
+        fixed = subset.copy()
+        last = fixed[fixed["Nombre"] == names[0]].index[-1]
+        fixed.loc[last, "lluvia"] = 99.0
+        csv_b = os.path.join(tmpdir, "b.csv")
+        fixed.to_csv(csv_b, index=False)
+        run = gg.generate_graphs(out, csv_b, workers=2)
+        same = [os.path.samefile(os.path.join(run, "img_output", f"{n}.png"),
+                                 os.path.join(old, "img_output", f"{n}.png")) for n in names]
+        check("corrected station re-rendered, others hard-linked from the earlier run",
+              same == [False, True, True], str(same))
+        events = []
+        gg.generate_graphs(out, csv_b, workers=1, progress=events.append, incremental=False)
+        check("incremental=False re-renders every station", len(events) == len(names), str(events))
+    logging.disable(logging.NOTSET)
+except Exception as e:
+    check("incremental regeneration", False, str(e))
+
+log("\n[25] Historical backfill (one parse, one run folder per month)")
+try:
+    import filecmp
+    import logging
+    import pandas as pd
+    import graph_generation as gg
+    from data_loader import load_dataset
+
+    logging.disable(logging.WARNING)
+    raw = pd.read_csv(os.path.join(ROOT, "data", "shortscv.csv"))
+    names = [n for n, g in raw.groupby("Nombre") if g["tmin"].notna().any()][:3]
+    subset = raw[raw["Nombre"].isin(names)]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        archive = os.path.join(tmpdir, "archive.csv")
+        subset.to_csv(archive, index=False)
+        fechas = load_dataset(archive, "dates")["fecha"]
+        expected = sorted({str(p) for p in fechas.dt.to_period("M")})
+        reported, events = [], []
+        backfilled = gg.backfill_graphs(os.path.join(tmpdir, "bf"), archive, workers=2,
+                                     progress=events.append, on_month=reported.append)
+        check(f"one run folder per month ({', '.join(expected)})",
+              [r["month"] for r in backfilled] == expected and len(reported) == len(expected)
+              and events[-1:] == [100] and all(os.path.isdir(r["run_folder"]) for r in backfilled))
+        check("per-month throughput reported",
+              all(r["stations"] > 0 and r["seconds"] > 0 and r["stations_per_s"] > 0 for r in backfilled),
+              ", ".join(f"{r['month']}: {r['stations_per_s']:.1f} est/s" for r in backfilled))
+
+        # A normal run on the archive trimmed at the month's end must match that month
+        month = backfilled[len(backfilled) // 2]
+        period = pd.Period(month["month"], freq="M")
+        trimmed = os.path.join(tmpdir, "trimmed.csv")
+        subset[(fechas <= period.end_time).to_numpy()].to_csv(trimmed, index=False)
+        live = gg.generate_graphs(os.path.join(tmpdir, "live"), trimmed, workers=1, incremental=False)
+        same_names = all(sorted(os.listdir(os.path.join(live, d))) == sorted(os.listdir(os.path.join(month["run_folder"], d)))
+                         for d in ("img_output", "html_output"))
+        pngs = os.listdir(os.path.join(live, "img_output"))
+        check(f"{month['month']} matches a run on the CSV trimmed at month end",
+              os.path.basename(live) == os.path.basename(month["run_folder"]) and same_names and pngs
+              and all(filecmp.cmp(os.path.join(live, "img_output", f),
+                                  os.path.join(month["run_folder"], "img_output", f), shallow=False)
+                      for f in pngs), os.path.basename(live))
+        only = gg.backfill_graphs(os.path.join(tmpdir, "one"), archive, start=month["month"],
+                                  end=month["month"].replace("-", ""), workers=1)
+        check("--from/--to limit the months", [r["month"] for r in only] == [month["month"]])
+
+        # One failing month (its run folder path is taken by a file): the
+        # others are still rendered and reported, then one error is raised
+        for bf_workers in (2, 1):
+            broken_out = os.path.join(tmpdir, f"broken{bf_workers}")
+            os.makedirs(broken_out)
+            open(os.path.join(broken_out, os.path.basename(month["run_folder"])), "w").close()
+            reported, events, error = [], [], None
+            try:
+                gg.backfill_graphs(broken_out, archive, workers=bf_workers,
+                                   progress=events.append, on_month=reported.append)
+            except gg.BackfillError as e:
+                error = e
+            check(f"workers={bf_workers}: a failing month is reported, the rest are kept",
+                  error is not None and [f["month"] for f in error.failed] == [month["month"]]
+                  and [r["month"] for r in error.results] == [m for m in expected if m != month["month"]]
+                  and all(r["stations_per_s"] > 0 for r in error.results)
+                  and sorted(r["month"] for r in reported) == expected and events[-1:] == [100],
+                  str(error))
+    logging.disable(logging.NOTSET)
+except Exception as e:
+    check("historical backfill", False, str(e))
+
+log("\n[26] Watch-folder service (watch_folder.py)")
+try:
+    import json
+    import logging
+    import shutil
+    import pandas as pd
+    from watch_folder import FolderWatcher, WatchService, STATUS_NAME
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        clock = [0.0]
+        watcher = FolderWatcher(tmpdir, settle_seconds=5.0, clock=lambda: clock[0])
+        partial = os.path.join(tmpdir, "insivumeh_20230801_202305_a_202307.csv")
+        with open(partial, "w") as f:
+            f.write("fecha,Nombre\n")
+        seen = [len(watcher.poll())]
+        clock[0] = 3.0
+        with open(partial, "a") as f:
+            f.write("2023-07-01,A\n")               # still being written
+        seen.append(len(watcher.poll()))
+        clock[0] = 7.0
+        seen.append(len(watcher.poll()))            # unchanged for 4 s only
+        clock[0] = 8.5
+        ready = watcher.poll()
+        seen.append(len(ready))
+        watcher.acknowledge(*ready[0])
+        seen.append(len(watcher.poll()))
+        check("debounce: reported once, after settle_seconds without changes",
+              seen == [0, 0, 0, 1, 0] and watcher.pending() == 0, str(seen))
+
+    logging.disable(logging.WARNING)
+    raw = pd.read_csv(os.path.join(ROOT, "data", "shortscv.csv"))
+    names = [n for n, g in raw.groupby("Nombre") if g["tmin"].notna().any()][:2]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        inbox, out = os.path.join(tmpdir, "inbox"), os.path.join(tmpdir, "out")
+        os.makedirs(inbox)
+        first = os.path.join(inbox, "insivumeh_20230801_202305_a_202307.csv")
+        raw[raw["Nombre"] == names[0]].to_csv(first, index=False)
+        raw[raw["Nombre"].isin(names)].to_csv(os.path.join(inbox, "insivumeh_20230802_202305_a_202307.csv"), index=False)
+        shutil.copy(first, os.path.join(inbox, "insivumeh_copia_202305_a_202307.csv"))
+        with open(os.path.join(inbox, "notas.csv"), "w") as f:
+            f.write("no es una exportación\n")
+
+        class RecordingService(WatchService):
+            """Keeps a copy of the status file after every rewrite."""
+            def _write_status(self):
+                super()._write_status()
+                with open(self.status_path, encoding="utf-8") as f:
+                    self.snapshots.append(json.load(f))
+
+        def serve():
+            service = RecordingService(inbox, out, interval=0.05, settle_seconds=0.1, queue_size=1,
+                                       render_workers=1)
+            service.snapshots = []
+            service.run(once=True)
+            with open(service.status_path, encoding="utf-8") as f:
+                return service, json.load(f)
+
+        service, status = serve()
+        job_states = {}
+        for snapshot in service.snapshots:
+            for digest, job in snapshot["jobs"].items():
+                if job_states.setdefault(digest, [])[-1:] != [job["status"]]:
+                    job_states[digest].append(job["status"])
+        check(f"{STATUS_NAME} written in the output folder and updated as jobs move",
+              service.status_path == os.path.join(out, STATUS_NAME) and len(job_states) == 2
+              and all(states == ["queued", "running", "done"] for states in job_states.values())
+              and [snap["updated"] for snap in service.snapshots] == sorted(snap["updated"] for snap in service.snapshots)
+              and not [f for f in os.listdir(out) if f.endswith(".tmp")],
+              f"{len(service.snapshots)} writes: {list(job_states.values())}")
+        jobs = list(status["jobs"].values())
+        check("2 distinct exports processed once through a 1-slot queue, copy and other CSVs skipped",
+              len(jobs) == 2 and all(j["status"] == "done" for j in jobs)
+              and all(os.path.isdir(j["run_folder"]) and os.path.isfile(j["map_path"]) for j in jobs),
+              ", ".join(f"{os.path.basename(j['file'])}: {j['status']} {j.get('seconds')} s" for j in jobs))
+        check("status file reports an idle queue",
+              status["queued"] == 0 and status["running"] == 0 and status["waiting_files"] == 0)
+
+        service, status = serve()
+        check("restart does not process the same files again",
+              len(status["jobs"]) == 2 and [j["finished_at"] for j in status["jobs"].values()]
+              == [j["finished_at"] for j in jobs])
+        with open(first, "a", encoding="utf-8") as f:
+            f.write(open(first, encoding="utf-8").read().splitlines()[-1] + "\n")
+        service, status = serve()
+        check("a changed file is a new job", len(status["jobs"]) == 3
+              and all(j["status"] == "done" for j in status["jobs"].values()))
+    logging.disable(logging.NOTSET)
+except Exception as e:
+    check("watch-folder service", False, str(e))
+
+log("\n[27] Staged render pipeline (bounded queues, I/O pool, stage timings)")
+try:
+    import filecmp
+    import json
+    import logging
+    import re
+    import pandas as pd
+    import graph_generation as gg
+    from data_processing import prepare_data_for_graphs, read_and_prepare_data
+
+    logging.disable(logging.WARNING)
+    raw = pd.read_csv(os.path.join(ROOT, "data", "shortscv.csv"))
+    names = [n for n, g in raw.groupby("Nombre") if g["tmin"].notna().any()][:4]
+    ids = re.compile(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}|"p\d+"|id="[^"]+"')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        csv_path = os.path.join(tmpdir, "subset.csv")
+        raw[raw["Nombre"].isin(names)].to_csv(csv_path, index=False)
+        stations = list(prepare_data_for_graphs(read_and_prepare_data(csv_path)))
+        dirs = {}
+        for label in ("serial", "pipeline", "tight"):
+            dirs[label] = (os.path.join(tmpdir, label, "img_output"), os.path.join(tmpdir, label, "html_output"))
+            for d in dirs[label]:
+                os.makedirs(d)
+        # Reference: the per-station path the pipeline replaces
+        from data_processing import process_grouped_data
+        for name, group in stations:
+            gg.plot_with_matplotlib(process_grouped_data(name, group, *dirs["serial"]))
+        finished_names = []
+        stats = gg.render_pipeline(stations, *dirs["pipeline"], on_done=finished_names.append)
+        gg.render_pipeline(stations, *dirs["tight"], io_workers=1, queue_size=1)
+
+        def same_outputs(label):
+            for a, b in zip(dirs["serial"], dirs[label]):
+                if sorted(os.listdir(a)) != sorted(os.listdir(b)) or not os.listdir(a):
+                    return False
+                for f in os.listdir(a):
+                    pa, pb = os.path.join(a, f), os.path.join(b, f)
+                    if f.endswith(".png"):
+                        if not filecmp.cmp(pa, pb, shallow=False):
+                            return False
+                    elif (ids.sub("", open(pa, encoding="utf-8").read())
+                          != ids.sub("", open(pb, encoding="utf-8").read())):
+                        return False
+            return True
+
+        check("pipeline output matches process_grouped_data + plot_with_matplotlib (PNG bytes, HTML up to Bokeh ids)",
+              same_outputs("pipeline") and sorted(finished_names) == sorted(n for n, _ in stations))
+        check("1-slot queues and a single I/O thread give the same files", same_outputs("tight"))
+        record = stats.record()
+        check("every stage timed for every station",
+              list(record) == list(gg.PIPELINE_STAGES)
+              and all(e["items"] == len(stations) and e["busy_s"] >= 0 for e in record.values()),
+              ", ".join(f"{s} {e['busy_s']:.2f} s" for s, e in record.items()))
+
+        broken = [("roto", pd.DataFrame({"Nombre": ["roto"]}))] + stations[:1]
+        done_broken = []
+        gg.render_pipeline(broken, *dirs["tight"], on_done=done_broken.append)
+        check("a failing station is finished without files, the rest still rendered",
+              sorted(done_broken) == sorted(["roto", stations[0][0]])
+              and not any(f.startswith("roto") for d in dirs["tight"] for f in os.listdir(d)))
+
+        # A crashing stage must stop and join the others, even when they are
+        # blocked on full 1-slot queues, and surface as RuntimeError
+        import threading
+        render_png, crashed = gg._render_png, False
+        gg._render_png = lambda data, target: 1 / 0
+        try:
+            gg.render_pipeline(stations * 3, *dirs["tight"], io_workers=1, queue_size=1)
+        except RuntimeError:
+            crashed = True
+        finally:
+            gg._render_png = render_png
+        leftover = [t.name for t in threading.enumerate() if t.name.startswith("render-")]
+        check("a crashing stage raises RuntimeError and leaves no stage threads behind",
+              crashed and not leftover, str(leftover))
+
+        out = os.path.join(tmpdir, "out")
+        gg.generate_graphs(out, csv_path, workers=1)
+        gg.generate_graphs(out, csv_path, workers=2, incremental=False)
+        with open(gg.stats_path(out), encoding="utf-8") as f:
+            runs = [json.loads(line) for line in f]
+        check("stage timings appended to render_stats.jsonl per run (pool chunks merged)",
+              len(runs) == 2 and [r["workers"] for r in runs] == [1, 2]
+              and all(r["stages"]["write"]["items"] == r["rendered"] == len(stations) for r in runs),
+              f"{runs[-1]['seconds']} s, build {runs[-1]['stages']['build']['busy_s']} s")
+    logging.disable(logging.NOTSET)
+except Exception as e:
+    check("staged render pipeline", False, str(e))
+
 # ── Summary ────────────────────────────────────────────────────────────────────
 log(f"\n{'='*50}")
 passed = sum(results)
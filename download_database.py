@@ -1,9 +1,37 @@
 import re
+import json
+import time
 import requests
 import logging
 import os
+from datetime import date, datetime
+from urllib3.exceptions import HTTPError as _Urllib3Error, ProtocolError, ReadTimeoutError
 
-CHUNK_SIZE = 32768
+from data_loader import StreamingIngest
+
+CHUNK_SIZE = 32768                 # first read; then adapted to throughput
+MIN_CHUNK_SIZE = 16 << 10
+MAX_CHUNK_SIZE = 1 << 20
+CHUNK_TARGET_SECONDS = 0.05        # aim for reads of ~50 ms each
+CHUNK_WINDOW_SECONDS = 0.2         # throughput is measured over windows this long
+PROGRESS_INTERVAL = 0.25           # seconds between progress callbacks
+DRIVE_URL = "https://drive.google.com/uc?export=download"
+
+# Google Drive file ID for the INSIVUMEH monthly database (Step 1 download)
+GDRIVE_FILE_ID = '19gcM1e5rb-HvJ-MVhNSZgsinNhN0S79Y'
+
+# Inside the data folder: the in-progress download and the record of the
+# last completed one (validators, content hash, final file name)
+TEMP_NAME = "_download_temp.csv"
+STATE_NAME = "_download_state.json"
+# One JSON line per update_database() call, for capacity planning
+STATS_NAME = "_download_stats.jsonl"
+
+# Sidecar next to a partial download: {file_id, url, length, etag, last_modified}
+PART_SUFFIX = ".part.json"
+
+# 15 s connect timeout, 120 s read timeout — prevents infinite hang
+_TIMEOUT = (15, 120)
 
 
 def _extract_token(response):
@@ -34,20 +62,283 @@ def _extract_token(response):
     return None
 
 
-def save_response_content(response, destination):
+def part_state_path(destination):
+    """Path of the resume sidecar kept next to a partial download."""
+    return destination + PART_SUFFIX
+
+
+def _read_part_state(destination, file_id):
+    """
+    Load the sidecar of a partial download of ``file_id``.
+
+    Returns (state, size) when the partial file can be resumed: the sidecar
+    names the same file, records the full length and a validator (ETag or
+    Last-Modified), and the partial is non-empty and shorter than the
+    length. Returns None otherwise (the download starts from byte zero).
+    """
+    try:
+        with open(part_state_path(destination), encoding="utf-8") as f:
+            state = json.load(f)
+        size = os.path.getsize(destination)
+    except (OSError, ValueError):
+        return None
+    if state.get("file_id") != file_id:
+        return None
+    if not (state.get("etag") or state.get("last_modified")):
+        return None
+    if not state.get("length") or not 0 < size < state["length"]:
+        return None
+    return state, size
+
+
+def _write_part_state(destination, state):
+    tmp = part_state_path(destination) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp, part_state_path(destination))
+
+
+def _clear_part_state(destination):
+    try:
+        os.remove(part_state_path(destination))
+    except FileNotFoundError:
+        pass
+
+
+def _content_length(response):
+    """Content-Length as an int; None when missing or not a plain number."""
+    length = response.headers.get("Content-Length")
+    return int(length) if length and length.isdigit() else None
+
+
+def _response_state(response, file_id, url):
+    """Sidecar contents for a full (HTTP 200) response."""
+    return {
+        "file_id":       file_id,
+        "url":           url,
+        "length":        _content_length(response),
+        "etag":          response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+    }
+
+
+def _resumes(response, resume):
+    """
+    True when a 206 response continues the partial file exactly: it starts
+    at the partial size, the total matches the recorded length and the ETag
+    (when the server sends one) is unchanged.
+    """
+    state, size = resume
+    if response.status_code != 206:
+        return False
+    match = re.match(r"bytes (\d+)-\d+/(\d+)", response.headers.get("Content-Range", ""))
+    if not match or int(match.group(1)) != size or int(match.group(2)) != state["length"]:
+        return False
+    etag = response.headers.get("ETag")
+    return not (etag and state.get("etag") and etag != state["etag"])
+
+
+def _open_download(session, url, file_id, resume, known=None):
+    """
+    GET the file, passing the Drive confirmation interstitial if shown.
+
+    With ``resume`` the requests carry ``Range: bytes=<size>-`` and an
+    ``If-Range`` validator, so a server whose copy changed answers with the
+    full file (200) instead of a range of a different file. Otherwise, with
+    ``known`` (validators of the last completed download) they carry
+    ``If-None-Match`` / ``If-Modified-Since``.
+
+    Returns the streaming response (200, 304 with ``known``, or 206/416 when
+    resuming), or None after logging an HTTP error.
+    """
+    headers = {}
+    accepted = (200,)
+    if resume:
+        state, size = resume
+        headers = {"Range": f"bytes={size}-",
+                   "If-Range": state.get("etag") or state["last_modified"]}
+        accepted = (200, 206, 416)
+    elif known:
+        if known.get("etag"):
+            headers["If-None-Match"] = known["etag"]
+        if known.get("last_modified"):
+            headers["If-Modified-Since"] = known["last_modified"]
+        accepted = (200, 304)
+
+    response = session.get(url, params={'id': file_id}, headers=headers,
+                           stream=True, timeout=_TIMEOUT)
+    if response.status_code not in accepted:
+        logging.error(f"Error downloading file: HTTP {response.status_code}")
+        return None
+
+    token = _extract_token(response)
+
+    if token:
+        response.close()
+        response = session.get(
+            url, params={'id': file_id, 'confirm': token}, headers=headers,
+            stream=True, timeout=_TIMEOUT,
+        )
+        if response.status_code not in accepted:
+            logging.error(f"Error downloading after confirmation: HTTP {response.status_code}")
+            return None
+
+    return response
+
+
+class TransferStats:
+    """
+    Throughput telemetry of one download.
+
+    save_response_content() reports every chunk through chunk(); the
+    optional progress callback receives, at most every PROGRESS_INTERVAL
+    seconds and once at the end, a dict:
+
+        bytes       bytes of the file on disk (including a resumed prefix)
+        total       expected file size, or None when unknown
+        rate        smoothed transfer rate in bytes/s
+        mb_per_s    rate in MB/s
+        eta         seconds left, or None
+        chunk_size  current read size
+        done        True on the final call
+
+    record() summarises the transfer for the stats log.
+    """
+
+    def __init__(self, progress=None):
+        self.progress = progress
+        self.offset = 0
+        self.total = None
+        self.received = 0
+        self.chunk_sizes = []
+        self.max_gap = 0.0
+        self.rate = None
+        self.status = None
+        self._start = self._last = self._last_emit = time.perf_counter()
+        self._emit_bytes = 0
+
+    def begin(self, offset, total):
+        self.offset, self.total = offset, total
+        self._start = self._last = self._last_emit = time.perf_counter()
+
+    def chunk(self, nbytes, chunk_size):
+        now = time.perf_counter()
+        self.received += nbytes
+        self.chunk_sizes.append(chunk_size)
+        self.max_gap = max(self.max_gap, now - self._last)
+        self._last = now
+        if now - self._last_emit >= PROGRESS_INTERVAL:
+            self._emit(now)
+
+    def finish(self):
+        self._emit(time.perf_counter(), done=True)
+
+    def _emit(self, now, done=False):
+        interval = now - self._last_emit
+        if interval > 0:
+            current = (self.received - self._emit_bytes) / interval
+            self.rate = current if self.rate is None else 0.3 * current + 0.7 * self.rate
+        self._last_emit, self._emit_bytes = now, self.received
+        if self.progress is None:
+            return
+        done_bytes = self.offset + self.received
+        eta = None
+        if self.total and self.rate:
+            eta = max(self.total - done_bytes, 0) / self.rate
+        self.progress({
+            "bytes": done_bytes, "total": self.total, "rate": self.rate or 0.0,
+            "mb_per_s": (self.rate or 0.0) / 1e6, "eta": eta,
+            "chunk_size": self.chunk_sizes[-1] if self.chunk_sizes else CHUNK_SIZE,
+            "done": done,
+        })
+
+    def record(self):
+        seconds = self._last - self._start
+        return {
+            "status": self.status,
+            "bytes": self.received,
+            "resumed_from": self.offset,
+            "total": self.total,
+            "seconds": round(seconds, 3),
+            "mb_per_s": round(self.received / seconds / 1e6, 3) if seconds > 0 else None,
+            "max_stall_s": round(self.max_gap, 3),
+            "chunks": len(self.chunk_sizes),
+            "chunk_min": min(self.chunk_sizes, default=None),
+            "chunk_max": max(self.chunk_sizes, default=None),
+            "chunk_final": self.chunk_sizes[-1] if self.chunk_sizes else None,
+        }
+
+
+def _next_chunk_size(size, rate):
+    """
+    Read size for the next chunk: the bytes the observed throughput
+    (bytes/s) delivers in CHUNK_TARGET_SECONDS, rounded down to a power of
+    two, at most halving or doubling per step and clamped to
+    [MIN_CHUNK_SIZE, MAX_CHUNK_SIZE]. Fast links get large reads (fewer
+    Python iterations); slow ones small reads (steady progress, quick stall
+    detection).
+    """
+    target = min(max(rate * CHUNK_TARGET_SECONDS, size // 2), size * 2)
+    target = 1 << max(int(target).bit_length() - 1, 0)
+    return min(max(target, MIN_CHUNK_SIZE), MAX_CHUNK_SIZE)
+
+
+def _iter_adaptive(response, stats=None):
+    """
+    Yield the response body in reads sized by _next_chunk_size().
+
+    Throughput is measured over CHUNK_WINDOW_SECONDS of wall time (reads
+    plus the caller's write/parse), so the size follows what the pipeline
+    sustains rather than how fast single reads drain the socket buffer.
+    Reads urllib3's stream directly (iter_content() fixes one chunk size)
+    and converts its errors to the requests exceptions iter_content()
+    raises.
     """
-    Stream response body to disk in 32 KB chunks.
+    size = CHUNK_SIZE
+    window_start, window_bytes = time.perf_counter(), 0
+    while True:
+        try:
+            chunk = response.raw.read(size, decode_content=True)
+        except ProtocolError as e:
+            raise requests.exceptions.ChunkedEncodingError(e)
+        except ReadTimeoutError as e:
+            raise requests.exceptions.ConnectionError(e)
+        except _Urllib3Error as e:
+            raise requests.RequestException(e)
+        if not chunk:
+            return
+        if stats is not None:
+            stats.chunk(len(chunk), size)
+        yield chunk
+        window_bytes += len(chunk)
+        elapsed = time.perf_counter() - window_start
+        if elapsed >= CHUNK_WINDOW_SECONDS:
+            size = _next_chunk_size(size, window_bytes / elapsed)
+            window_start, window_bytes = time.perf_counter(), 0
+
+
+def save_response_content(response, destination, offset=0, ingest=None, stats=None):
+    """
+    Stream response body to disk in adaptive chunks (CHUNK_SIZE to start,
+    then sized to the observed throughput; see _next_chunk_size()).
+
+    With ``offset`` > 0 the body continues a partial file: it is truncated
+    to ``offset`` bytes and the chunks are appended. Each chunk written is
+    also passed to ``ingest.feed()`` (a data_loader.StreamingIngest), so the
+    CSV is parsed while it downloads; ingest never raises on bad data, it
+    stops parsing and the file is loaded once complete. ``stats`` (a TransferStats) receives
+    the chunk telemetry and drives the progress callback.
 
     Raises ValueError if the first bytes look like an HTML page rather than
     the expected CSV — catches the case where Google returns a warning page
     instead of the file.
     """
     try:
-        first_chunk = True
-        with open(destination, "wb") as f:
-            for chunk in response.iter_content(CHUNK_SIZE):
-                if not chunk:
-                    continue
+        first_chunk = offset == 0
+        with open(destination, "r+b" if offset else "wb") as f:
+            f.seek(offset)
+            f.truncate()
+            for chunk in _iter_adaptive(response, stats):
                 if first_chunk:
                     first_chunk = False
                     if chunk.lstrip()[:1] == b'<':
@@ -57,61 +348,271 @@ def save_response_content(response, destination):
                             "the file ID may be incorrect."
                         )
                 f.write(chunk)
+                if ingest is not None:
+                    ingest.feed(chunk)
+    except requests.RequestException:
+        raise
     except IOError as e:
         logging.error(f"Error writing to {destination}: {e}")
         raise
 
 
-def download_file_from_google_drive(file_id, destination):
+def _same_remote(response, known):
+    """
+    True when a 200 response announces the file of the last download: same
+    ETag, or (without ETags) same Last-Modified and Content-Length. A
+    missing or malformed Content-Length counts as changed.
+    """
+    etag = response.headers.get("ETag")
+    if etag and known.get("etag"):
+        return etag == known["etag"]
+    length = _content_length(response)
+    return bool(known.get("last_modified")) \
+        and response.headers.get("Last-Modified") == known["last_modified"] \
+        and length is not None and length == known.get("length")
+
+
+def _download(file_id, destination, url=DRIVE_URL, known=None, ingest=None, stats=None):
+    """
+    Core of download_file_from_google_drive().
+
+    ``ingest`` (a fresh data_loader.StreamingIngest) receives every byte of
+    the file: the partial file first when resuming, then each new chunk.
+    ``stats`` (a TransferStats) collects throughput telemetry and calls its
+    progress callback; its ``status`` is set to the returned status.
+
+    Returns (status, state) with status one of:
+      "downloaded"   — ``destination`` holds the complete file; ``state`` has
+                       its length, ETag and Last-Modified.
+      "not_modified" — ``known`` was given and the server answered 304, or a
+                       200 with the same validators (its body is not read);
+                       ``state`` is ``known``.
+      "failed"       — error logged; a partial download is kept for resume.
+    """
+    stats = stats if stats is not None else TransferStats()
+    stats.status = "failed"
+    try:
+        session = requests.Session()
+        # Byte ranges must refer to the bytes written to disk
+        session.headers["Accept-Encoding"] = "identity"
+
+        resume = _read_part_state(destination, file_id)
+        response = _open_download(session, url, file_id, resume, known)
+        if response is not None and resume and response.status_code != 200 \
+                and not _resumes(response, resume):
+            logging.warning("Partial download no longer matches the server copy; restarting")
+            response.close()
+            resume = None
+            response = _open_download(session, url, file_id, None)
+        if response is None:
+            return "failed", None
+
+        if not resume and known and (response.status_code == 304 or _same_remote(response, known)):
+            response.close()
+            stats.status = "not_modified"
+            return "not_modified", known
+
+        if resume and response.status_code == 206:
+            state, offset = resume
+            logging.info(f"Resuming download at byte {offset:,} of {state['length']:,}")
+            if ingest is not None:
+                ingest.feed_file(destination, offset)
+        else:
+            state, offset = _response_state(response, file_id, url), 0
+            _write_part_state(destination, state)
+
+        stats.begin(offset, state["length"])
+        save_response_content(response, destination, offset, ingest, stats)
+        stats.finish()
+
+        size = os.path.getsize(destination)
+        if state["length"] and size != state["length"]:
+            logging.error(f"Download incomplete: {size:,} of {state['length']:,} bytes "
+                          f"(kept for resume)")
+            return "failed", None
+        _clear_part_state(destination)
+        stats.status = "downloaded"
+        return "downloaded", dict(state, length=size)
+
+    except requests.RequestException as e:
+        logging.error(f"Network error occurred: {e}")
+        return "failed", None
+    except ValueError as e:
+        # An HTML page instead of the file: nothing worth resuming
+        _clear_part_state(destination)
+        logging.error(f"{e}")
+        return "failed", None
+    except Exception as e:
+        logging.error(f"An unexpected error occurred: {e}")
+        return "failed", None
+    finally:
+        record = stats.record()
+        if record["bytes"]:
+            logging.info(f"Download {stats.status}: {record['bytes']:,} bytes in "
+                         f"{record['seconds']} s ({record['mb_per_s']} MB/s), "
+                         f"chunks {record['chunk_min']}-{record['chunk_max']} bytes")
+
+
+def download_file_from_google_drive(file_id, destination, url=DRIVE_URL, progress=None):
     """
-    Download a publicly shared file from Google Drive.
+    Download a publicly shared file from Google Drive, resuming a previous
+    partial download when possible.
 
     Handles the virus-scan confirmation interstitial Google shows for large
     files by extracting the confirm token from either the response cookies
     (legacy) or the HTML warning page body (current behaviour).
 
+    While the body streams, ``destination`` holds the bytes received so far
+    and ``destination + PART_SUFFIX`` records the file ID, expected length
+    and ETag/Last-Modified. If the connection drops, both are kept and the
+    next call continues with an HTTP ``Range`` request. The partial file is
+    only extended when the server answers 206 for exactly the missing range
+    of the same length and ETag; a 200 (no range support, or ``If-Range``
+    saw a changed file), a mismatched 206 or a 416 restarts from byte zero.
+
     Args:
         file_id (str):      Google Drive file ID.
         destination (str):  Local path where the file will be saved.
+        url (str):          Download endpoint (a local stand-in in tests).
+        progress (callable): Called with a progress dict (bytes, total,
+                            rate, mb_per_s, eta, chunk_size, done) at most
+                            every PROGRESS_INTERVAL s; see TransferStats.
 
     Returns:
-        True on success, False on any network or HTTP error.
+        True on success, False on any network or HTTP error (a partial
+        download is kept for the next call). An HTML warning page instead
+        of the file (missing/expired token or wrong file ID) is logged and
+        also returns False.
+    """
+    return _download(file_id, destination, url, stats=TransferStats(progress))[0] == "downloaded"
+
 
-    Raises:
-        ValueError: if Google returns an HTML warning page instead of the file
-                    (indicates a missing/expired token or wrong file ID).
-        IOError:    if the local file cannot be written.
+def database_filename(data_start, data_end, download_date=None):
     """
-    URL = "https://drive.google.com/uc?export=download"
+    Name of a downloaded database:
+    insivumeh_{YYYYMMDD download}_{YYYYMM first data}_a_{YYYYMM last data}.csv
+    """
+    download_date = download_date or date.today().strftime('%Y%m%d')
+    return f'insivumeh_{download_date}_{data_start}_a_{data_end}.csv'
+
 
+def _read_download_state(state_path, file_id, data_dir):
+    """
+    Record of the last completed download, or None when it cannot be reused:
+    missing/corrupt, another file ID, or its CSV is gone or has another size.
+    """
     try:
-        # 15 s connect timeout, 120 s read timeout — prevents infinite hang
-        _TIMEOUT = (15, 120)
+        with open(state_path, encoding="utf-8") as f:
+            state = json.load(f)
+        size = os.path.getsize(os.path.join(data_dir, state["name"]))
+    except (OSError, ValueError, KeyError):
+        return None
+    if state.get("file_id") != file_id or size != state.get("length"):
+        return None
+    return state
 
-        session = requests.Session()
-        response = session.get(URL, params={'id': file_id}, stream=True, timeout=_TIMEOUT)
 
-        if response.status_code != 200:
-            logging.error(f"Error downloading file: HTTP {response.status_code}")
-            return False
+def _write_download_state(state_path, state):
+    tmp = state_path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp, state_path)
 
-        token = _extract_token(response)
 
-        if token:
-            response = session.get(
-                URL, params={'id': file_id, 'confirm': token},
-                stream=True, timeout=_TIMEOUT,
-            )
-            if response.status_code != 200:
-                logging.error(f"Error downloading after confirmation: HTTP {response.status_code}")
-                return False
+def _append_stats(data_dir, file_id, stats):
+    """Append the TransferStats record of one call to ``data_dir/STATS_NAME``."""
+    record = {"time": datetime.now().isoformat(timespec="seconds"), "file_id": file_id,
+              **stats.record()}
+    try:
+        with open(os.path.join(data_dir, STATS_NAME), "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+    except OSError as e:
+        logging.warning(f"Could not write download stats: {e}")
 
-        save_response_content(response, destination)
-        return True
 
-    except requests.RequestException as e:
-        logging.error(f"Network error occurred: {e}")
-        return False
-    except Exception as e:
-        logging.error(f"An unexpected error occurred: {e}")
-        return False
+def update_database(data_dir='data', file_id=GDRIVE_FILE_ID, url=DRIVE_URL, progress=None):
+    """
+    Step 1: bring the local copy of the database up to date.
+
+    The last completed download is recorded in ``data_dir/STATE_NAME``
+    (ETag, Last-Modified, Content-Length, SHA-256 and file name). The next
+    call makes a conditional request with those validators; when the server
+    answers 304, or a 200 announcing the same validators, the transfer is
+    skipped (the body is never read) and the existing
+    ``insivumeh_*.csv`` is reused. A changed download whose content hash
+    equals the previous one is discarded the same way. Otherwise the new
+    file is named with database_filename() and becomes the recorded one.
+
+    The bytes are parsed while they arrive (data_loader.StreamingIngest):
+    the date range, per-station row counts and hash are ready when the last
+    chunk lands, and the dataset cache of the final file is written from
+    the parsed blocks, so the graph and map steps never parse the text.
+
+    Every call appends its transfer statistics (bytes, seconds, MB/s,
+    longest stall, chunk sizes, status) as one JSON line to
+    ``data_dir/STATS_NAME``.
+
+    Args:
+        data_dir (str): Folder for the temp file, the state and the CSVs.
+        file_id (str):  Google Drive file ID.
+        url (str):      Download endpoint (a local stand-in in tests).
+        progress (callable): Progress callback, see TransferStats.
+
+    Returns:
+        dict(path, name, changed, data_start, data_end, rows, stations), or
+        None when the download failed (a partial ``TEMP_NAME`` is kept for
+        resume).
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    temp_path = os.path.join(data_dir, TEMP_NAME)
+    state_path = os.path.join(data_dir, STATE_NAME)
+    last = _read_download_state(state_path, file_id, data_dir)
+
+    ingest = StreamingIngest()
+    stats = TransferStats(progress)
+    status, remote = _download(file_id, temp_path, url, known=last, ingest=ingest, stats=stats)
+    _append_stats(data_dir, file_id, stats)
+    if status == "failed":
+        return None
+
+    if status == "downloaded":
+        try:
+            summary = ingest.close(temp_path)
+        except (ValueError, KeyError) as e:
+            # The bytes are complete; keep them for inspection
+            raise ValueError(f"Downloaded file '{temp_path}' could not be parsed: {e}") from e
+        digest = summary["sha256"]
+        if last and digest == last["sha256"]:
+            logging.info("Downloaded file is identical to the previous one")
+            os.remove(temp_path)
+            # Keep the new validators so the next request can be answered with a 304
+            last = dict(last, etag=remote["etag"], last_modified=remote["last_modified"])
+            _write_download_state(state_path, last)
+            status = "not_modified"
+
+    if status == "not_modified":
+        return {"path": os.path.join(data_dir, last["name"]), "name": last["name"],
+                "changed": False, "data_start": last["data_start"], "data_end": last["data_end"],
+                "rows": last.get("rows"), "stations": last.get("stations")}
+
+    if summary["first_fecha"] is None:
+        os.remove(temp_path)
+        raise ValueError("Downloaded file has no valid 'fecha' values")
+    data_start = summary["first_fecha"].strftime('%Y%m')
+    data_end = summary["last_fecha"].strftime('%Y%m')
+    final_name = database_filename(data_start, data_end)
+    final_path = os.path.join(data_dir, final_name)
+    os.replace(temp_path, final_path)
+    # os.replace keeps size and mtime, so the key matches the final file
+    ingest.write_cache(final_path)
+
+    _write_download_state(state_path, {
+        "file_id": file_id, "url": url, "name": final_name,
+        "length": remote["length"], "etag": remote["etag"],
+        "last_modified": remote["last_modified"], "sha256": digest,
+        "data_start": data_start, "data_end": data_end,
+        "rows": summary["rows"], "stations": summary["stations"],
+    })
+    return {"path": final_path, "name": final_name, "changed": True,
+            "data_start": data_start, "data_end": data_end,
+            "rows": summary["rows"], "stations": summary["stations"]}
@@ -14,6 +14,7 @@ a = Analysis(
         ('assets\\spinning-loading.gif', 'assets'),
     ],
     hiddenimports=[
+        'data_loader',
         'data_processing',
         'graph_generation',
         'map_viewer',
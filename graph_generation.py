@@ -1,53 +1,804 @@
+import hashlib
+import io
+import json
 import logging
 import os
-from datetime import date
+import queue
+import re
+import shutil
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import date, datetime
+import numpy as np
 import pandas as pd
+import bokeh
+import matplotlib
 import matplotlib.pyplot as plt
-from PyQt6.QtCore import QObject, pyqtSignal
-from data_processing import read_and_prepare_data, prepare_data_for_graphs, process_grouped_data
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from data_loader import CACHE_DIRNAME, WINDOW_DAYS
+from data_processing import (read_and_prepare_data, prepare_data_for_graphs, plot_limits,
+                             prepare_station_frame, create_bokeh_plot, page_html,
+                             extract_plotting_data, save_dashboard, write_bokeh_bundle,
+                             HTML_MODES, SERIES)
 
-class GraphGenerator(QObject):
-    progress_signal   = pyqtSignal(int)
-    completion_signal = pyqtSignal(str, str)   # (status_message, run_folder_abs_path)
+# Rendering processes used by generate_graphs(); 1 renders on the calling thread
+DEFAULT_WORKERS = os.cpu_count() or 1
 
-    def generate_graphs(self, output_directory, csv_file_path):
-        try:
-            df = read_and_prepare_data(csv_file_path)
-            grouped_data = prepare_data_for_graphs(df)
-
-            run_date   = date.today().strftime('%Y%m%d')
-            data_start = df['fecha'].min().strftime('%Y%m')
-            data_end   = df['fecha'].max().strftime('%Y%m')
-            run_folder = f"graficas_{run_date}_{data_start}_a_{data_end}"
-
-            directory_img  = os.path.join(output_directory, run_folder, "img_output")
-            directory_html = os.path.join(output_directory, run_folder, "html_output")
-            os.makedirs(directory_img, exist_ok=True)
-            os.makedirs(directory_html, exist_ok=True)
-
-            total = len(grouped_data)
-            for i, (name, group) in enumerate(grouped_data):
-                plot_data = process_grouped_data(name, group, directory_img, directory_html)
-                plot_with_matplotlib(plot_data)
-                progress = int((i + 1) / total * 100)
-                self.progress_signal.emit(progress)
-
-            run_folder_path = os.path.abspath(os.path.join(output_directory, run_folder))
-            self.completion_signal.emit(
-                f"Gráficos generados exitosamente! → {run_folder}",
-                run_folder_path,
-            )
 
+def generate_graphs(output_directory, csv_file_path, workers=None, html_mode="standalone",
+                    progress=None, incremental=True, stats=None):
+    """
+    Render the Bokeh HTML and matplotlib PNG of every station.
+
+    Qt-free: progress goes to a plain callback, so the same pipeline runs
+    from the GUI (gui.GraphGenerator forwards it to a Qt signal) and from
+    cli.py on a headless server. Stations go through render_pipeline();
+    with workers > 1 they are split into chunks handed to a process pool,
+    each process running its own pipeline, and progress is reported as
+    each chunk completes.
+
+    With incremental=True, stations whose 30-day data and rendering settings
+    match the manifest of an earlier run into the same output_directory are
+    hard-linked from that run's folder instead of re-rendered (see
+    manifest_path); only new or changed stations are drawn.
+
+    Args:
+        output_directory (str): Folder where the graficas_* run folder is created.
+        csv_file_path (str):    CSV to plot.
+        workers (int):          Rendering processes (DEFAULT_WORKERS when None).
+        html_mode (str):        'standalone' (one self-contained file per
+                                station), 'shared' (pages load one BokehJS
+                                bundle from html_output/static) or
+                                'dashboard' (one page with a station selector).
+        progress (callable):    Called with the percentage of stations done (int).
+        incremental (bool):     Reuse unchanged stations from earlier runs; False
+                                re-renders every station (the manifest is
+                                still updated).
+        stats (PipelineStats):  Filled with the per-stage timings of the run;
+                                they are also appended to stats_path().
+
+    Returns:
+        str: Absolute path of the graficas_* run folder.
+
+    Raises:
+        ValueError: for an unknown html_mode; read/parse errors propagate.
+    """
+    started = time.perf_counter()
+    workers = DEFAULT_WORKERS if workers is None else max(int(workers), 1)
+    progress = progress or (lambda percent: None)
+    stats = stats if stats is not None else PipelineStats()
+    if html_mode not in HTML_MODES:
+        raise ValueError(f"html_mode debe ser uno de {HTML_MODES}")
+    # Only the window is read; the archive's first date names the folder
+    df = read_and_prepare_data(csv_file_path, last_days=WINDOW_DAYS)
+    grouped_data = prepare_data_for_graphs(df)
+
+    run_date   = date.today().strftime('%Y%m%d')
+    data_start = df.attrs.get('first_fecha', df['fecha'].min()).strftime('%Y%m')
+    data_end   = df['fecha'].max().strftime('%Y%m')
+    run_folder = f"graficas_{run_date}_{data_start}_a_{data_end}"
+
+    directory_img  = os.path.join(output_directory, run_folder, "img_output")
+    directory_html = os.path.join(output_directory, run_folder, "html_output")
+    os.makedirs(directory_img, exist_ok=True)
+    os.makedirs(directory_html, exist_ok=True)
+    if html_mode == "shared":
+        write_bokeh_bundle(directory_html)
+
+    stations = list(grouped_data)
+    total = len(stations)
+    run_dir = os.path.join(output_directory, run_folder)
+    manifest = _read_manifest(output_directory)
+    entries, pending = {}, []
+    for name, group in stations:
+        entry = {"key": _station_key(name, group, html_mode), "run_folder": run_folder,
+                 "files": _station_files(name, group, html_mode)}
+        entries[str(name)] = entry
+        previous = manifest.get(str(name)) if incremental else None
+        if (previous and previous["key"] == entry["key"] and _link_outputs(
+                os.path.join(output_directory, previous["run_folder"]), run_dir, previous["files"])):
+            entry["files"] = previous["files"]
+            continue
+        # May be hard links into an earlier run: never render through them
+        _unlink_outputs(run_dir, entry["files"])
+        pending.append((name, group))
+    reused = total - len(pending)
+    if reused:
+        logging.info(f"{reused} of {total} stations unchanged, reused from earlier runs")
+        progress(int(reused / total * 100))
+
+    if workers == 1 or len(pending) <= 1:
+        done = iter(range(reused + 1, total + 1))
+        render_pipeline(pending, directory_img, directory_html, html_mode, stats=stats,
+                        on_done=lambda name: progress(int(next(done) / total * 100)))
+    else:
+        _render_parallel(pending, directory_img, directory_html, workers, html_mode, progress,
+                         reused, stats)
+    if html_mode == "dashboard":
+        save_dashboard(stations, directory_html, df['fecha'].max().strftime('%m-%Y'))
+
+    # Record the files each station produced. Rendering is deterministic, so a
+    # PNG that failed (e.g. an all-NaN window) would fail again for the same
+    # key: the entry lists only what exists, incremental=False retries it.
+    for name, entry in entries.items():
+        entry["files"] = [rel for rel in entry["files"] if os.path.exists(os.path.join(run_dir, rel))]
+        if entry["files"]:
+            manifest[name] = entry
+        else:
+            manifest.pop(name, None)
+    _write_manifest(output_directory, manifest)
+
+    _export_stats(output_directory, stats, {
+        "run_folder": run_folder, "stations": total, "rendered": len(pending), "reused": reused,
+        "workers": workers, "html_mode": html_mode,
+        "seconds": round(time.perf_counter() - started, 3),
+    })
+    return os.path.abspath(run_dir)
+
+
+def _render_parallel(stations, directory_img, directory_html, workers, html_mode="standalone",
+                     progress=None, reused=0, stats=None):
+    """Render stations in a process pool, reporting progress as each chunk finishes.
+
+    Stations are split into about CHUNKS_PER_WORKER chunks per process, so
+    each process keeps its pipeline stages busy while the load stays
+    balanced. `reused` stations are already done and count towards the
+    percentage; the chunks' stage timings are merged into `stats`.
+    """
+    total = len(stations) + reused
+    workers = min(workers, len(stations))
+    size = -(-len(stations) // (workers * CHUNKS_PER_WORKER))
+    chunks = [stations[i:i + size] for i in range(0, len(stations), size)]
+    done = reused
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_render_worker) as pool:
+        futures = {
+            pool.submit(_render_chunk, chunk, directory_img, directory_html, html_mode): chunk
+            for chunk in chunks
+        }
+        for future in as_completed(futures):
+            try:
+                record = future.result()
+                if stats is not None:
+                    stats.merge(record)
+            except Exception as e:
+                # The worker process itself died (e.g. out of memory)
+                names = ", ".join(str(name) for name, _ in futures[future])
+                logging.warning(f"Rendering process failed for '{names}': {e}")
+            done += len(futures[future])
+            if progress is not None:
+                progress(int(done / total * 100))
+
+
+def _render_chunk(stations, directory_img, directory_html, html_mode="standalone"):
+    """Pool task: run one pipeline over a chunk of stations; returns its stage timings."""
+    stats = PipelineStats()
+    render_pipeline(stations, directory_img, directory_html, html_mode, stats=stats)
+    return stats.record()
+
+
+# ── Historical backfill ──────────────────────────────────────────────────────
+
+class BackfillError(RuntimeError):
+    """
+    Some months of backfill_graphs() failed; the others were rendered.
+
+    results holds the rendered months (as backfill_graphs() returns them),
+    failed one {"month", "error"} dict per failed month, both in month order.
+    """
+
+    def __init__(self, results, failed):
+        months = ", ".join(f["month"] for f in failed)
+        super().__init__(f"{len(failed)} de {len(results) + len(failed)} meses con error: {months} "
+                         f"(primero: {failed[0]['error']})")
+        self.results = results
+        self.failed = failed
+
+
+def backfill_graphs(output_directory, csv_file_path, start=None, end=None, workers=None,
+                    html_mode="standalone", progress=None, on_month=None):
+    """
+    Render the monthly graphs of every month of the archive in one pass.
+
+    Each month gets the run folder a normal run would produce on the CSV
+    trimmed at that month's last date: the WINDOW_DAYS before the latest
+    date of the month (the month's global max, as in prepare_data_for_graphs),
+    in graficas_<run_date>_<archive start>_a_<YYYYMM>. The CSV is parsed once
+    and sorted once by (Nombre, fecha); each month's stations are contiguous
+    slices of that frame found by binary search. Months are rendered in a
+    process pool, one month per task, each through render_pipeline(). The
+    incremental manifest is not used.
+
+    Args:
+        output_directory (str): Folder where the graficas_* run folders are created.
+        csv_file_path (str):    Archive CSV.
+        start, end (str):       First/last month as 'YYYYMM' or 'YYYY-MM';
+                                None for the first/last month of the archive.
+        workers (int):          Rendering processes (DEFAULT_WORKERS when None).
+        html_mode (str):        As in generate_graphs().
+        progress (callable):    Called with the percentage of months done (int).
+        on_month (callable):    Called with each month's result dict as it completes;
+                                a failed month gives {"month", "error"} instead.
+
+    Returns:
+        list[dict]: One dict per rendered month, in month order: month
+        ('YYYY-MM'), run_folder (absolute path), stations, seconds,
+        stations_per_s (rendering throughput of that month) and stages
+        (PipelineStats.record() of that month).
+
+    Raises:
+        ValueError: for an unknown html_mode or a malformed month.
+        BackfillError: when some months failed, after every other month has
+            been rendered and reported.
+    """
+    workers = DEFAULT_WORKERS if workers is None else max(int(workers), 1)
+    progress = progress or (lambda percent: None)
+    if html_mode not in HTML_MODES:
+        raise ValueError(f"html_mode debe ser uno de {HTML_MODES}")
+
+    df = read_and_prepare_data(csv_file_path)
+    df = df[df["fecha"].notna() & df["Nombre"].notna()].sort_values(["Nombre", "fecha"], kind="stable", ignore_index=True)
+    fechas = df["fecha"].to_numpy()
+    codes = df["Nombre"].cat.codes.to_numpy()
+    bounds = np.flatnonzero(np.diff(codes)) + 1
+    blocks = list(zip(np.r_[0, bounds], np.r_[bounds, len(df)]))
+    names = [df["Nombre"].iat[a] for a, _ in blocks]
+
+    months = pd.period_range(_parse_month(start) or df["fecha"].min().to_period("M"),
+                             _parse_month(end) or df["fecha"].max().to_period("M"), freq="M")
+    run_date = date.today().strftime('%Y%m%d')
+    data_start = df["fecha"].min().strftime('%Y%m')
+    tasks = []
+    for month in months:
+        in_month = fechas[(fechas >= month.start_time.to_datetime64())
+                          & (fechas <= month.end_time.to_datetime64())]
+        if not len(in_month):
+            continue
+        max_date = in_month.max()
+        cutoff = max_date - np.timedelta64(WINDOW_DAYS, "D")
+        stations = []
+        for name, (a, b) in zip(names, blocks):
+            lo = a + np.searchsorted(fechas[a:b], cutoff, side="left")
+            hi = a + np.searchsorted(fechas[a:b], max_date, side="right")
+            if hi > lo:
+                stations.append((name, df.iloc[lo:hi]))
+        run_folder = f"graficas_{run_date}_{data_start}_a_{month.strftime('%Y%m')}"
+        tasks.append((str(month), os.path.join(output_directory, run_folder), stations, html_mode))
+
+    results, failed = [], []
+
+    def collect(month, render):
+        # One failed month must not cost the records of the others
+        try:
+            result = render()
         except Exception as e:
-            self.completion_signal.emit(f"Error: {str(e)}", "")
+            logging.warning(f"Backfill of month {month} failed: {e}")
+            result = {"month": month, "error": str(e)}
+            failed.append(result)
+        else:
+            results.append(result)
+        if on_month is not None:
+            on_month(result)
+
+    if workers == 1 or len(tasks) <= 1:
+        for i, task in enumerate(tasks):
+            collect(task[0], lambda: _render_month(*task))
+            progress(int((i + 1) / len(tasks) * 100))
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks)),
+                                 initializer=_init_render_worker) as pool:
+            futures = {pool.submit(_render_month, *task): task[0] for task in tasks}
+            for done, future in enumerate(as_completed(futures), start=1):
+                collect(futures[future], future.result)
+                progress(int(done / len(tasks) * 100))
+    results.sort(key=lambda r: r["month"])
+    if failed:
+        raise BackfillError(results, sorted(failed, key=lambda f: f["month"]))
+    return results
+
+
+def _parse_month(value):
+    """'YYYYMM' / 'YYYY-MM' → pd.Period (None passes through)."""
+    if value is None:
+        return None
+    match = re.fullmatch(r"(\d{4})-?(\d{2})", str(value).strip())
+    if not match or not 1 <= int(match.group(2)) <= 12:
+        raise ValueError(f"Mes inválido: {value!r} (use AAAAMM o AAAA-MM)")
+    return pd.Period(year=int(match.group(1)), month=int(match.group(2)), freq="M")
+
+
+def _render_month(month, run_dir, stations, html_mode="standalone"):
+    """Render one backfill month into run_dir; module-level so it can run in a process pool."""
+    started = time.perf_counter()
+    directory_img = os.path.join(run_dir, "img_output")
+    directory_html = os.path.join(run_dir, "html_output")
+    os.makedirs(directory_img, exist_ok=True)
+    os.makedirs(directory_html, exist_ok=True)
+    if html_mode == "shared":
+        write_bokeh_bundle(directory_html)
+    stats = PipelineStats()
+    render_pipeline(stations, directory_img, directory_html, html_mode, stats=stats)
+    if html_mode == "dashboard" and stations:
+        month_year = max(group["fecha"].max() for _, group in stations).strftime('%m-%Y')
+        save_dashboard(stations, directory_html, month_year)
+    seconds = time.perf_counter() - started
+    return {"month": month, "run_folder": os.path.abspath(run_dir), "stations": len(stations),
+            "seconds": seconds, "stations_per_s": len(stations) / seconds if seconds else 0.0,
+            "stages": stats.record()}
+
+
+# ── Staged render pipeline ───────────────────────────────────────────────────
+# Each station goes through four stages, one thread each, connected by
+# bounded queues:
+#   slice     : sorted 30-day frame + plotting data (prepare_station_frame)
+#   build     : Bokeh figure, then the matplotlib PNG rendered into memory
+#   serialize : Bokeh page HTML (page_html)
+#   write     : both files written by a small I/O thread pool
+# A full queue blocks the stage feeding it, and at most `queue_size` stations
+# wait for or sit in the I/O pool, so memory stays bounded however many
+# stations there are. The stages overlap file writes and the Bokeh
+# serialization of one station with the drawing of the next.
+PIPELINE_QUEUE_SIZE = 4     # stations buffered between two stages
+IO_WORKERS = 2              # file-writing threads per pipeline
+CHUNKS_PER_WORKER = 4       # pool tasks per rendering process in _render_parallel
+STATS_NAME = "render_stats.jsonl"
+PIPELINE_STAGES = ("slice", "build", "serialize", "write")
+PIPELINE_POLL_S = 0.1       # how often blocked stages check for an aborted run
+
+
+class _PipelineAborted(Exception):
+    """Raised inside a stage thread to unwind it once the run has been aborted."""
+
+
+class PipelineStats:
+    """
+    Per-stage timings of render_pipeline(), summed over its stations.
+
+    For every stage: items handled, busy_s (time doing work), wait_in_s
+    (starved: waiting for the previous stage) and wait_out_s (backpressure:
+    blocked on a full queue or a busy I/O pool). The stage with the largest
+    busy_s is the bottleneck. Thread-safe; records from several pipelines
+    (e.g. pool processes) are combined with merge(), so busy_s may exceed
+    the wall-clock time of the run.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {stage: {"items": 0, "busy_s": 0.0, "wait_in_s": 0.0, "wait_out_s": 0.0}
+                       for stage in PIPELINE_STAGES}
+
+    def add(self, stage, busy=0.0, wait_in=0.0, wait_out=0.0, items=1):
+        with self._lock:
+            entry = self.stages[stage]
+            entry["items"] += items
+            entry["busy_s"] += busy
+            entry["wait_in_s"] += wait_in
+            entry["wait_out_s"] += wait_out
+
+    def merge(self, record):
+        """Add a record() of another pipeline."""
+        for stage, entry in record.items():
+            self.add(stage, entry["busy_s"], entry["wait_in_s"], entry["wait_out_s"], entry["items"])
+
+    def record(self):
+        """JSON-ready copy: {stage: {items, busy_s, wait_in_s, wait_out_s}}."""
+        with self._lock:
+            return {stage: {key: round(value, 4) if isinstance(value, float) else value
+                            for key, value in entry.items()}
+                    for stage, entry in self.stages.items()}
+
+
+def stats_path(output_directory):
+    """JSON-lines file generate_graphs() appends one stage-timing record per run to."""
+    return os.path.join(output_directory, CACHE_DIRNAME, STATS_NAME)
+
+
+def _export_stats(output_directory, stats, run_info):
+    record = {"finished": datetime.now().isoformat(timespec="seconds"), **run_info,
+              "stages": stats.record()}
+    summary = ", ".join(f"{stage} {entry['busy_s']:.2f} s" for stage, entry in record["stages"].items())
+    logging.info(f"Render stages ({record['rendered']} stations): {summary}")
+    path = stats_path(output_directory)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except OSError as e:
+        logging.warning(f"Could not write render stats '{path}': {e}")
+
+
+def render_pipeline(stations, directory_img, directory_html, html_mode="standalone",
+                    on_done=None, stats=None, io_workers=IO_WORKERS,
+                    queue_size=PIPELINE_QUEUE_SIZE):
+    """
+    Render (name, group) stations through the staged pipeline described above.
+
+    Produces the same files as data_processing.process_grouped_data()
+    followed by plot_with_matplotlib(), with per-station failure isolation:
+    a station whose data or Bokeh page fails writes nothing; a failed PNG is
+    logged and the HTML still written.
+    The directories (and the shared bundle) must already exist. If a stage
+    crashes or on_done raises, the other stages are stopped and joined
+    before the error is raised (RuntimeError for a stage crash).
+
+    Args:
+        on_done (callable): Called on the calling thread with each station
+                            name once its files are written (or it failed).
+        stats (PipelineStats): Receives the per-stage timings.
+        io_workers (int):   File-writing threads.
+        queue_size (int):   Bound of every inter-stage queue and of the
+                            stations queued for writing.
+    """
+    stats = stats if stats is not None else PipelineStats()
+    to_build = queue.Queue(maxsize=queue_size)
+    to_serialize = queue.Queue(maxsize=queue_size)
+    finished = queue.Queue()
+    write_slots = threading.BoundedSemaphore(queue_size)
+    abort = threading.Event()
+
+    # Blocking calls wake up every PIPELINE_POLL_S so an aborted run never
+    # leaves a stage stuck on a full or empty queue
+    def timed_get(source, stage):
+        t0 = time.perf_counter()
+        while True:
+            try:
+                item = source.get(timeout=PIPELINE_POLL_S)
+                break
+            except queue.Empty:
+                if abort.is_set():
+                    raise _PipelineAborted()
+        stats.add(stage, wait_in=time.perf_counter() - t0, items=0)
+        return item
+
+    def timed_put(target, item, stage):
+        t0 = time.perf_counter()
+        while True:
+            if abort.is_set():
+                raise _PipelineAborted()
+            try:
+                target.put(item, timeout=PIPELINE_POLL_S)
+                break
+            except queue.Full:
+                pass
+        stats.add(stage, wait_out=time.perf_counter() - t0, items=0)
+
+    def slice_stage():
+        for name, group in stations:
+            t0 = time.perf_counter()
+            try:
+                df, month_year_str = prepare_station_frame(group)
+                plot_data = extract_plotting_data(df, name, directory_img)
+            except Exception as e:
+                logging.warning(f"Rendering '{name}' failed (slice): {e}")
+                finished.put(name)
+                continue
+            finally:
+                stats.add("slice", busy=time.perf_counter() - t0)
+            timed_put(to_build, (name, df, month_year_str, plot_data), "slice")
+        timed_put(to_build, None, "slice")
+
+    def build_stage():
+        while (item := timed_get(to_build, "build")) is not None:
+            name, df, month_year_str, plot_data = item
+            t0 = time.perf_counter()
+            fig = png = None
+            try:
+                if html_mode != "dashboard":
+                    fig = create_bokeh_plot(df, name)
+            except Exception as e:
+                logging.warning(f"Rendering '{name}' failed (build): {e}")
+                stats.add("build", busy=time.perf_counter() - t0)
+                finished.put(name)
+                continue
+            buffer = io.BytesIO()
+            if _render_png(plot_data, buffer):
+                png = buffer.getvalue()
+            stats.add("build", busy=time.perf_counter() - t0)
+            timed_put(to_serialize, (name, month_year_str, fig, png), "build")
+        timed_put(to_serialize, None, "build")
+
+    def write_files(name, files, queued_at):
+        t0 = time.perf_counter()
+        try:
+            for path, content in files:
+                if isinstance(content, bytes):
+                    with open(path, "wb") as f:
+                        f.write(content)
+                else:
+                    with open(path, "w", encoding="utf-8") as f:
+                        f.write(content)
+        except OSError as e:
+            logging.warning(f"Writing the graphs of '{name}' failed: {e}")
+        finally:
+            stats.add("write", busy=time.perf_counter() - t0, wait_in=t0 - queued_at)
+            write_slots.release()
+            finished.put(name)
 
+    def serialize_stage(writer):
+        while (item := timed_get(to_serialize, "serialize")) is not None:
+            name, month_year_str, fig, png = item
+            t0 = time.perf_counter()
+            files = []
+            try:
+                if fig is not None:
+                    filename, page = page_html(fig, name, month_year_str, directory_html, html_mode)
+                    files.append((os.path.join(directory_html, filename), page))
+            except Exception as e:
+                logging.warning(f"Rendering '{name}' failed (serialize): {e}")
+                stats.add("serialize", busy=time.perf_counter() - t0)
+                finished.put(name)
+                continue
+            if png is not None:
+                files.append((os.path.join(directory_img, f"{os.path.basename(name)}.png"), png))
+            stats.add("serialize", busy=time.perf_counter() - t0)
+            t0 = time.perf_counter()
+            while not write_slots.acquire(timeout=PIPELINE_POLL_S):
+                if abort.is_set():
+                    raise _PipelineAborted()
+            stats.add("serialize", wait_out=time.perf_counter() - t0, items=0)
+            writer.submit(write_files, name, files, time.perf_counter())
 
-def plot_with_matplotlib(data):
+    def run_stage(target, *args):
+        try:
+            target(*args)
+        except _PipelineAborted:
+            pass
+        except BaseException as e:
+            # Per-station errors are handled above; anything else stops the run
+            abort.set()
+            finished.put(e)
+
+    with ThreadPoolExecutor(max_workers=max(int(io_workers), 1),
+                            thread_name_prefix="render-io") as writer:
+        threads = [threading.Thread(target=run_stage, args=(slice_stage,), name="render-slice", daemon=True),
+                   threading.Thread(target=run_stage, args=(build_stage,), name="render-build", daemon=True),
+                   threading.Thread(target=run_stage, args=(serialize_stage, writer),
+                                    name="render-serialize", daemon=True)]
+        for thread in threads:
+            thread.start()
+        try:
+            for _ in range(len(stations)):
+                name = finished.get()
+                if isinstance(name, BaseException):
+                    raise RuntimeError(f"Render pipeline stage failed: {name!r}") from name
+                if on_done is not None:
+                    on_done(name)
+        except BaseException:
+            abort.set()
+            raise
+        finally:
+            for thread in threads:
+                thread.join()
+        if not finished.empty():
+            raise RuntimeError(f"Render pipeline stage failed: {finished.get()!r}")
+    return stats
+
+
+# ── Incremental regeneration ─────────────────────────────────────────────────
+# <output_dir>/_cache/graficas_manifest.json maps each station to the content
+# hash of its 30-day slice plus the rendering settings, and to the run folder
+# holding its files. Bump RENDER_VERSION whenever the charts change their look;
+# the html_mode and the Bokeh/matplotlib versions are part of the key.
+RENDER_VERSION = 1
+MANIFEST_NAME = "graficas_manifest.json"
+MANIFEST_VERSION = 1
+
+
+def manifest_path(output_directory):
+    """Station manifest used by generate_graphs() for runs saved in output_directory."""
+    return os.path.join(output_directory, CACHE_DIRNAME, MANIFEST_NAME)
+
+
+def _read_manifest(output_directory):
+    """Station entries of the manifest; {} when missing, unreadable or outdated."""
+    try:
+        with open(manifest_path(output_directory), encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(data, dict) or data.get("version") != MANIFEST_VERSION:
+        return {}
+    return data.get("stations", {})
+
+
+def _write_manifest(output_directory, stations):
+    path = manifest_path(output_directory)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": MANIFEST_VERSION, "stations": stations}, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logging.warning(f"Could not write graph manifest '{path}': {e}")
+
+
+def _station_key(name, group, html_mode):
+    """Content hash of everything the outputs of one station depend on."""
+    h = hashlib.sha1(f"v{RENDER_VERSION}|{html_mode}|bokeh{bokeh.__version__}"
+                     f"|mpl{matplotlib.__version__}|{name}".encode())
+    data = group.sort_values("fecha")
+    h.update(data["fecha"].to_numpy("datetime64[ns]").view(np.int64).tobytes())
+    for col in SERIES:
+        h.update(data[col].to_numpy(np.float64, na_value=np.nan).tobytes())
+    return h.hexdigest()
+
+
+def _station_files(name, group, html_mode):
+    """Files of one station relative to the run folder (names as in save_plot / plot_with_matplotlib)."""
+    station = os.path.basename(name)
+    files = [os.path.join("img_output", f"{station}.png")]
+    if html_mode != "dashboard":
+        month_year = group["fecha"].max().strftime("%m-%Y")
+        files.append(os.path.join("html_output", f"{station}_{month_year}.html"))
+    return files
+
+
+def _link_outputs(source_dir, run_dir, files):
+    """
+    Make `files` of source_dir available in run_dir: hard links, or copies
+    where the file system has none. False when a source file is missing.
+    """
+    try:
+        for rel in files:
+            src, dst = os.path.join(source_dir, rel), os.path.join(run_dir, rel)
+            if os.path.exists(dst) and os.path.samefile(src, dst):
+                continue        # same-day rerun: already in place
+            if os.path.exists(dst):
+                os.remove(dst)
+            try:
+                os.link(src, dst)
+            except OSError:
+                shutil.copy2(src, dst)
+    except OSError:
+        return False
+    return True
+
+
+def _unlink_outputs(run_dir, files):
+    for rel in files:
+        try:
+            os.remove(os.path.join(run_dir, rel))
+        except FileNotFoundError:
+            pass
+
+
+def _init_render_worker():
+    """Process-pool initializer: render off-screen, like MPLBACKEND=Agg in monthly_graph.py."""
+    matplotlib.use('Agg')
+
+
+class _FigureTemplate:
+    """
+    Persistent three-axis station figure, reused for every PNG of a worker.
+
+    Axes, lines, labels and the legend are created once (from the first
+    station, so the x axis picks up the date converter exactly as in a fresh
+    figure). Each later station only swaps the Line2D data, y-limits and
+    title. tight_layout() results are cached by the tick labels of all axes:
+    identical labels give identical margins, so the layout is computed once
+    per distinct label set and the PNGs stay pixel-identical to a freshly
+    built figure.
+    """
+
+    def __init__(self, data):
+        fecha = data['fecha']
+        fig = Figure(figsize=(12, 5))
+        FigureCanvasAgg(fig)
+        ax1 = fig.add_subplot()
+
+        ax1.set_xlabel('Fecha')
+        ax1.set_ylabel('Precipitación (mm)', color='tab:blue')
+        l_lluvia, = ax1.plot(fecha, data['lluvia'], color='tab:blue', label='Precipitación')
+        ax1.tick_params(axis='y', labelcolor='tab:blue')
+
+        ax2 = ax1.twinx()
+        ax2.set_ylabel('Temperatura (°C)', color='tab:red')
+        l_tseca, = ax2.plot(fecha, data['tseca'], color='tab:green', label='Temperatura Seca')
+        l_tmin,  = ax2.plot(fecha, data['tmin'], color='deepskyblue', linestyle='--', label='Temp Min')
+        l_tmax,  = ax2.plot(fecha, data['tmax'], color='firebrick', linestyle='--', label='Temp Max')
+        ax2.tick_params(axis='y', labelcolor='tab:red')
+
+        ax3 = ax1.twinx()
+        ax3.spines['right'].set_position(('outward', 60))
+        ax3.set_ylabel('Humedad relativa (%)', color='darkorange')
+        l_hum, = ax3.plot(fecha, data['hum_rel'], color='darkorange', linestyle=':', label='Humedad relativa')
+        ax3.tick_params(axis='y', labelcolor='darkorange')
+        ax3.set_ylim(0, 100)
+
+        lines1, labels1 = ax1.get_legend_handles_labels()
+        lines2, labels2 = ax2.get_legend_handles_labels()
+        lines3, labels3 = ax3.get_legend_handles_labels()
+        ax2.legend(lines1 + lines2 + lines3, labels1 + labels2 + labels3, loc=0)
+
+        self.fig = fig
+        self._default_params = self._subplot_params()
+        self.axes = (ax1, ax2, ax3)
+        self.lines = {'lluvia': l_lluvia, 'tseca': l_tseca, 'tmin': l_tmin,
+                      'tmax': l_tmax, 'hum_rel': l_hum}
+        self._layouts = {}
+
+    def render(self, data, target):
+        """Update the figure with one station's data and save it as PNG to a path or file object."""
+        ax1, ax2, ax3 = self.axes
+        lluvia_top, temp_lo, temp_hi = plot_limits(data)
+
+        for key, line in self.lines.items():
+            line.set_data(data['fecha'], data[key])
+        for ax in self.axes:
+            ax.relim()
+            ax.autoscale_view(scaley=False)
+        ax1.set_ylim(-5, lluvia_top)
+        ax2.set_ylim(temp_lo, temp_hi)
+        ax3.set_title(f"Datos de {data['estacion']}")
+
+        layout_key = self._layout_key()
+        params = self._layouts.get(layout_key)
+        if params is None:
+            # tight_layout() is not exactly independent of the current
+            # margins; start from a fresh figure's so results match it bit-for-bit
+            self.fig.subplots_adjust(**self._default_params)
+            self.fig.tight_layout()
+            params = self._layouts[layout_key] = self._subplot_params()
+        else:
+            self.fig.subplots_adjust(**params)
+
+        self.fig.savefig(target, format="png")
+
+    def _subplot_params(self):
+        sp = self.fig.subplotpars
+        return dict(left=sp.left, right=sp.right, bottom=sp.bottom,
+                    top=sp.top, wspace=sp.wspace, hspace=sp.hspace)
+
+    def _layout_key(self):
+        """Tick label strings of every axis — the inputs that move the margins."""
+        ax1, ax2, ax3 = self.axes
+        key = []
+        for axis in (ax1.xaxis, ax1.yaxis, ax2.yaxis, ax3.yaxis):
+            ticks = axis.get_major_locator()()
+            key.append(tuple(axis.get_major_formatter().format_ticks(ticks)))
+        return tuple(key)
+
+
+# One template per rendering thread (each pool process has its own)
+_templates = threading.local()
+
+
+def _render_png(data, target):
+    """
+    Draw one station on this thread's _FigureTemplate and save the PNG to
+    `target` (a path or a binary file object). Failures are logged; returns
+    True when the PNG was saved.
+    """
+    try:
+        template = getattr(_templates, 'template', None)
+        if template is None:
+            template = _templates.template = _FigureTemplate(data)
+        template.render(data, target)
+    except Exception as e:
+        # Start from a clean figure for the next station
+        _templates.template = None
+        logging.warning(f"plot_with_matplotlib failed for '{data.get('estacion', '?')}': {e}")
+        return False
+    return True
+
+
+def plot_with_matplotlib(data, reuse_figure=True):
     """
     Plot the data using matplotlib and save the figures.
     Three axes: precipitation (left), temperature (right), humidity (far right).
     Runs on the GraphWorker background thread — never on the GUI thread.
+
+    With reuse_figure=True (default) the PNG is drawn on this thread's
+    persistent _FigureTemplate instead of building a new figure; the output
+    is the same. reuse_figure=False keeps the original build-per-station
+    path (used by dev/bench_plot_template.py as the baseline).
     """
+    if reuse_figure:
+        _render_png(data, os.path.join(data['directory_img'], f"{os.path.basename(data['estacion'])}.png"))
+        return
+
     try:
         fecha = data['fecha']
         lluvia = data['lluvia']
@@ -58,10 +809,7 @@ def plot_with_matplotlib(data):
         estacion = data['estacion']
         directory_img = data['directory_img']
 
-        # Data-driven axis limits so high-rainfall or unusual-temp days are never clipped
-        lluvia_top = max(pd.to_numeric(lluvia, errors='coerce').max() * 1.15, 30)
-        temp_lo    = min(pd.to_numeric(tmin,   errors='coerce').min() - 2,  -5)
-        temp_hi    = max(pd.to_numeric(tmax,   errors='coerce').max() + 3,  40)
+        lluvia_top, temp_lo, temp_hi = plot_limits(data)
 
         fig, ax1 = plt.subplots(figsize=(12, 5))
 
@@ -1,22 +1,22 @@
 import sys
 import subprocess
 import os
-import pandas as pd
-from datetime import date
+import time
+import logging
+import importlib
 from PyQt6.QtWidgets import (
     QApplication, QLabel, QVBoxLayout, QWidget, QPushButton, QFileDialog,
     QLineEdit, QProgressBar, QDialog, QMessageBox, QHBoxLayout
 )
 import webbrowser
-from PyQt6.QtCore import QThread, pyqtSignal, Qt
+from PyQt6.QtCore import QObject, QThread, QTimer, pyqtSignal, Qt
 from PyQt6.QtGui import QPixmap, QMovie
-from data_processing import detect_date_format
-from download_database import download_file_from_google_drive
-from graph_generation import GraphGenerator
-from map_viewer import build_station_summary, build_station_history, generate_map
 
-# Google Drive file ID for the INSIVUMEH monthly database (Step 1 download)
-GDRIVE_FILE_ID = '19gcM1e5rb-HvJ-MVhNSZgsinNhN0S79Y'
+# The pipeline modules (pandas, Bokeh, matplotlib, folium, requests) are not
+# imported here: each worker imports what it needs when it first runs, and
+# PrewarmWorker loads them in the background once the window is visible, so
+# the window appears after importing Qt alone.
+PREWARM_MODULES = ("download_database", "graph_generation", "map_viewer")
 
 
 def resource_path(relative_path):
@@ -46,48 +46,70 @@ def open_map_in_browser(map_path: str) -> None:
     webbrowser.open(f"file:///{map_path.replace(os.sep, '/')}")
 
 
-class DownloadWorker(QThread):
-    finished_signal = pyqtSignal(str, str)   # (final_path, display_message) on success
-    error_signal    = pyqtSignal(str)         # error message on failure
+class PrewarmWorker(QThread):
+    """Imports PREWARM_MODULES in the background so the first button press is fast."""
 
     def run(self):
-        data_dir  = 'data'
-        os.makedirs(data_dir, exist_ok=True)
-        temp_path = os.path.join(data_dir, '_download_temp.csv')
+        for name in PREWARM_MODULES:
+            start = time.perf_counter()
+            try:
+                importlib.import_module(name)
+            except Exception as e:
+                # The worker that needs the module imports it again and reports the error
+                logging.warning(f"Prewarm import of '{name}' failed: {e}")
+                continue
+            logging.info(f"Prewarmed '{name}' in {time.perf_counter() - start:.2f} s")
 
-        try:
-            success = download_file_from_google_drive(GDRIVE_FILE_ID, temp_path)
-            if not success:
-                self.error_signal.emit(
-                    'No se pudo descargar la base de datos. '
-                    'Verifique su conexión e intente de nuevo.'
-                )
-                return
 
-            df_dates   = pd.read_csv(temp_path, usecols=['fecha'], low_memory=False)
-            sample     = str(df_dates['fecha'].dropna().iloc[0]).strip()
-            date_fmt   = detect_date_format(sample)
-            fechas     = pd.to_datetime(df_dates['fecha'], format=date_fmt)
-            data_start = fechas.min().strftime('%Y%m')
-            data_end   = fechas.max().strftime('%Y%m')
+class DownloadWorker(QThread):
+    finished_signal = pyqtSignal(str, str, bool)   # (final_path, display_message, changed) on success
+    error_signal    = pyqtSignal(str)              # error message on failure
+    progress_signal = pyqtSignal(int)              # percent of the file received
+    status_signal   = pyqtSignal(str)              # "x de y MB — z MB/s — n s restantes"
+
+    def _on_progress(self, info: dict):
+        done_mb = info['bytes'] / 1e6
+        if info['total']:
+            self.progress_signal.emit(int(100 * info['bytes'] / info['total']))
+            text = f'Descargando: {done_mb:.1f} de {info["total"] / 1e6:.1f} MB'
+        else:
+            text = f'Descargando: {done_mb:.1f} MB'
+        text += f' — {info["mb_per_s"]:.2f} MB/s'
+        if info['eta'] is not None and not info['done']:
+            text += f' — {info["eta"]:.0f} s restantes'
+        self.status_signal.emit(text)
 
-            download_date = date.today().strftime('%Y%m%d')
-            final_name    = f'insivumeh_{download_date}_{data_start}_a_{data_end}.csv'
-            final_path    = os.path.join(data_dir, final_name)
+    def run(self):
+        data_dir = 'data'
 
-            os.replace(temp_path, final_path)
+        try:
+            from download_database import update_database, part_state_path, TEMP_NAME
+            result = update_database(data_dir, progress=self._on_progress)
+            if result is None:
+                msg = ('No se pudo descargar la base de datos. '
+                       'Verifique su conexión e intente de nuevo.')
+                if os.path.exists(part_state_path(os.path.join(data_dir, TEMP_NAME))):
+                    msg += '\nLa descarga parcial se conserva y continuará en el próximo intento.'
+                self.error_signal.emit(msg)
+                return
 
+            data_start, data_end = result['data_start'], result['data_end']
+            header = ('Base de datos descargada exitosamente.' if result['changed'] else
+                      'Base de datos sin cambios desde la última descarga; '
+                      'se usa el archivo existente.')
             msg = (
-                f'Base de datos descargada exitosamente.\n\n'
-                f'Archivo: {final_name}\n'
+                f'{header}\n\n'
+                f'Archivo: {result["name"]}\n'
                 f'Período de datos: {data_start[:4]}-{data_start[4:]} '
                 f'a {data_end[:4]}-{data_end[4:]}'
             )
-            self.finished_signal.emit(final_path, msg)
+            if result.get('rows') is not None:
+                msg += f'\nRegistros: {result["rows"]:,} de {result["stations"]} estaciones'
+            self.finished_signal.emit(result['path'], msg, result['changed'])
 
         except Exception as e:
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
+            # The temp file is kept: with its .part.json sidecar the next
+            # download resumes it; without one it is simply overwritten.
             self.error_signal.emit(f'Ocurrió un error durante la descarga: {str(e)}')
 
 
@@ -102,15 +124,36 @@ class MapWorker(QThread):
 
     def run(self):
         try:
+            from map_viewer import build_station_summary, build_station_history, generate_map
             summary  = build_station_summary(self.csv_file_path)
             history  = build_station_history(self.csv_file_path)
-            map_path = generate_map(summary, self.output_directory, history)
+            map_path = generate_map(summary, self.output_directory, history, rain_surface=True)
             msg      = f'Mapa generado: {len(summary)} estaciones — {map_path}'
             self.finished_signal.emit(map_path, msg)
         except Exception as e:
             self.error_signal.emit(str(e))
 
 
+class GraphGenerator(QObject):
+    """Qt front end of graph_generation.generate_graphs(): progress and completion as signals."""
+    progress_signal   = pyqtSignal(int)
+    completion_signal = pyqtSignal(str, str)   # (status_message, run_folder_abs_path)
+
+    def generate_graphs(self, output_directory, csv_file_path, workers=None, html_mode="standalone"):
+        try:
+            import graph_generation
+            run_folder_path = graph_generation.generate_graphs(
+                output_directory, csv_file_path, workers=workers, html_mode=html_mode,
+                progress=self.progress_signal.emit,
+            )
+            self.completion_signal.emit(
+                f"Gráficos generados exitosamente! → {os.path.basename(run_folder_path)}",
+                run_folder_path,
+            )
+        except Exception as e:
+            self.completion_signal.emit(f"Error: {str(e)}", "")
+
+
 class GraphWorker(QThread):
     progress_signal = pyqtSignal(int)
     finished_signal = pyqtSignal(str, str)   # (status_message, run_folder_abs_path)
@@ -128,11 +171,24 @@ class GraphWorker(QThread):
 
 
 class WeatherGraphsApp(QWidget):
-    def __init__(self):
+    def __init__(self, prewarm=True):
         super().__init__()
         self._last_run_folder = None
+        self._prewarm = prewarm
+        self.prewarm_worker = None
         self.init_ui()
 
+    def showEvent(self, event):
+        super().showEvent(event)
+        if self._prewarm and self.prewarm_worker is None:
+            # Queued until the event loop runs, i.e. after the window is painted
+            QTimer.singleShot(0, self.start_prewarm)
+
+    def start_prewarm(self):
+        if self.prewarm_worker is None:
+            self.prewarm_worker = PrewarmWorker()
+            self.prewarm_worker.start()
+
     def init_ui(self):
         self.setWindowTitle("Generador de Gráficas Mensual v1.0.0")
         main_layout = QVBoxLayout()
@@ -214,17 +270,24 @@ class WeatherGraphsApp(QWidget):
         self.show_loading()
         self.download_button.setEnabled(False)
 
+        self.progress.setValue(0)
         self.download_worker = DownloadWorker()
+        self.download_worker.progress_signal.connect(self.update_progress)
+        self.download_worker.status_signal.connect(self.status_label.setText)
         self.download_worker.finished_signal.connect(self._on_download_complete)
         self.download_worker.error_signal.connect(self._on_download_error)
         self.download_worker.start()
 
-    def _on_download_complete(self, final_path: str, msg: str):
+    def _on_download_complete(self, final_path: str, msg: str, changed: bool):
         self.hide_loading()
         self.download_button.setEnabled(True)
         self.csv_edit.setText(final_path)
-        self.status_label.setText("Descarga completada.")
-        QMessageBox.information(self, 'Descarga completada', msg)
+        if changed:
+            self.status_label.setText("Descarga completada.")
+            QMessageBox.information(self, 'Descarga completada', msg)
+        else:
+            self.status_label.setText("Base de datos sin cambios.")
+            QMessageBox.information(self, 'Sin cambios', msg)
 
     def _on_download_error(self, error_msg: str):
         self.hide_loading()
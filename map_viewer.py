@@ -26,30 +26,71 @@ Map layers (toggle via LayerControl)
 
 Popup on each marker shows all aggregated stats for that station.
 
+Layer modes (generate_map(layer_mode=...))
+------------------------------------------
+- "layers"  : one FeatureGroup of markers per variable (above); every popup
+              and sparkline is written once per variable.
+- "restyle" : one marker set whose popups are written once; a "Variable"
+              control recolours/resizes the markers in the browser from a
+              small per-variable table of colours, radii and values.
+
 Dependencies: folium, matplotlib, pandas, numpy
 (install via the graph_generator conda environment — see readme.md)
 """
 
 import html as _html
+import hashlib
+import inspect
 import io
+import json
 import base64
+import logging
 import os
+import re
 from datetime import date
+from functools import lru_cache
 import pandas as pd
 import numpy as np
 import matplotlib
 import matplotlib.colors as mcolors
 import matplotlib.dates as mdates
+import matplotlib.ticker as mticker
+import matplotlib.transforms as mtransforms
 import matplotlib.pyplot as plt
 import folium
+from branca.element import MacroElement
 from folium.plugins import HeatMap
-from data_processing import detect_date_format
+from jinja2 import Template
+from data_loader import load_dataset, read_last_days, CACHE_DIRNAME, WINDOW_DAYS
 
 
 # ── Map defaults ────────────────────────────────────────────────────────────
 GUATEMALA_CENTER = [15.5, -90.3]
 DEFAULT_ZOOM = 7
 
+# Base tile layers (name, URL template, attribution, max zoom) — first is shown
+TILE_LAYERS = [
+    ("OpenStreetMap", "https://tile.openstreetmap.org/{z}/{x}/{y}.png",
+     '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors', 19),
+    ("Satélite (Esri)",
+     "https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}",
+     "Esri", 18),
+    ("Topografía (Esri)",
+     "https://server.arcgisonline.com/ArcGIS/rest/services/World_Topo_Map/MapServer/tile/{z}/{y}/{x}",
+     "Esri", 18),
+]
+HEATMAP_LABEL = "Mapa de calor (Lluvia)"
+HEATMAP_OPTIONS = {"radius": 35, "blur": 25, "max_zoom": 10}
+
+# Interpolated 30-day rainfall surface (IDW) drawn as one image overlay
+RAIN_SURFACE_LABEL = "Lluvia interpolada 30d (IDW)"
+RAIN_SURFACE_BOUNDS = ((13.6, -92.3), (18.0, -88.1))   # (south, west), (north, east)
+RAIN_SURFACE_CELL_DEG = 0.025     # ~2.7 km
+RAIN_SURFACE_NEIGHBOURS = 8       # stations used per grid cell
+RAIN_SURFACE_POWER = 2.0          # IDW distance exponent
+RAIN_SURFACE_MAX_KM = 60.0        # cells farther than this from any station stay transparent
+RAIN_SURFACE_OPACITY = 0.7
+
 # ── Variable display configuration ──────────────────────────────────────────
 # Keys must match column names produced by build_station_summary().
 VARIABLES: dict = {
@@ -112,19 +153,13 @@ def build_station_summary(csv_path: str) -> pd.DataFrame:
     Raises:
         ValueError: If the CSV has no rows with valid coordinates.
     """
-    df = pd.read_csv(csv_path, header=0, low_memory=False)
-
-    sample = str(df["fecha"].dropna().iloc[0]).strip()
-    df["fecha"] = pd.to_datetime(df["fecha"], format=detect_date_format(sample))
-
-    # Filter to the last 30 days from the dataset's most recent date
-    max_date = df["fecha"].max()
-    cutoff = max_date - pd.Timedelta(days=30)
-    df = df[df["fecha"] >= cutoff].copy()
+    # Last 30 days from the dataset's most recent date — read from the end of
+    # the file, so the cost does not grow with the archive length
+    df = read_last_days(csv_path, WINDOW_DAYS, "map_summary")
 
     # ── Aggregate per station ────────────────────────────────────────────────
     agg = (
-        df.groupby("Nombre")
+        df.groupby("Nombre", observed=True)
         .agg(
             lluvia_total=("lluvia", "sum"),
             tseca_mean=("tseca", "mean"),
@@ -140,7 +175,7 @@ def build_station_summary(csv_path: str) -> pd.DataFrame:
     )
 
     # ── Geographic coordinates (constant per station) ────────────────────────
-    geo = df.groupby("Nombre").agg(
+    geo = df.groupby("Nombre", observed=True).agg(
         Latitud=("Latitud", "first"),
         Longitud=("Longitud", "first"),
         Altitud=("Altitud", "first"),
@@ -149,7 +184,7 @@ def build_station_summary(csv_path: str) -> pd.DataFrame:
     # ── Station ID column (differs between CSV variants) ─────────────────────
     id_col = "ID" if "ID" in df.columns else ("estacion" if "estacion" in df.columns else None)
     if id_col:
-        geo = geo.join(df.groupby("Nombre")[id_col].first().rename("station_id"))
+        geo = geo.join(df.groupby("Nombre", observed=True)[id_col].first().rename("station_id"))
 
     summary = agg.join(geo, on="Nombre")
     summary = summary.dropna(subset=["Latitud", "Longitud"])
@@ -175,13 +210,11 @@ def build_station_history(csv_path: str) -> dict:
             month, lluvia_total, tseca_mean, tmin_mean, tmax_mean, hum_rel_mean
         sorted by month ascending.
     """
-    df = pd.read_csv(csv_path, header=0, low_memory=False)
-    sample = str(df["fecha"].dropna().iloc[0]).strip()
-    df["fecha"] = pd.to_datetime(df["fecha"], format=detect_date_format(sample))
+    df = load_dataset(csv_path, "map_history")
     df["month"] = df["fecha"].dt.to_period("M").dt.to_timestamp()
 
     history = {}
-    for name, group in df.groupby("Nombre"):
+    for name, group in df.groupby("Nombre", observed=True):
         monthly = (
             group.groupby("month")
             .agg(
@@ -198,9 +231,120 @@ def build_station_history(csv_path: str) -> dict:
     return history
 
 
-def _build_sparklines(history: dict) -> dict:
-    """Pre-generate base64 sparkline PNGs for every station in history."""
-    return {name: _sparkline_b64(df) for name, df in history.items()}
+# ── Sparkline cache ──────────────────────────────────────────────────────────
+# PNGs are stored as <sha1>.png, keyed by the station's monthly values and the
+# rendering parameters. Bump SPARKLINE_VERSION whenever a sparkline renderer
+# changes its look; the backend and its library version are part of the key.
+SPARKLINE_VERSION = 1
+SPARKLINE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+_SPARKLINE_COLUMNS = ("lluvia_total", "tseca_mean")
+
+# "matplotlib": _sparkline_b64 (full figure); "pillow": _sparkline_pillow_b64,
+# the same chart drawn directly into a small image (~19x faster, ~4x smaller)
+SPARKLINE_BACKENDS = ("matplotlib", "pillow")
+
+
+def _render_sparkline(monthly_df: pd.DataFrame, backend: str = "matplotlib") -> str:
+    """Base64 PNG sparkline of one station with the chosen backend."""
+    if backend == "pillow":
+        return _sparkline_pillow_b64(monthly_df)
+    return _sparkline_b64(monthly_df)
+
+
+def _backend_version(backend: str) -> str:
+    if backend == "pillow":
+        import PIL
+        return f"pillow{PIL.__version__}"
+    return f"mpl{matplotlib.__version__}"
+
+
+def sparkline_cache_dir(output_dir: str) -> str:
+    """Sparkline cache folder used by generate_map() for maps saved in output_dir."""
+    return os.path.join(output_dir, CACHE_DIRNAME, "sparklines")
+
+
+def _sparkline_key(monthly_df: pd.DataFrame, backend: str = "matplotlib") -> str:
+    """Content hash of everything the sparkline of one station depends on."""
+    h = hashlib.sha1(f"v{SPARKLINE_VERSION}|{backend}|{_backend_version(backend)}".encode())
+    h.update(monthly_df["month"].to_numpy("datetime64[ns]").view(np.int64).tobytes())
+    for col in _SPARKLINE_COLUMNS:
+        h.update(monthly_df[col].to_numpy(np.float64, na_value=np.nan).tobytes())
+    return h.hexdigest()
+
+
+def _cached_sparkline(monthly_df: pd.DataFrame, cache_dir: str, backend: str = "matplotlib"):
+    """
+    Return (base64 PNG, was_cached) for one station, rendering only on a miss.
+
+    Hits refresh the file's mtime, which is the LRU order used by
+    _evict_sparklines(). Cache I/O errors fall back to plain rendering.
+    """
+    if monthly_df is None or len(monthly_df) < 2:
+        return "", False
+    path = os.path.join(cache_dir, f"{_sparkline_key(monthly_df, backend)}.png")
+    try:
+        with open(path, "rb") as f:
+            png = f.read()
+        os.utime(path)
+        return base64.b64encode(png).decode("utf-8"), True
+    except OSError:
+        pass
+
+    b64 = _render_sparkline(monthly_df, backend)
+    if b64:
+        try:
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(base64.b64decode(b64))
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.warning(f"Could not write sparkline cache entry '{path}': {e}")
+    return b64, False
+
+
+def _evict_sparklines(cache_dir: str, max_bytes: int = SPARKLINE_CACHE_MAX_BYTES) -> int:
+    """Delete least-recently-used sparklines until the folder fits max_bytes; returns count."""
+    try:
+        entries = [e for e in os.scandir(cache_dir) if e.is_file() and e.name.endswith(".png")]
+    except OSError:
+        return 0
+    stats = [(e.stat().st_mtime_ns, e.stat().st_size, e.path) for e in entries]
+    total = sum(size for _, size, _ in stats)
+    removed = 0
+    for _, size, path in sorted(stats):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    return removed
+
+
+def _build_sparklines(history: dict, cache_dir: str = None, backend: str = "matplotlib") -> dict:
+    """
+    Pre-generate base64 sparkline PNGs for every station in history.
+
+    With cache_dir, stations whose monthly history is unchanged since an
+    earlier run are read from the cache instead of being re-rendered.
+    backend is one of SPARKLINE_BACKENDS.
+    """
+    if backend not in SPARKLINE_BACKENDS:
+        raise ValueError(f"backend must be one of {SPARKLINE_BACKENDS}, not {backend!r}")
+    if not cache_dir:
+        return {name: _render_sparkline(df, backend) for name, df in history.items()}
+
+    os.makedirs(cache_dir, exist_ok=True)
+    sparklines, reused = {}, 0
+    for name, df in history.items():
+        sparklines[name], hit = _cached_sparkline(df, cache_dir, backend)
+        reused += hit
+    evicted = _evict_sparklines(cache_dir)
+    logging.info(f"Sparklines: {reused}/{len(history)} reused from cache"
+                 + (f", {evicted} evicted" if evicted else ""))
+    return sparklines
 
 
 def _sparkline_b64(monthly_df: pd.DataFrame) -> str:
@@ -245,34 +389,267 @@ def _sparkline_b64(monthly_df: pd.DataFrame) -> str:
     return base64.b64encode(buf.read()).decode("utf-8")
 
 
+# ── Lightweight sparkline backend ────────────────────────────────────────────
+# Draws the same chart as _sparkline_b64 directly with Pillow (already a
+# matplotlib dependency): no Figure, artist tree or tight-bbox pass. Ticks come
+# from the same locators matplotlib would use; the plot box is placed the way
+# tight_layout + bbox_inches="tight" place it, i.e. shifted by the width of the
+# widest tick label. Geometry is in final pixels (3.8 x 1.8 in at 90 dpi) and
+# drawn at _SPK_SCALE x for anti-aliasing, then box-reduced.
+_SPK_SIZE = (352, 172)
+_SPK_TOP, _SPK_BOTTOM = 9, 132
+_SPK_LEFT_PAD = 32.5                    # image edge → left axis, minus the widest left tick label
+_SPK_RIGHT_EDGE = 320.5                 # right axis + widest right tick label
+_SPK_RIGHT_MAX = 343                    # no right axis: plot stops where the last x label fits
+_SPK_SCALE = 2
+_SPK_BAR = (119, 172, 226)              # #4a90d9 at alpha 0.75 over white
+_SPK_BAR_LABEL = (74, 144, 217)         # #4a90d9
+_SPK_LINE = (224, 90, 43)               # #e05a2b
+_SPK_TICK_PX = 7.5                      # 6 pt at 90 dpi
+_SPK_LABEL_PX = 8.75                    # 7 pt at 90 dpi
+_SPK_TICK_LEN = 4
+_SPK_Y_NBINS = 8                        # AutoLocator: 123 px axis / (2 x 6 pt labels)
+
+
+@lru_cache(maxsize=None)
+def _sparkline_font(px: float):
+    from PIL import ImageFont
+    path = matplotlib.font_manager.findfont("DejaVu Sans")
+    return ImageFont.truetype(path, round(px * _SPK_SCALE))
+
+
+def _axis_range(lo: float, hi: float, margin: float = 0.05) -> tuple:
+    """Autoscaled limits of matplotlib: widen a zero-width range, then add margins."""
+    lo, hi = mtransforms.nonsingular(lo, hi, expander=0.05)
+    pad = (hi - lo) * margin
+    return lo - pad, hi + pad
+
+
+def _y_ticks(lo: float, hi: float) -> np.ndarray:
+    """Ticks matplotlib draws on a sparkline y axis spanning [lo, hi]."""
+    ticks = mticker.MaxNLocator(nbins=_SPK_Y_NBINS, steps=[1, 2, 2.5, 5, 10]).tick_values(lo, hi)
+    span = hi - lo
+    return ticks[(ticks >= lo - span * 1e-9) & (ticks <= hi + span * 1e-9)]
+
+
+def _tick_labels(ticks: np.ndarray) -> list:
+    """Format ticks with the fewest shared decimals that keep them exact (20.0, 29.75, −0.04, …)."""
+    scale = max(float(np.max(np.abs(ticks))), 1.0)
+    decimals = next((d for d in range(7) if np.allclose(np.round(ticks, d), ticks, rtol=0, atol=scale * 1e-9)), 6)
+    if decimals == 0 and len(ticks) > 1 and np.min(np.diff(ticks)) < 1:
+        decimals = 1                                # 0.0, 2.5 … not 0, 2.5
+    labels = []
+    for t in ticks:
+        text = f"{t:.{decimals}f}"
+        if float(text) == 0:
+            text = text.lstrip("-")                 # no "-0.00"
+        labels.append(text.replace("-", "\u2212"))  # matplotlib's Unicode minus
+    return labels
+
+
+def _label_width(labels: list, font) -> float:
+    """Widest rendered label in final (not supersampled) pixels."""
+    return max((font.getlength(text) for text in labels), default=0) / _SPK_SCALE
+
+
+def _sparkline_pillow_b64(monthly_df: pd.DataFrame) -> str:
+    """
+    Same chart as _sparkline_b64 (rainfall bars, mean-temperature line),
+    drawn with Pillow and saved as a small palette PNG.
+
+    Returns empty string if the dataframe has fewer than 2 months.
+    """
+    if monthly_df is None or len(monthly_df) < 2:
+        return ""
+    from PIL import Image, ImageDraw
+
+    s = _SPK_SCALE
+    months = pd.DatetimeIndex(monthly_df["month"])
+    days = months.to_numpy("datetime64[D]").astype(np.float64)
+    lluvia = monthly_df["lluvia_total"].fillna(0).to_numpy(np.float64)
+    temp = monthly_df["tseca_mean"].to_numpy(np.float64, na_value=np.nan)
+    valid = ~np.isnan(temp)
+    tick_font = _sparkline_font(_SPK_TICK_PX)
+    label_font = _sparkline_font(_SPK_LABEL_PX)
+    tick = _SPK_TICK_LEN * s
+
+    # Data limits as matplotlib autoscales them: bars stick to 0 with 5%
+    # headroom, everything else gets 5% margins
+    x0, x1 = _axis_range(days.min() - 10, days.max() + 10)
+    if lluvia.max() > 0:
+        l_lo, l_hi = 0.0, lluvia.max() * 1.05
+    else:
+        l_lo, l_hi = _axis_range(0.0, 0.0)
+    l_ticks = _y_ticks(l_lo, l_hi)
+    l_labels = _tick_labels(l_ticks)
+    if valid.any():
+        t_lo, t_hi = _axis_range(temp[valid].min(), temp[valid].max())
+        t_ticks = _y_ticks(t_lo, t_hi)
+        t_labels = _tick_labels(t_ticks)
+    x_ticks = mdates.AutoDateLocator().tick_values(mdates.num2date(x0), mdates.num2date(x1))
+    x_ticks = x_ticks[(x_ticks >= x0) & (x_ticks <= x1)]
+    x_labels = [mdates.num2date(d).strftime("%m/%y") for d in x_ticks]
+
+    # Plot box: tight_layout moves each side by the widest tick label
+    left = _SPK_LEFT_PAD + _label_width(l_labels, tick_font)
+    top, bottom = _SPK_TOP, _SPK_BOTTOM
+    if valid.any():
+        r_width = _label_width(t_labels, tick_font)
+        right = _SPK_RIGHT_EDGE - r_width
+    else:
+        # the last 45°-rotated month label must end inside the figure
+        l, t, r, b = tick_font.getbbox(x_labels[-1]) if x_labels else (0, 0, 0, 0)
+        half = (r - l + b - t) / s / np.sqrt(2) / 2
+        frac = (x_ticks[-1] - x0) / (x1 - x0) if x_labels else 1.0
+        right = min(_SPK_RIGHT_MAX, left + (_SPK_RIGHT_MAX - half - left) / max(frac, 1e-9))
+    # spines snap to whole pixels, as Agg does
+    left, top, right, bottom = (int(v + 0.5) * s for v in (left, top, right, bottom))
+
+    def sx(d):
+        return left + (d - x0) / (x1 - x0) * (right - left)
+
+    def sy_l(v):
+        return bottom - (v - l_lo) / (l_hi - l_lo) * (bottom - top)
+
+    img = Image.new("RGB", (_SPK_SIZE[0] * s, _SPK_SIZE[1] * s), "white")
+    draw = ImageDraw.Draw(img)
+
+    # Rainfall bars (20 days wide)
+    for d, v in zip(days, lluvia):
+        if v > 0:
+            draw.rectangle([sx(d - 10), sy_l(v), sx(d + 10), sy_l(0)], fill=_SPK_BAR)
+
+    # Left axis ticks + labels
+    for t, text in zip(l_ticks, l_labels):
+        y = sy_l(t)
+        draw.line([(left - tick, y), (left, y)], fill=_SPK_BAR_LABEL, width=s)
+        draw.text((left - tick - 2 * s, y), text, font=tick_font, fill=_SPK_BAR_LABEL, anchor="rm")
+    _draw_vertical_label(img, "mm", label_font, _SPK_BAR_LABEL, 17 * s, (top + bottom) / 2)
+
+    # x ticks: rotated month labels centred under the tick
+    for d, text in zip(x_ticks, x_labels):
+        x = sx(d)
+        draw.line([(x, bottom), (x, bottom + tick)], fill="black", width=s)
+        _draw_rotated_text(img, text, tick_font, "black", x, bottom + tick + 2 * s)
+
+    # Temperature line (right axis) — only when there is any temperature
+    if valid.any():
+        def sy_r(v):
+            return bottom - (v - t_lo) / (t_hi - t_lo) * (bottom - top)
+
+        for t, text in zip(t_ticks, t_labels):
+            y = sy_r(t)
+            draw.line([(right, y), (right + tick, y)], fill=_SPK_LINE, width=s)
+            draw.text((right + tick + 2 * s, y), text, font=tick_font, fill=_SPK_LINE, anchor="lm")
+        _draw_vertical_label(img, "°C", label_font, _SPK_LINE, right + (r_width + 22.5) * s,
+                             (top + bottom) / 2)
+
+        points = [(sx(d), sy_r(v)) if ok else None for d, v, ok in zip(days, temp, valid)]
+        segment = []
+        for p in points + [None]:
+            if p is not None:
+                segment.append(p)
+                continue
+            if len(segment) > 1:
+                draw.line(segment, fill=_SPK_LINE, width=round(1.5 * s), joint="curve")
+            segment = []
+        r = 1.875 * s                               # 2 pt marker + 1 pt edge
+        for p in points:
+            if p is not None:
+                draw.ellipse([p[0] - r, p[1] - r, p[0] + r, p[1] + r], fill=_SPK_LINE)
+
+    # outline covers whole output pixels on every side (inset by width - 1)
+    draw.rectangle([left, top, right + s - 1, bottom + s - 1], outline="black", width=s)
+
+    small = img.reduce(s)
+    # Few distinct colours: a 32-entry palette keeps the PNG a few KB. Fast
+    # octree quantizing and zlib level 6 cost ~2 ms; optimize=True / median
+    # cut add ~10 ms per image for a few hundred bytes
+    small = small.quantize(colors=32, method=Image.Quantize.FASTOCTREE)
+    buf = io.BytesIO()
+    small.save(buf, format="PNG", compress_level=6)
+    return base64.b64encode(buf.getvalue()).decode("utf-8")
+
+
+def _draw_rotated_text(img, text, font, fill, cx, y_top, angle=45):
+    """Paste text rotated by `angle`, its bounding box centred on cx with top at y_top."""
+    from PIL import Image, ImageDraw
+    l, t, r, b = font.getbbox(text)
+    tile = Image.new("L", (r - l + 2, b - t + 2), 0)
+    ImageDraw.Draw(tile).text((1 - l, 1 - t), text, font=font, fill=255)
+    tile = tile.rotate(angle, resample=Image.BICUBIC, expand=True)
+    img.paste(Image.new("RGB", tile.size, fill), (round(cx - tile.width / 2), round(y_top)), tile)
+
+
+def _draw_vertical_label(img, text, font, fill, cx, cy):
+    """Paste an axis label rotated 90° (reading bottom to top), centred on (cx, cy)."""
+    from PIL import Image, ImageDraw
+    l, t, r, b = font.getbbox(text)
+    tile = Image.new("L", (r - l + 2, b - t + 2), 0)
+    ImageDraw.Draw(tile).text((1 - l, 1 - t), text, font=font, fill=255)
+    tile = tile.rotate(90, expand=True)
+    img.paste(Image.new("RGB", tile.size, fill),
+              (round(cx - tile.width / 2), round(cy - tile.height / 2)), tile)
+
+
 # ── Colour / radius helpers ──────────────────────────────────────────────────
 
-def _value_to_hex(value, vmin: float, vmax: float, cmap_name: str) -> str:
-    """Map a scalar to a hex colour string using a matplotlib colormap."""
-    if pd.isna(value) or vmin == vmax:
-        return "#aaaaaa"
-    norm = mcolors.Normalize(vmin=vmin, vmax=vmax, clip=True)
+NAN_COLOR = "#aaaaaa"
+
+
+@lru_cache(maxsize=None)
+def _colormap_lut(cmap_name: str) -> np.ndarray:
+    """Hex colour LUT of a matplotlib colormap (256 entries), built once per name."""
     cmap = matplotlib.colormaps[cmap_name]
-    rgba = cmap(norm(float(value)))
-    return mcolors.to_hex(rgba)
+    return np.array([mcolors.to_hex(rgba) for rgba in cmap(np.arange(cmap.N))])
+
 
+def _values_to_hex(values, vmin: float, vmax: float, cmap_name: str) -> np.ndarray:
+    """
+    Map a column of values to hex colour strings in one NumPy pass.
 
-def _value_to_radius(value, vmin: float, vmax: float,
-                     rmin: float = 5, rmax: float = 22) -> float:
-    """Scale value → marker radius using square-root scaling."""
-    if pd.isna(value) or vmin >= vmax:
-        return rmin
-    sq = np.sqrt(max(float(value) - vmin, 0.0))
+    Same result as matplotlib's Normalize(vmin, vmax, clip=True) followed by
+    the colormap lookup: the normalised value picks one of the cmap.N (256)
+    LUT entries exactly as Colormap.__call__ does.
+    NaN values (and a zero-width range) map to NAN_COLOR.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    colors = np.full(values.shape, NAN_COLOR, dtype=object)
+    if vmin == vmax:
+        return colors
+    lut = _colormap_lut(cmap_name)
+    valid = ~np.isnan(values)
+    norm = np.clip((values[valid] - vmin) / (vmax - vmin), 0.0, 1.0)
+    idx = np.minimum((norm * len(lut)).astype(np.intp), len(lut) - 1)
+    colors[valid] = lut[idx]
+    return colors
+
+
+def _values_to_radius(values, vmin: float, vmax: float,
+                      rmin: float = 5, rmax: float = 22) -> np.ndarray:
+    """Scale a column of values → marker radii using square-root scaling; NaN → rmin."""
+    values = np.asarray(values, dtype=np.float64)
+    radii = np.full(values.shape, float(rmin))
     sq_max = np.sqrt(max(vmax - vmin, 0.0))
-    if sq_max == 0:
-        return rmin
-    return rmin + (sq / sq_max) * (rmax - rmin)
+    if vmin >= vmax or sq_max == 0:
+        return radii
+    valid = ~np.isnan(values)
+    sq = np.sqrt(np.maximum(values[valid] - vmin, 0.0))
+    radii[valid] = rmin + (sq / sq_max) * (rmax - rmin)
+    return radii
 
 
 # ── Popup HTML ───────────────────────────────────────────────────────────────
 
-def _popup_html(row: pd.Series, hist_b64: str = "") -> str:
-    """Build the HTML content displayed when a station marker is clicked."""
+def _popup_html(row: dict, hist_b64: str = "", hist_url: str = "") -> str:
+    """
+    Build the HTML content displayed when a station marker is clicked.
+
+    `row` is one summary row as a mapping (pd.Series or itertuples()._asdict()).
+    The history chart is either embedded (hist_b64) or a sidecar file
+    (hist_url) referenced through data-src, which _LazyPopupImages turns into
+    src when the popup opens.
+    """
     name = _html.escape(str(row["Nombre"]).replace("_", " "))
     station_id = _html.escape(str(row.get("station_id", "—")))
     altitud = row.get("Altitud")
@@ -308,12 +685,14 @@ def _popup_html(row: pd.Series, hist_b64: str = "") -> str:
     ])
 
     chart_html = ""
-    if hist_b64:
+    if hist_b64 or hist_url:
+        img_attr = (f"data-src='{_html.escape(hist_url, quote=True)}'" if hist_url
+                    else f"src='data:image/png;base64,{hist_b64}'")
         chart_html = (
             "<tr><td colspan='2' style='padding-top:6px'>"
             "<div style='font-size:10px;color:#555;margin-bottom:2px'>"
             "Historial mensual &mdash; lluvia (azul) / temp. (naranja)</div>"
-            f"<img src='data:image/png;base64,{hist_b64}' "
+            f"<img {img_attr} "
             "style='width:100%;border-radius:3px'></td></tr>"
         )
 
@@ -328,34 +707,39 @@ def _popup_html(row: pd.Series, hist_b64: str = "") -> str:
 
 # ── Layer builder ─────────────────────────────────────────────────────────────
 
+def _station_popup(row: dict, sparklines: dict = None, chart_urls: dict = None) -> folium.Popup:
+    """
+    Popup of one station. With chart_urls (sidecar charts) the popup is lazy
+    (when folium supports it, see POPUP_LAZY): its HTML is only turned into
+    DOM on the first click, and the chart image is only fetched when the
+    popup opens.
+    """
+    if chart_urls is not None:
+        hist_url = chart_urls.get(row["Nombre"], "")
+        lazy = {"lazy": True} if POPUP_LAZY else {}
+        return folium.Popup(_popup_html(row, hist_url=hist_url),
+                            max_width=390 if hist_url else 270, **lazy)
+    hist_b64 = (sparklines or {}).get(row["Nombre"], "")
+    return folium.Popup(_popup_html(row, hist_b64), max_width=390 if hist_b64 else 270)
+
+
 def _add_variable_layer(
     m: folium.Map,
     summary: pd.DataFrame,
     var_key: str,
     show: bool = False,
     sparklines: dict = None,
+    chart_urls: dict = None,
 ) -> None:
     """Add a FeatureGroup layer to the map for one variable."""
     cfg = VARIABLES[var_key]
-    valid = summary[var_key].dropna()
-    vmin = float(valid.min()) if len(valid) else 0.0
-    vmax = float(valid.max()) if len(valid) else 1.0
+    style = _variable_style(summary, var_key)
 
     fg = folium.FeatureGroup(name=cfg["label"], show=show)
 
-    for _, row in summary.iterrows():
-        lat, lon = row["Latitud"], row["Longitud"]
+    for i, row in enumerate(summary.itertuples(index=False)):
+        row = row._asdict()
         value = row.get(var_key)
-
-        color = _value_to_hex(value, vmin, vmax, cfg["cmap"])
-
-        if cfg["radius_scale"]:
-            radius = _value_to_radius(
-                value, vmin, vmax, cfg.get("rmin", 5), cfg.get("rmax", 22)
-            )
-        else:
-            radius = cfg.get("radius", 8)
-
         tooltip_text = (
             f"{str(row['Nombre']).replace('_', ' ')}: "
             f"{value:.1f} {cfg['unit']}"
@@ -363,88 +747,366 @@ def _add_variable_layer(
             else str(row["Nombre"]).replace("_", " ")
         )
 
-        hist_b64 = (sparklines or {}).get(row["Nombre"], "")
-        popup_width = 390 if hist_b64 else 270
-
         folium.CircleMarker(
-            location=[lat, lon],
-            radius=radius,
+            location=[row["Latitud"], row["Longitud"]],
+            radius=style["radii"][i],
             color="white",
             weight=1,
             fill=True,
-            fill_color=color,
+            fill_color=style["colors"][i],
             fill_opacity=0.85,
-            popup=folium.Popup(_popup_html(row, hist_b64), max_width=popup_width),
+            popup=_station_popup(row, sparklines, chart_urls),
             tooltip=tooltip_text,
         ).add_to(fg)
 
     fg.add_to(m)
 
 
-# ── Main entry point ──────────────────────────────────────────────────────────
+# ── Restyle mode (one marker set) ─────────────────────────────────────────────
+
+LAYER_MODES = ("layers", "restyle")
+
+
+def _variable_style(summary: pd.DataFrame, var_key: str) -> dict:
+    """Per-station fill colours, radii and tooltip values for one variable."""
+    cfg = VARIABLES[var_key]
+    values = summary[var_key].to_numpy(dtype=np.float64, na_value=np.nan)
+    valid = values[~np.isnan(values)]
+    vmin = float(valid.min()) if len(valid) else 0.0
+    vmax = float(valid.max()) if len(valid) else 1.0
 
-def generate_map(summary: pd.DataFrame, output_dir: str, history: dict = None) -> str:
+    colors = _values_to_hex(values, vmin, vmax, cfg["cmap"])
+    if cfg["radius_scale"]:
+        radii = _values_to_radius(values, vmin, vmax, cfg.get("rmin", 5), cfg.get("rmax", 22))
+    else:
+        radii = np.full(len(values), float(cfg.get("radius", 8)))
+    return {"label": cfg["label"], "unit": cfg["unit"],
+            "colors": colors, "radii": radii, "values": values}
+
+
+def _style_table(style: dict) -> dict:
+    """JSON-ready, rounded copy of a _variable_style() result for _RestyleControl."""
+    rounded = np.round(style["values"], 1).tolist()
+    return {"label": style["label"], "unit": style["unit"],
+            "colors": style["colors"].tolist(),
+            "radii": np.round(style["radii"], 2).tolist(),
+            "values": [None if np.isnan(v) else v for v in rounded]}
+
+class _RestyleControl(MacroElement):
     """
-    Build a self-contained Folium/Leaflet HTML map of all stations.
+    Leaflet control with one radio button per variable. Selecting a variable
+    restyles the existing markers (fill colour, radius, tooltip) from the
+    per-variable table instead of switching between marker layers.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function() {
+            var markers = [{{ this.marker_names|join(", ") }}];
+            var names = {{ this.names|tojson }};
+            var styles = {{ this.styles|tojson }};
+            var order = {{ this.order|tojson }};
+            function restyle(key) {
+                var s = styles[key];
+                markers.forEach(function(marker, i) {
+                    marker.setStyle({fillColor: s.colors[i]});
+                    marker.setRadius(s.radii[i]);
+                    var v = s.values[i];
+                    marker.setTooltipContent(
+                        v === null ? names[i] : names[i] + ": " + v.toFixed(1) + " " + s.unit);
+                });
+            }
+            var control = L.control({position: "topright"});
+            control.onAdd = function() {
+                var div = L.DomUtil.create("div", "leaflet-control-layers leaflet-control-layers-expanded");
+                var html = "<b>Variable</b>";
+                order.forEach(function(key, i) {
+                    html += '<label style="display:block"><input type="radio" name="variable" value="'
+                        + key + '"' + (i === 0 ? " checked" : "") + "> " + styles[key].label + "</label>";
+                });
+                div.innerHTML = html;
+                L.DomEvent.disableClickPropagation(div);
+                L.DomEvent.on(div, "change", function(e) { restyle(e.target.value); });
+                return div;
+            };
+            control.addTo({{ this._parent.get_name() }});
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, markers, names, styles):
+        super().__init__()
+        self._name = "RestyleControl"
+        self.marker_names = [marker.get_name() for marker in markers]
+        self.names = names
+        self.styles = styles
+        # tojson sorts object keys; keep the VARIABLES order for the buttons
+        self.order = list(styles)
+
+
+def _add_restyle_markers(m: folium.Map, summary: pd.DataFrame, sparklines: dict = None,
+                         chart_urls: dict = None) -> None:
+    """
+    Add one marker per station, styled for the first variable, plus the
+    _RestyleControl that switches variables client-side. Popups (and their
+    sparklines) are written once per station instead of once per variable.
+    """
+    styles = {var_key: _style_table(_variable_style(summary, var_key)) for var_key in VARIABLES}
+    first = styles[next(iter(VARIABLES))]
+    names = [str(n).replace("_", " ") for n in summary["Nombre"]]
+
+    fg = folium.FeatureGroup(name="Estaciones", show=True)
+    markers = []
+    for i, row in enumerate(summary.itertuples(index=False)):
+        row = row._asdict()
+        value = first["values"][i]
+        tooltip_text = names[i] if value is None else f"{names[i]}: {value:.1f} {first['unit']}"
+
+        marker = folium.CircleMarker(
+            location=[row["Latitud"], row["Longitud"]],
+            radius=first["radii"][i],
+            color="white",
+            weight=1,
+            fill=True,
+            fill_color=first["colors"][i],
+            fill_opacity=0.85,
+            popup=_station_popup(row, sparklines, chart_urls),
+            tooltip=tooltip_text,
+        )
+        marker.add_to(fg)
+        markers.append(marker)
+    fg.add_to(m)
+    _RestyleControl(markers, names, styles).add_to(m)
+
+
+# ── Sidecar chart assets ─────────────────────────────────────────────────────
+
+CHART_MODES = ("inline", "sidecar")
+
+# Popup(lazy=True) only exists in recent folium releases; older ones would
+# pass the keyword on as a Leaflet option and build every popup eagerly
+POPUP_LAZY = "lazy" in inspect.signature(folium.Popup.__init__).parameters
+
+
+def _write_chart_assets(sparklines: dict, output_dir: str, assets_name: str) -> dict:
+    """
+    Write each station's sparkline as <output_dir>/<assets_name>/<station>.png.
+
+    Charts left from an earlier map with the same name (stations no longer
+    in the summary, renamed stations) are deleted.
+
+    Returns:
+        dict mapping station Nombre → URL of its chart relative to the map.
+    """
+    assets_dir = os.path.join(output_dir, assets_name)
+    os.makedirs(assets_dir, exist_ok=True)
+    urls, used = {}, set()
+    for name, b64 in sparklines.items():
+        if not b64:
+            continue
+        stem = re.sub(r"[^\w.-]", "_", str(name))
+        while stem.lower() in used:      # keep names unique on case-insensitive disks
+            stem += "_"
+        used.add(stem.lower())
+        with open(os.path.join(assets_dir, f"{stem}.png"), "wb") as f:
+            f.write(base64.b64decode(b64))
+        urls[name] = f"{assets_name}/{stem}.png"
+    for entry in os.scandir(assets_dir):
+        if entry.is_file() and entry.name.endswith(".png") and entry.name[:-4].lower() not in used:
+            os.remove(entry.path)
+    return urls
+
+
+class _LazyPopupImages(MacroElement):
+    """Loads popup images (data-src → src) only when their popup opens."""
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        {{ this._parent.get_name() }}.on("popupopen", function(e) {
+            var root = e.popup.getElement();
+            if (!root) return;
+            root.querySelectorAll("img[data-src]").forEach(function(img) {
+                img.src = img.getAttribute("data-src");
+                img.removeAttribute("data-src");
+            });
+        });
+        {% endmacro %}
+    """)
+
+    def __init__(self):
+        super().__init__()
+        self._name = "LazyPopupImages"
+
+
+# ── Interpolated rainfall surface ─────────────────────────────────────────────
+
+def _mercator_y(lat):
+    return np.log(np.tan(np.pi / 4 + np.radians(lat) / 2))
+
+
+def _idw_grid(points_km: np.ndarray, values: np.ndarray, xs: np.ndarray, ys: np.ndarray,
+              k: int = RAIN_SURFACE_NEIGHBOURS, power: float = RAIN_SURFACE_POWER,
+              tile: int = 16):
+    """
+    Inverse-distance-weighted estimate on a rectilinear grid from the k
+    nearest stations of every cell.
+
+    Neighbour search is a tiled grid search: for each tile of tile x tile
+    cells, a station can only be among the k nearest of some cell if its
+    minimum distance to the tile rectangle is <= the k-th smallest maximum
+    distance; only those candidates enter the vectorised distance block. The
+    pruning is exact, and cost grows with local station density instead of
+    cells x stations.
 
     Args:
-        summary   : Output of build_station_summary().
-        output_dir: Directory where map.html will be saved (created if missing).
-        history   : Optional output of build_station_history(). When provided,
-                    each station popup includes an embedded monthly history chart.
+        points_km: (n, 2) station x/y in km (local planar projection).
+        values   : (n,) station values.
+        xs, ys   : grid column x and row y coordinates in km.
 
     Returns:
-        Absolute path to the saved map.html file.
+        (estimate, nearest_km): two (len(ys), len(xs)) arrays.
     """
-    os.makedirs(output_dir, exist_ok=True)
+    k = min(k, len(points_km))
+    px, py = points_km[:, 0], points_km[:, 1]
+    estimate = np.empty((len(ys), len(xs)))
+    nearest = np.empty((len(ys), len(xs)))
+    for r0 in range(0, len(ys), tile):
+        ty = ys[r0:r0 + tile]
+        ylo, yhi = ty.min(), ty.max()
+        dy_min = np.maximum(0.0, np.maximum(ylo - py, py - yhi))
+        dy_max = np.maximum(np.abs(py - ylo), np.abs(py - yhi))
+        for c0 in range(0, len(xs), tile):
+            tx = xs[c0:c0 + tile]
+            xlo, xhi = tx.min(), tx.max()
+            dmin = np.hypot(np.maximum(0.0, np.maximum(xlo - px, px - xhi)), dy_min)
+            dmax = np.hypot(np.maximum(np.abs(px - xlo), np.abs(px - xhi)), dy_max)
+            cand = dmin <= np.partition(dmax, k - 1)[k - 1]
+
+            d = np.hypot(tx[None, :, None] - px[cand], ty[:, None, None] - py[cand])
+            if d.shape[-1] > k:
+                idx = np.argpartition(d, k - 1, axis=-1)[..., :k]
+                d = np.take_along_axis(d, idx, axis=-1)
+                v = values[cand][idx]
+            else:
+                v = np.broadcast_to(values[cand], d.shape)
+            with np.errstate(divide="ignore"):
+                w = 1.0 / np.power(d, power)
+            exact = np.isinf(w)
+            # A cell on top of a station takes that station's value
+            w = np.where(exact.any(axis=-1, keepdims=True), exact.astype(np.float64), w)
+            block = (slice(r0, r0 + tile), slice(c0, c0 + tile))
+            estimate[block] = (w * v).sum(axis=-1) / w.sum(axis=-1)
+            nearest[block] = d.min(axis=-1)
+    return estimate, nearest
+
+
+def _rain_surface(summary: pd.DataFrame):
+    """
+    Interpolate lluvia_total over RAIN_SURFACE_BOUNDS and encode it as a PNG.
 
-    run_date   = date.today().strftime('%Y%m%d')
-    data_month = pd.Timestamp(summary['last_fecha'].max()).strftime('%Y%m')
-    map_name   = f"mapa_{run_date}_{data_month}.html"
+    Grid rows are evenly spaced in Web-Mercator y, so Leaflet's linear
+    stretching of the image between its bounds puts every row at its latitude.
 
-    sparklines = _build_sparklines(history) if history else {}
+    Returns:
+        dict(url=PNG data URI, bounds, vmin, vmax), or None with fewer than
+        3 stations reporting rainfall.
+    """
+    lluvia = summary["lluvia_total"].to_numpy(dtype=np.float64, na_value=np.nan)
+    ok = ~np.isnan(lluvia)
+    if ok.sum() < 3:
+        return None
+    lat = summary["Latitud"].to_numpy(dtype=np.float64)[ok]
+    lon = summary["Longitud"].to_numpy(dtype=np.float64)[ok]
+    values = lluvia[ok]
+
+    (south, west), (north, east) = RAIN_SURFACE_BOUNDS
+    n_cols = int(round((east - west) / RAIN_SURFACE_CELL_DEG))
+    n_rows = int(round((north - south) / RAIN_SURFACE_CELL_DEG))
+    # Cell centres; rows from north to south (image order)
+    cols = west + (np.arange(n_cols) + 0.5) * (east - west) / n_cols
+    y_n, y_s = _mercator_y(north), _mercator_y(south)
+    y = y_n - (np.arange(n_rows) + 0.5) * (y_n - y_s) / n_rows
+    rows = np.degrees(2 * np.arctan(np.exp(y)) - np.pi / 2)
+
+    # Local planar km around the centre latitude
+    kx = 111.32 * np.cos(np.radians((north + south) / 2))
+    ky = 110.57
+    points_km = np.column_stack([lon * kx, lat * ky])
+    estimate, nearest = _idw_grid(points_km, values, cols * kx, rows * ky)
+    estimate, nearest = estimate.ravel(), nearest.ravel()
+
+    vmin, vmax = 0.0, float(values.max())
+    lut = np.array([mcolors.to_rgb(c) for c in _colormap_lut(VARIABLES["lluvia_total"]["cmap"])])
+    norm = np.clip(estimate / vmax, 0.0, 1.0) if vmax > 0 else np.zeros_like(estimate)
+    idx = np.minimum((norm * len(lut)).astype(np.intp), len(lut) - 1)
+    rgba = np.empty((len(estimate), 4), dtype=np.uint8)
+    rgba[:, :3] = np.round(lut[idx] * 255)
+    rgba[:, 3] = np.where(nearest <= RAIN_SURFACE_MAX_KM, 255, 0)
+
+    from PIL import Image
+    buf = io.BytesIO()
+    Image.fromarray(rgba.reshape(n_rows, n_cols, 4), "RGBA").save(buf, format="PNG", optimize=True)
+    return {
+        "url": "data:image/png;base64," + base64.b64encode(buf.getvalue()).decode("ascii"),
+        "bounds": [list(RAIN_SURFACE_BOUNDS[0]), list(RAIN_SURFACE_BOUNDS[1])],
+        "vmin": vmin,
+        "vmax": vmax,
+    }
+
+
+def _surface_legend_html(vmin: float, vmax: float) -> str:
+    """Colour bar of the rainfall surface (same colormap as the markers)."""
+    lut = _colormap_lut(VARIABLES["lluvia_total"]["cmap"])
+    stops = ", ".join(lut[np.linspace(0, len(lut) - 1, 9).astype(int)])
+    return (
+        "<div style='font-family:sans-serif;font-size:11px;background:white;padding:6px 10px;"
+        "border-radius:6px;box-shadow:0 2px 6px rgba(0,0,0,.25)'>"
+        f"<b>{_html.escape(RAIN_SURFACE_LABEL)}</b>"
+        f"<div style='width:180px;height:10px;margin:4px 0;background:linear-gradient(to right, {stops})'></div>"
+        "<div style='display:flex;justify-content:space-between'>"
+        f"<span>{vmin:.0f} mm</span><span>{vmax:.0f} mm</span></div></div>"
+    )
 
-    m = folium.Map(location=GUATEMALA_CENTER, zoom_start=DEFAULT_ZOOM, tiles=None)
 
-    # ── Base tile layers ─────────────────────────────────────────────────────
-    folium.TileLayer("OpenStreetMap", name="OpenStreetMap").add_to(m)
-    folium.TileLayer(
-        tiles=(
-            "https://server.arcgisonline.com/ArcGIS/rest/services"
-            "/World_Imagery/MapServer/tile/{z}/{y}/{x}"
-        ),
-        attr="Esri",
-        name="Satélite (Esri)",
-    ).add_to(m)
-    folium.TileLayer(
-        tiles=(
-            "https://server.arcgisonline.com/ArcGIS/rest/services"
-            "/World_Topo_Map/MapServer/tile/{z}/{y}/{x}"
-        ),
-        attr="Esri",
-        name="Topografía (Esri)",
-    ).add_to(m)
+# JS shared by both engines: show the colour bar only while the surface layer is on
+_SURFACE_LEGEND_JS = """
+    var surfaceLegend = L.control({position: "bottomright"});
+    surfaceLegend.onAdd = function() {
+        var div = L.DomUtil.create("div");
+        div.innerHTML = %(html)s;
+        return div;
+    };
+    %(map)s.on("overlayadd", function(e) {
+        if (e.name === %(label)s) surfaceLegend.addTo(%(map)s);
+    });
+    %(map)s.on("overlayremove", function(e) {
+        if (e.name === %(label)s) surfaceLegend.remove();
+    });
+"""
 
-    # ── Variable marker layers (first one visible by default) ────────────────
-    for i, var_key in enumerate(VARIABLES):
-        _add_variable_layer(m, summary, var_key, show=(i == 0), sparklines=sparklines)
 
-    # ── Precipitation heatmap (toggle) ───────────────────────────────────────
-    heat_data = [
-        [row["Latitud"], row["Longitud"], float(row["lluvia_total"])]
-        for _, row in summary.iterrows()
-        if not pd.isna(row["lluvia_total"]) and row["lluvia_total"] > 0
-    ]
-    if heat_data:
-        fg_heat = folium.FeatureGroup(name="Mapa de calor (Lluvia)", show=False)
-        HeatMap(heat_data, radius=35, blur=25, max_zoom=10).add_to(fg_heat)
-        fg_heat.add_to(m)
+class _SurfaceLegend(MacroElement):
+    """Folium engine: colour bar shown while the rainfall surface overlay is active."""
 
-    # ── Layer control ────────────────────────────────────────────────────────
-    folium.LayerControl(collapsed=False).add_to(m)
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        {{ this.script(this._parent.get_name()) }}
+        {% endmacro %}
+    """)
+
+    def __init__(self, vmin: float, vmax: float):
+        super().__init__()
+        self._name = "SurfaceLegend"
+        self.html = _surface_legend_html(vmin, vmax)
+
+    def script(self, map_name: str) -> str:
+        return _SURFACE_LEGEND_JS % {"html": json.dumps(self.html), "map": map_name,
+                                     "label": json.dumps(RAIN_SURFACE_LABEL)}
+
+
+# ── Page furniture shared by both map engines ─────────────────────────────────
 
-    # ── Title banner ─────────────────────────────────────────────────────────
-    title_html = """
+_TITLE_HTML = """
     <div style="position:fixed;top:10px;left:50%;transform:translateX(-50%);
                 z-index:1000;background:white;padding:7px 18px;border-radius:6px;
                 box-shadow:0 2px 8px rgba(0,0,0,.3);font-family:sans-serif;
@@ -453,10 +1115,8 @@ def generate_map(summary: pd.DataFrame, output_dir: str, history: dict = None) -
         <span style="color:#666;font-size:11px"> &bull; Últimos 30 días</span>
     </div>
     """
-    m.get_root().html.add_child(folium.Element(title_html))
 
-    # ── Legend hint ──────────────────────────────────────────────────────────
-    legend_html = """
+_LEGEND_HTML = """
     <div style="position:fixed;bottom:30px;left:10px;z-index:1000;
                 background:white;padding:6px 12px;border-radius:6px;
                 box-shadow:0 2px 6px rgba(0,0,0,.25);font-family:sans-serif;
@@ -467,8 +1127,297 @@ def generate_map(summary: pd.DataFrame, output_dir: str, history: dict = None) -
         • Pasa el cursor para ver el valor rápido
     </div>
     """
-    m.get_root().html.add_child(folium.Element(legend_html))
+
+
+def _heat_points(summary: pd.DataFrame) -> list:
+    """[lat, lon, lluvia_total] of every station with rain, for the heat-map layer."""
+    lluvia = summary["lluvia_total"].to_numpy(dtype=np.float64, na_value=np.nan)
+    rainy = lluvia > 0   # NaN compares False
+    return np.column_stack([
+        summary["Latitud"].to_numpy(dtype=np.float64)[rainy],
+        summary["Longitud"].to_numpy(dtype=np.float64)[rainy],
+        lluvia[rainy],
+    ]).tolist()
+
+
+# ── Direct Leaflet engine ─────────────────────────────────────────────────────
+# Writes the page without the Folium object graph: the stations are one GeoJSON
+# FeatureCollection (popup HTML stored once per station) and a fixed script
+# builds the markers, tooltips, layers, heat map and controls in the browser.
+
+MAP_ENGINES = ("folium", "leaflet")
+_LEAFLET_JS = "https://cdn.jsdelivr.net/npm/leaflet@1.9.3/dist/leaflet.js"
+_LEAFLET_CSS = "https://cdn.jsdelivr.net/npm/leaflet@1.9.3/dist/leaflet.css"
+_LEAFLET_HEAT_JS = ("https://cdn.jsdelivr.net/gh/python-visualization/folium@main"
+                    "/folium/templates/leaflet_heat.min.js")
+
+_LEAFLET_PAGE = Template("""<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <link rel="stylesheet" href="{{ leaflet_css }}">
+    <script src="{{ leaflet_js }}"></script>
+    <script src="{{ heat_js }}"></script>
+    <style>
+        html, body { width: 100%; height: 100%; margin: 0; padding: 0; }
+        #map { position: absolute; top: 0; bottom: 0; right: 0; left: 0; }
+    </style>
+</head>
+<body>
+<div id="map"></div>
+{{ title_html }}
+{{ legend_html }}
+<script>
+(function() {
+    var data = {{ data }};
+    var map = L.map("map", {center: data.center, zoom: data.zoom});
+
+    var base = {};
+    data.tiles.forEach(function(t, i) {
+        var layer = L.tileLayer(t.url, {attribution: t.attr, maxZoom: t.max_zoom});
+        if (i === 0) layer.addTo(map);
+        base[t.name] = layer;
+    });
+
+    function tooltip(i, s) {
+        var v = s.values[i];
+        return v === null ? data.names[i] : data.names[i] + ": " + v.toFixed(1) + " " + s.unit;
+    }
+    function marker(feature, latlng, s) {
+        var p = feature.properties, i = p.i;
+        var m = L.circleMarker(latlng, {radius: s.radii[i], color: "white", weight: 1,
+                                        fill: true, fillColor: s.colors[i], fillOpacity: 0.85});
+        // Content function: the popup DOM is only built when it opens
+        m.bindPopup(function() { return p.popup; }, {maxWidth: p.width});
+        m.bindTooltip(tooltip(i, s));
+        return m;
+    }
+
+    var overlays = {};
+    if (data.mode === "restyle") {
+        var first = data.styles[data.order[0]], markers = [];
+        var group = L.geoJSON(data.stations, {pointToLayer: function(f, ll) {
+            var m = marker(f, ll, first);
+            markers.push(m);
+            return m;
+        }}).addTo(map);
+        overlays["Estaciones"] = group;
+        var control = L.control({position: "topright"});
+        control.onAdd = function() {
+            var div = L.DomUtil.create("div", "leaflet-control-layers leaflet-control-layers-expanded");
+            var html = "<b>Variable</b>";
+            data.order.forEach(function(key, i) {
+                html += '<label style="display:block"><input type="radio" name="variable" value="'
+                    + key + '"' + (i === 0 ? " checked" : "") + "> " + data.styles[key].label + "</label>";
+            });
+            div.innerHTML = html;
+            L.DomEvent.disableClickPropagation(div);
+            L.DomEvent.on(div, "change", function(e) {
+                var s = data.styles[e.target.value];
+                markers.forEach(function(m, i) {
+                    m.setStyle({fillColor: s.colors[i]});
+                    m.setRadius(s.radii[i]);
+                    m.setTooltipContent(tooltip(i, s));
+                });
+            });
+            return div;
+        };
+        control.addTo(map);
+    } else {
+        data.order.forEach(function(key, k) {
+            var s = data.styles[key];
+            var layer = L.geoJSON(data.stations, {pointToLayer: function(f, ll) { return marker(f, ll, s); }});
+            if (k === 0) layer.addTo(map);
+            overlays[s.label] = layer;
+        });
+    }
+
+    if (data.heat.length) {
+        overlays[data.heat_label] = L.heatLayer(data.heat, data.heat_options);
+    }
+    if (data.surface) {
+        overlays[data.surface.label] = L.imageOverlay(data.surface.url, data.surface.bounds,
+                                                      {opacity: data.surface.opacity});
+    }
+    L.control.layers(base, overlays, {collapsed: false}).addTo(map);
+{{ surface_js }}
+
+    if (data.lazy_images) {
+        map.on("popupopen", function(e) {
+            var root = e.popup.getElement();
+            if (!root) return;
+            root.querySelectorAll("img[data-src]").forEach(function(img) {
+                img.src = img.getAttribute("data-src");
+                img.removeAttribute("data-src");
+            });
+        });
+    }
+})();
+</script>
+</body>
+</html>
+""")
+
+
+def _leaflet_map_html(summary: pd.DataFrame, layer_mode: str = "layers",
+                      sparklines: dict = None, chart_urls: dict = None,
+                      surface: dict = None) -> str:
+    """
+    Render the whole map page for the "leaflet" engine.
+
+    Same layers, styles, popups, tooltips, heat map and controls as the Folium
+    path; the per-variable styles come from _variable_style() and the popups
+    from _popup_html(), so both engines show identical content.
+    """
+    styles = {var_key: _style_table(_variable_style(summary, var_key)) for var_key in VARIABLES}
+    features = []
+    for i, row in enumerate(summary.itertuples(index=False)):
+        row = row._asdict()
+        if chart_urls is not None:
+            hist_url = chart_urls.get(row["Nombre"], "")
+            popup, has_chart = _popup_html(row, hist_url=hist_url), bool(hist_url)
+        else:
+            hist_b64 = (sparklines or {}).get(row["Nombre"], "")
+            popup, has_chart = _popup_html(row, hist_b64), bool(hist_b64)
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "Point",
+                         "coordinates": [float(row["Longitud"]), float(row["Latitud"])]},
+            "properties": {"i": i, "popup": popup, "width": 390 if has_chart else 270},
+        })
+
+    data = {
+        "center": GUATEMALA_CENTER,
+        "zoom": DEFAULT_ZOOM,
+        "tiles": [{"name": n, "url": u, "attr": a, "max_zoom": z} for n, u, a, z in TILE_LAYERS],
+        "mode": layer_mode,
+        "names": [str(n).replace("_", " ") for n in summary["Nombre"]],
+        "order": list(styles),
+        "styles": styles,
+        "stations": {"type": "FeatureCollection", "features": features},
+        "heat": _heat_points(summary),
+        "heat_label": HEATMAP_LABEL,
+        "heat_options": {"radius": HEATMAP_OPTIONS["radius"], "blur": HEATMAP_OPTIONS["blur"],
+                         "maxZoom": HEATMAP_OPTIONS["max_zoom"], "minOpacity": 0.5},
+        "lazy_images": chart_urls is not None,
+        "surface": surface and {"url": surface["url"], "bounds": surface["bounds"],
+                                "opacity": RAIN_SURFACE_OPACITY, "label": RAIN_SURFACE_LABEL},
+    }
+    # "</" would end the <script> block early (popup HTML is full of it)
+    data_json = json.dumps(data, ensure_ascii=False, allow_nan=False).replace("</", "<\\/")
+    surface_js = ""
+    if surface is not None:
+        surface_js = _SURFACE_LEGEND_JS % {
+            "html": json.dumps(_surface_legend_html(surface["vmin"], surface["vmax"])),
+            "map": "map", "label": json.dumps(RAIN_SURFACE_LABEL)}
+    return _LEAFLET_PAGE.render(
+        leaflet_css=_LEAFLET_CSS, leaflet_js=_LEAFLET_JS, heat_js=_LEAFLET_HEAT_JS,
+        title_html=_TITLE_HTML, legend_html=_LEGEND_HTML, data=data_json,
+        surface_js=surface_js,
+    )
+
+
+# ── Main entry point ──────────────────────────────────────────────────────────
+
+def generate_map(summary: pd.DataFrame, output_dir: str, history: dict = None,
+                 layer_mode: str = "layers", cache_sparklines: bool = True,
+                 sparkline_backend: str = "matplotlib", charts: str = "inline",
+                 engine: str = "folium", rain_surface: bool = False) -> str:
+    """
+    Build a self-contained Folium/Leaflet HTML map of all stations.
+
+    Args:
+        summary   : Output of build_station_summary().
+        output_dir: Directory where map.html will be saved (created if missing).
+        history   : Optional output of build_station_history(). When provided,
+                    each station popup includes an embedded monthly history chart.
+        layer_mode: "layers" (one marker layer per variable) or "restyle"
+                    (one marker set restyled client-side; see LAYER_MODES).
+        cache_sparklines: Reuse history charts from sparkline_cache_dir(output_dir)
+                    for stations whose monthly history has not changed.
+        sparkline_backend: "matplotlib" or "pillow" (see SPARKLINE_BACKENDS).
+        charts    : "inline" embeds each history chart in its popup as base64;
+                    "sidecar" writes them to <map name>_files/ next to the map
+                    and popups load their chart only when opened.
+        engine    : "folium" (Folium object graph) or "leaflet" (direct writer:
+                    one GeoJSON FeatureCollection plus a fixed script).
+        rain_surface: Add the IDW-interpolated rainfall image overlay
+                    (RAIN_SURFACE_LABEL) with its colour bar. Opt-in; when
+                    added, the layer starts unchecked in the layer control.
+
+    Returns:
+        Absolute path to the saved map.html file.
+    """
+    if layer_mode not in LAYER_MODES:
+        raise ValueError(f"layer_mode must be one of {LAYER_MODES}, not {layer_mode!r}")
+    if charts not in CHART_MODES:
+        raise ValueError(f"charts must be one of {CHART_MODES}, not {charts!r}")
+    if engine not in MAP_ENGINES:
+        raise ValueError(f"engine must be one of {MAP_ENGINES}, not {engine!r}")
+    os.makedirs(output_dir, exist_ok=True)
+
+    run_date   = date.today().strftime('%Y%m%d')
+    data_month = pd.Timestamp(summary['last_fecha'].max()).strftime('%Y%m')
+    map_name   = f"mapa_{run_date}_{data_month}.html"
+
+    cache_dir = sparkline_cache_dir(output_dir) if cache_sparklines else None
+    sparklines = _build_sparklines(history, cache_dir, sparkline_backend) if history else {}
+    chart_urls = None
+    if charts == "sidecar":
+        if engine == "folium" and not POPUP_LAZY:
+            logging.warning(f"folium {folium.__version__} has no lazy popups: sidecar charts are "
+                            "still fetched on demand, but every popup is built at page load "
+                            "(upgrade folium or use engine='leaflet')")
+        chart_urls = _write_chart_assets(sparklines, output_dir, map_name[:-len(".html")] + "_files")
+        sparklines = {}
+
+    surface = _rain_surface(summary) if rain_surface else None
 
     out_path = os.path.join(output_dir, map_name)
+    if engine == "leaflet":
+        page = _leaflet_map_html(summary, layer_mode, sparklines, chart_urls, surface)
+        with open(out_path, "w", encoding="utf-8") as f:
+            f.write(page)
+        return os.path.abspath(out_path)
+
+    m = folium.Map(location=GUATEMALA_CENTER, zoom_start=DEFAULT_ZOOM, tiles=None)
+
+    # ── Base tile layers ─────────────────────────────────────────────────────
+    for name, url, attr, max_zoom in TILE_LAYERS:
+        folium.TileLayer(tiles=url, attr=attr, name=name, max_zoom=max_zoom).add_to(m)
+
+    # ── Variable marker layers (first one visible by default) ────────────────
+    if layer_mode == "restyle":
+        _add_restyle_markers(m, summary, sparklines, chart_urls)
+    else:
+        for i, var_key in enumerate(VARIABLES):
+            _add_variable_layer(m, summary, var_key, show=(i == 0),
+                                sparklines=sparklines, chart_urls=chart_urls)
+    if chart_urls is not None:
+        _LazyPopupImages().add_to(m)
+
+    # ── Precipitation heatmap (toggle) ───────────────────────────────────────
+    heat_data = _heat_points(summary)
+    if heat_data:
+        fg_heat = folium.FeatureGroup(name=HEATMAP_LABEL, show=False)
+        HeatMap(heat_data, **HEATMAP_OPTIONS).add_to(fg_heat)
+        fg_heat.add_to(m)
+
+    # ── Interpolated rainfall surface (toggle) ───────────────────────────────
+    if surface is not None:
+        folium.raster_layers.ImageOverlay(
+            image=surface["url"], bounds=surface["bounds"], opacity=RAIN_SURFACE_OPACITY,
+            name=RAIN_SURFACE_LABEL, show=False,
+        ).add_to(m)
+        _SurfaceLegend(surface["vmin"], surface["vmax"]).add_to(m)
+
+    # ── Layer control ────────────────────────────────────────────────────────
+    folium.LayerControl(collapsed=False).add_to(m)
+
+    # ── Title banner and legend hint ─────────────────────────────────────────
+    m.get_root().html.add_child(folium.Element(_TITLE_HTML))
+    m.get_root().html.add_child(folium.Element(_LEGEND_HTML))
+
     m.save(out_path)
     return os.path.abspath(out_path)
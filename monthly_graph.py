@@ -1,7 +1,13 @@
+import os
 import sys
 import logging
-import matplotlib
-matplotlib.use('Agg')   # force non-interactive backend before any pyplot import
+import multiprocessing
+
+# Non-interactive matplotlib backend for every later pyplot import (and the
+# rendering processes, which inherit the environment) without importing
+# matplotlib before the window is shown
+os.environ.setdefault("MPLBACKEND", "Agg")
+
 from PyQt6.QtWidgets import QApplication
 from gui import WeatherGraphsApp
 
@@ -22,4 +28,6 @@ def main():
     sys.exit(app.exec())
 
 if __name__ == "__main__":
+    # Rendering worker processes re-launch the frozen exe; let them exit here
+    multiprocessing.freeze_support()
     main()
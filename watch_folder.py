@@ -0,0 +1,298 @@
+"""
+watch_folder.py — Watch-folder service: graphs and map for every new export.
+
+Polls a directory for insivumeh_*.csv files. A file is taken once its size
+and modification time have stayed the same for `settle_seconds` (so copies
+still being written are not picked up half-way), then it is identified by the
+SHA-256 of its content and handed to a bounded job queue. Job threads run the
+same pipeline as the GUI and cli.py: graph_generation.generate_graphs() and
+map_viewer.generate_map().
+
+A content hash is processed at most once: renamed copies of a processed file
+are skipped, a changed file is a new job, and the record survives restarts
+because it lives in the status file (<output_dir>/watch_status.json, rewritten
+on every state change). Jobs that were queued or running when the service
+stopped are picked up again on the next start.
+
+Polling is used instead of OS change notifications: it needs no extra
+dependency, behaves the same on Windows shares and local disks, and one
+os.scandir() every few seconds is negligible next to a rendering run.
+
+Usage (see cli.py):
+    python cli.py watch --dir data --output salida [--once]
+"""
+
+import fnmatch
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+WATCH_PATTERN = "insivumeh_*.csv"
+POLL_INTERVAL = 2.0      # seconds between directory scans
+SETTLE_SECONDS = 5.0     # a file must be unchanged this long before it is processed
+QUEUE_SIZE = 8           # queued jobs; further files wait in the folder
+STATUS_NAME = "watch_status.json"
+HASH_BLOCK = 1 << 20
+
+# Job states recorded in the status file; FINAL_STATES are never run again
+FINAL_STATES = ("done", "failed")
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+class FolderWatcher:
+    """
+    Polling directory scanner with debounce.
+
+    poll() returns (path, signature) for every matching file whose
+    (size, mtime_ns) signature has been observed unchanged for settle_seconds
+    and has not been acknowledged yet. The caller acknowledges a file once it
+    has dealt with it; an unacknowledged file is reported again on later polls.
+    """
+
+    def __init__(self, directory, pattern=WATCH_PATTERN, settle_seconds=SETTLE_SECONDS,
+                 clock=time.monotonic):
+        self.directory = directory
+        self.pattern = pattern
+        self.settle_seconds = settle_seconds
+        self._clock = clock
+        self._seen = {}     # path -> (signature, monotonic time it was first seen)
+        self._acked = {}    # path -> signature already handled
+
+    def poll(self):
+        now = self._clock()
+        ready, present = [], set()
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError as e:
+            logging.warning(f"Cannot scan watch folder '{self.directory}': {e}")
+            return []
+        for entry in entries:
+            if not fnmatch.fnmatch(entry.name, self.pattern):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                st = entry.stat()
+            except OSError:
+                continue    # removed or locked between scandir and stat
+            signature = (st.st_size, st.st_mtime_ns)
+            present.add(entry.path)
+            seen = self._seen.get(entry.path)
+            if seen is None or seen[0] != signature:
+                self._seen[entry.path] = (signature, now)
+                continue
+            if (st.st_size and now - seen[1] >= self.settle_seconds
+                    and self._acked.get(entry.path) != signature):
+                ready.append((entry.path, signature))
+        for path in set(self._seen) - present:
+            del self._seen[path]
+            self._acked.pop(path, None)
+        return sorted(ready)
+
+    def acknowledge(self, path, signature):
+        self._acked[path] = signature
+
+    def pending(self):
+        """Files seen in the folder but not acknowledged yet (settling or waiting for queue room)."""
+        return sum(1 for path, (signature, _) in self._seen.items()
+                   if self._acked.get(path) != signature)
+
+
+class WatchService:
+    """
+    Watches `watch_dir` and renders graphs + map into `output_dir` for each new file.
+
+    concurrency job threads take jobs from a queue of at most queue_size
+    entries. Each job runs the graph stage, then the map stage; every stage
+    handles one file at a time (both write the same output folder, manifest
+    and sparkline cache), so with concurrency=2 the map of one file overlaps
+    the graphs of the next. The graphs themselves use `render_workers`
+    processes, as in generate_graphs().
+    """
+
+    def __init__(self, watch_dir, output_dir, pattern=WATCH_PATTERN, interval=POLL_INTERVAL,
+                 settle_seconds=SETTLE_SECONDS, concurrency=1, queue_size=QUEUE_SIZE,
+                 render_workers=None, html_mode="standalone", map_engine="folium"):
+        self.output_dir = output_dir
+        self.status_path = os.path.join(output_dir, STATUS_NAME)
+        self.interval = interval
+        self.concurrency = max(int(concurrency), 1)
+        self.render_workers = render_workers
+        self.html_mode = html_mode
+        self.map_engine = map_engine
+        self.watcher = FolderWatcher(watch_dir, pattern, settle_seconds)
+        self._queue = queue.Queue(maxsize=max(int(queue_size), 1))
+        self._lock = threading.Lock()
+        self._graph_lock = threading.Lock()
+        self._map_lock = threading.Lock()
+        self._running = 0
+        self._started = _now()
+        self.jobs = self._load_jobs()
+
+    # ── Status file ──────────────────────────────────────────────────────────
+
+    def _load_jobs(self):
+        """Finished jobs of earlier sessions; unfinished ones are dropped so they run again."""
+        try:
+            with open(self.status_path, encoding="utf-8") as f:
+                jobs = json.load(f).get("jobs", {})
+        except (OSError, ValueError, AttributeError):
+            return {}
+        return {digest: job for digest, job in jobs.items() if job.get("status") in FINAL_STATES}
+
+    def _write_status(self):
+        """Rewrite the status file; call with self._lock held."""
+        status = {
+            "watch_dir": os.path.abspath(self.watcher.directory),
+            "started": self._started,
+            "updated": _now(),
+            "queued": self._queue.qsize(),
+            "running": self._running,
+            "waiting_files": self.watcher.pending(),
+            "jobs": self.jobs,
+        }
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            tmp_path = f"{self.status_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(status, f, indent=1, ensure_ascii=False)
+            os.replace(tmp_path, self.status_path)
+        except OSError as e:
+            logging.warning(f"Could not write watch status '{self.status_path}': {e}")
+
+    def _update(self, digest, **fields):
+        with self._lock:
+            self.jobs[digest].update(fields)
+            self._write_status()
+
+    # ── Watching ─────────────────────────────────────────────────────────────
+
+    def poll_once(self):
+        """Scan the folder once and queue every settled, unseen file. Returns the number queued."""
+        queued = 0
+        with self._lock:
+            ready = self.watcher.poll()
+        for path, signature in ready:
+            try:
+                digest = file_sha256(path)
+            except OSError as e:
+                logging.warning(f"Cannot read '{path}', retrying on the next scan: {e}")
+                continue
+            with self._lock:
+                if digest in self.jobs:
+                    job = self.jobs[digest]
+                    if os.path.abspath(path) != job["file"]:
+                        logging.info(f"Skipping '{path}': same content as '{job['file']}' ({job['status']})")
+                    self.watcher.acknowledge(path, signature)
+                    continue
+                try:
+                    self._queue.put_nowait((digest, path))
+                except queue.Full:
+                    break   # stays unacknowledged: picked up again once there is room
+                self.jobs[digest] = {"file": os.path.abspath(path), "status": "queued",
+                                     "queued_at": _now()}
+                self.watcher.acknowledge(path, signature)
+                self._write_status()
+                queued += 1
+            logging.info(f"Queued '{path}'")
+        return queued
+
+    def idle(self):
+        """True when no file is waiting, queued or being processed."""
+        with self._lock:
+            # unfinished_tasks covers jobs taken from the queue but not done yet
+            return self._queue.unfinished_tasks == 0 and self.watcher.pending() == 0
+
+    def run(self, stop_event=None, once=False):
+        """
+        Poll until stop_event is set (or, with once=True, until every file
+        present has been processed). Job threads are joined before returning.
+        """
+        stop_event = stop_event or threading.Event()
+        threads = [threading.Thread(target=self._work, name=f"watch-job-{i}", daemon=True)
+                   for i in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        with self._lock:
+            self._write_status()
+        logging.info(f"Watching '{self.watcher.directory}' for {self.watcher.pattern}")
+        try:
+            while not stop_event.is_set():
+                self.poll_once()
+                if once and self.idle():
+                    break
+                stop_event.wait(self.interval)
+        finally:
+            # Jobs not started yet stay 'queued' in the status file and run on the next start
+            while True:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                self._queue.task_done()
+            for _ in threads:
+                self._queue.put((None, None))
+            for thread in threads:
+                thread.join()
+            with self._lock:
+                self._write_status()
+
+    # ── Jobs ─────────────────────────────────────────────────────────────────
+
+    def _work(self):
+        while True:
+            digest, path = self._queue.get()
+            if digest is None:
+                return
+            with self._lock:
+                self._running += 1
+            try:
+                self._process(digest, path)
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._write_status()
+                self._queue.task_done()
+
+    def _process(self, digest, path):
+        import graph_generation
+        import map_viewer
+
+        started = time.perf_counter()
+        self._update(digest, status="running", started_at=_now())
+        logging.info(f"Processing '{path}'")
+        try:
+            with self._graph_lock:
+                run_folder = graph_generation.generate_graphs(
+                    self.output_dir, path, workers=self.render_workers, html_mode=self.html_mode,
+                )
+            with self._map_lock:
+                summary = map_viewer.build_station_summary(path)
+                history = map_viewer.build_station_history(path)
+                map_path = map_viewer.generate_map(summary, self.output_dir, history,
+                                                   engine=self.map_engine)
+        except Exception as e:
+            logging.warning(f"Watch job for '{path}' failed: {e}")
+            self._update(digest, status="failed", error=str(e), finished_at=_now(),
+                         seconds=round(time.perf_counter() - started, 2))
+            return
+        seconds = round(time.perf_counter() - started, 2)
+        logging.info(f"Processed '{path}' in {seconds} s")
+        self._update(digest, status="done", run_folder=run_folder, map_path=map_path,
+                     stations=len(summary), finished_at=_now(), seconds=seconds)